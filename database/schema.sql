@@ -67,8 +67,11 @@ CREATE TABLE knowledge (
     title VARCHAR(255) NOT NULL,
     content TEXT NOT NULL,
     summary TEXT,  -- AI生成的摘要
-    source VARCHAR(50) DEFAULT 'manual',  -- chat:聊天提取 manual:手动添加 import:导入
+    source VARCHAR(50) DEFAULT 'manual',  -- chat:聊天提取 manual:手动添加 import:导入 web:网页
     source_id VARCHAR(100),  -- 来源ID（如消息ID）
+    source_url VARCHAR(2048),  -- 网页来源地址（source=web）
+    content_hash VARCHAR(64),  -- 正文 sha256，入库去重、网页重抓时判断内容是否变化
+    fetched_at TIMESTAMP,  -- 最近一次抓取时间
     tags JSONB DEFAULT '[]',  -- 标签数组
     embedding vector(1536),  -- OpenAI embedding 维度，其他模型可能不同
     token_count INT DEFAULT 0,
@@ -85,6 +88,8 @@ WITH (lists = 100);
 
 CREATE INDEX idx_knowledge_user ON knowledge(user_id, status);
 CREATE INDEX idx_knowledge_source ON knowledge(source);
+CREATE INDEX idx_knowledge_source_url ON knowledge(source_url);
+CREATE INDEX idx_knowledge_user_hash ON knowledge(user_id, content_hash);  -- 入库去重
 CREATE INDEX idx_knowledge_created ON knowledge(created_at DESC);
 
 -- 全文搜索索引（用于关键词搜索）
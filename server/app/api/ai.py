@@ -24,7 +24,7 @@ async def summarize(
     user_id: int = Depends(get_current_user_id)
 ):
     """AI总结内容"""
-    result = await ai_service.summarize(data.content)
+    result = await ai_service.summarize(data.content, user_id=user_id)
     return {"code": 0, "data": result}
 
 
@@ -34,7 +34,7 @@ async def generate_tags(
     user_id: int = Depends(get_current_user_id)
 ):
     """AI生成标签"""
-    tags = await ai_service.generate_tags(data.content)
+    tags = await ai_service.generate_tags(data.content, user_id=user_id)
     return {"code": 0, "data": {"tags": tags}}
 
 
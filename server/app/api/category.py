@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, func
+from sqlalchemy import select, update
 from pydantic import BaseModel
 from typing import Optional
 
 from app.core.database import get_db
 from app.core.security import get_current_user_id
-from app.models.knowledge import Category, Knowledge
+from app.models.knowledge import Category
 
 router = APIRouter()
 
@@ -30,14 +30,7 @@ async def list_categories(
     user_id: int = Depends(get_current_user_id),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取分类列表"""
-    count_result = await db.execute(
-        select(Knowledge.category_id, func.count().label("cnt"))
-        .where(Knowledge.user_id == user_id, Knowledge.status == 1)
-        .group_by(Knowledge.category_id)
-    )
-    count_map = {row[0]: row[1] for row in count_result.all() if row[0] is not None}
-
+    """获取分类列表（count 字段随知识增删同步维护）"""
     result = await db.execute(
         select(Category)
         .where(Category.user_id == user_id)
@@ -53,7 +46,7 @@ async def list_categories(
             "icon": c.icon,
             "color": c.color,
             "sortOrder": c.sort_order or 0,
-            "count": count_map.get(c.id, c.count or 0),
+            "count": c.count or 0,
         }
         for c in items
     ],
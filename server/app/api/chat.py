@@ -3,21 +3,20 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
 from pydantic import BaseModel
 from typing import Optional, List
-import re
+import logging
 
 from app.core.database import get_db
 from app.core.security import get_current_user_id
+from app.core.tracing import tracer
 from app.models.conversation import Conversation, Message
-from app.models.knowledge import Knowledge
 from app.services.ai_service import ai_service
+from app.services.counter_service import counter_service
+from app.services.dedup_service import dedup_service
+from app.services.intent import intent_detector, SEARCH
+from app.services.web_knowledge_service import web_knowledge_service
+from app.services.web_scraper import web_scraper
 
-# 保存指令（必须是短消息且主要是保存意图）
-SAVE_COMMANDS = [
-    '保存', '存一下', '存下', '记一下', '记下', '收藏', '入库', 
-    '帮我存', '帮我保存', '帮忙保存', '帮忙存', '存到知识库', 
-    '保存到知识库', '存入知识库', '这个保存', '保存这个',
-    '记录一下', '记录下来', '存下来', '保存下来'
-]
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -85,6 +84,7 @@ async def create_conversation(
     db.add(conversation)
     await db.commit()
     await db.refresh(conversation)
+    await counter_service.incr_user_stat(user_id, "conversation", 1)
     
     return {"code": 0, "data": {"id": conversation.id}}
 
@@ -96,12 +96,14 @@ async def delete_conversation(
     db: AsyncSession = Depends(get_db)
 ):
     """删除会话"""
-    await db.execute(
+    result = await db.execute(
         update(Conversation)
-        .where(Conversation.id == conversation_id, Conversation.user_id == user_id)
+        .where(Conversation.id == conversation_id, Conversation.user_id == user_id, Conversation.status == 1)
         .values(status=0)
     )
     await db.commit()
+    if result.rowcount > 0:
+        await counter_service.incr_user_stat(user_id, "conversation", -1)
     
     return {"code": 0, "message": "删除成功"}
 
@@ -117,10 +119,14 @@ async def delete_message(
     result = await db.execute(
         delete(Message)
         .where(Message.id == message_id, Message.user_id == user_id)
+        .returning(Message.role)
     )
+    deleted = result.first()
     await db.commit()
     
-    if result.rowcount > 0:
+    if deleted:
+        if deleted.role == "assistant":
+            await counter_service.incr_user_stat(user_id, "aiCalls", -1)
         return {"code": 0, "message": "删除成功"}
     else:
         return {"code": -1, "message": "消息不存在或无权限"}
@@ -194,52 +200,6 @@ async def get_messages(
     }
 
 
-def check_save_intent(message: str) -> dict:
-    """
-    检查消息是否是保存指令，返回解析结果
-    返回: {"is_save": bool, "type": str, "content": str}
-    - type: "specific" (有具体内容), "vague" (模糊指令), "last_reply" (保存上一条)
-    """
-    import re
-    msg = message.strip()
-    
-    # 检查是否包含保存关键词
-    save_keywords = ['保存', '记录', '记住', '存一下', '存下', '储存']
-    has_save_keyword = any(kw in msg for kw in save_keywords)
-    
-    if not has_save_keyword:
-        return {"is_save": False, "type": None, "content": None}
-    
-    # 包含查询相关词，不是保存指令
-    query_words = ['查', '找', '搜', '问', '什么', '怎么', '如何', '哪', '吗', '？', '?']
-    if any(word in msg for word in query_words):
-        return {"is_save": False, "type": None, "content": None}
-    
-    # 模式1: "帮我保存：xxx" 或 "保存：xxx" - 有具体内容
-    match = re.search(r'(?:帮我)?(?:保存|记录|记住|储存)[：:]\s*(.+)', msg, re.DOTALL)
-    if match:
-        content = match.group(1).strip()
-        if content and len(content) > 2:  # 内容足够长
-            return {"is_save": True, "type": "specific", "content": content}
-    
-    # 模式2: 模糊指令 - "保存以上内容"、"帮我记录这个"、"把这个存下"
-    vague_patterns = ['以上', '这个', '这些', '那个', '上面', '刚才', '这段']
-    if any(p in msg for p in vague_patterns):
-        return {"is_save": True, "type": "vague", "content": None}
-    
-    # 模式3: 简单保存指令 - "保存"、"帮我保存"、"保存上条"
-    last_reply_cmds = ['保存上条', '保存上一条', '存上条', '存上一条']
-    if any(cmd in msg for cmd in last_reply_cmds):
-        return {"is_save": True, "type": "last_reply", "content": None}
-    
-    if len(msg) <= 15:
-        for cmd in SAVE_COMMANDS:
-            if cmd in msg:
-                return {"is_save": True, "type": "last_reply", "content": None}
-    
-    return {"is_save": False, "type": None, "content": None}
-
-
 @router.post("")
 async def chat(
     data: ChatMessage,
@@ -256,15 +216,30 @@ async def chat(
         await db.commit()
         await db.refresh(conversation)
         conversation_id = conversation.id
+        await counter_service.incr_user_stat(user_id, "conversation", 1)
     
     # 检查是否是保存指令
-    save_intent = check_save_intent(data.message)
+    # 先读取用户 AI 配置：同时登记用户的扩展词表（每次对话都从数据库读取，其他进程保存的配置也能立即生效）
+    user_config = await ai_service.get_user_ai_config(db, user_id)
+    # 一次扫描得到全部指令意图（保存 / 检索）
+    intents = intent_detector.detect(data.message, user_id)
+    save_intent = intent_detector.save_intent(data.message, hits=intents)
     if save_intent["is_save"]:
         content_to_save = None
         save_title = None
         reply = None
         
-        if save_intent["type"] == "specific":
+        if save_intent["type"] == "specific" and web_scraper.is_valid_url(save_intent["content"]):
+            # 内容是网址：抓取网页正文保存
+            result = await web_knowledge_service.save_page(db, user_id, save_intent["content"].strip())
+            if result["success"]:
+                reply = f"已保存网页到知识库！\n标题：{result['title']}"
+                if result["status"] == "unchanged":
+                    reply = f"该网页已保存过，内容没有变化。\n标题：{result['title']}"
+            else:
+                reply = f"网页抓取失败：{result['error']}"
+            
+        elif save_intent["type"] == "specific":
             # 有具体内容，直接保存
             content_to_save = save_intent["content"]
             save_title = content_to_save[:50] + "..." if len(content_to_save) > 50 else content_to_save
@@ -303,32 +278,36 @@ async def chat(
             db.add(user_message)
             db.add(ai_message)
             await db.commit()
+            await counter_service.incr_user_stat(user_id, "aiCalls", 1)
             return {"code": 0, "data": {"conversationId": conversation_id, "reply": reply, "references": []}}
         
         # 保存到知识库
         if content_to_save:
             try:
-                embedding = await ai_service.get_embedding(content_to_save[:1000])
-                knowledge = Knowledge(
-                    user_id=user_id,
+                saved = await dedup_service.save(
+                    db, user_id,
                     title=save_title,
                     content=content_to_save,
                     source="chat",
                     tags=["AI对话"],
-                    embedding=embedding
+                    embedding_text=content_to_save[:1000],
+                    on_duplicate="skip"
                 )
-                db.add(knowledge)
+                if saved["status"] == "skipped":
+                    reply = f"知识库中已有相同或相似的内容，未重复保存。\n已有条目：{saved['title']}"
+                else:
+                    reply = f"已保存到知识库！\n内容：{save_title}"
                 
                 user_message = Message(conversation_id=conversation_id, user_id=user_id, role="user", content=data.message)
-                reply = f"已保存到知识库！\n内容：{save_title}"
                 ai_message = Message(conversation_id=conversation_id, user_id=user_id, role="assistant", content=reply)
                 db.add(user_message)
                 db.add(ai_message)
                 await db.commit()
+                await counter_service.incr_user_stat(user_id, "aiCalls", 1)
                 
                 return {"code": 0, "data": {"conversationId": conversation_id, "reply": reply, "references": []}}
             except Exception as e:
-                print(f"保存知识库失败: {e}")
+                logger.exception("保存知识库失败: %s", e)
         
         # 如果没有上一条消息，提示用户
         reply = "没有找到可保存的内容"
@@ -347,6 +326,7 @@ async def chat(
         )
         db.add(ai_message)
         await db.commit()
+        await counter_service.incr_user_stat(user_id, "aiCalls", 1)
         
         return {
             "code": 0,
@@ -401,6 +381,8 @@ async def chat(
         await db.flush()  # 获取消息ID
         user_msg_id = user_message.id
         await db.commit()
+        if data.aiReply:
+            await counter_service.incr_user_stat(user_id, "aiCalls", 1)
         
         return {
             "code": 0,
@@ -418,7 +400,9 @@ async def chat(
         user_id=user_id,
         conversation_id=conversation_id,
         message=data.message,
-        web_search=data.webSearch or False
+        web_search=data.webSearch or False,
+        search_intent=SEARCH in intents,
+        user_config=user_config
     )
     
     # 保存AI回复（含详细统计）
@@ -434,7 +418,12 @@ async def chat(
         model_name=ai_response.get("model_name", ""),
         provider=ai_response.get("provider", ""),
         cost=ai_response.get("cost", 0),
-        extra_data={"references": ai_response.get("references", [])}
+        extra_data={
+            "references": ai_response.get("references", []),
+            "timings": ai_response.get("timings", {}),
+            "pricingVersion": ai_response.get("pricing_version"),
+            "traceId": tracer.current_trace_id()
+        }
     )
     db.add(ai_message)
     
@@ -449,6 +438,7 @@ async def chat(
     )
     
     await db.commit()
+    await counter_service.incr_user_stat(user_id, "aiCalls", 1)
     
     return {
         "code": 0,
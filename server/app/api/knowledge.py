@@ -1,13 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, func, or_, text
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 
 from app.core.database import get_db
 from app.core.security import get_current_user_id
 from app.models.knowledge import Knowledge, Category
 from app.services.ai_service import ai_service
+from app.services.answer_cache import answer_cache
+from app.services.counter_service import counter_service
+from app.services.dedup_service import dedup_service, content_hash, ACTIONS
+from app.services.web_knowledge_service import web_knowledge_service
+from app.services.web_scraper import web_scraper
 
 router = APIRouter()
 
@@ -19,6 +24,7 @@ class KnowledgeCreate(BaseModel):
     source: Optional[str] = "manual"
     tags: Optional[List[str]] = []
     category_id: Optional[int] = None
+    on_duplicate: Optional[str] = None  # merge / skip / force，默认见 DEDUP_DEFAULT_ACTION
 
 
 class KnowledgeUpdate(BaseModel):
@@ -29,6 +35,17 @@ class KnowledgeUpdate(BaseModel):
     category_id: Optional[int] = None
 
 
+class KnowledgeFromUrl(BaseModel):
+    url: str
+    title: Optional[str] = None
+    category_id: Optional[int] = None
+
+
+class DedupRequest(BaseModel):
+    threshold: Optional[float] = Field(None, ge=0.5, le=1.0)
+    dry_run: bool = True
+
+
 class SearchRequest(BaseModel):
     query: Optional[str] = None
     keyword: Optional[str] = None
@@ -96,9 +113,10 @@ async def get_knowledge_detail(
     if not knowledge:
         raise HTTPException(status_code=404, detail="知识不存在")
     
-    # 更新浏览次数
+    # 更新浏览次数（不改变 updated_at，浏览不算内容更新）
     await db.execute(
-        update(Knowledge).where(Knowledge.id == knowledge_id).values(view_count=Knowledge.view_count + 1)
+        update(Knowledge).where(Knowledge.id == knowledge_id)
+        .values(view_count=Knowledge.view_count + 1, updated_at=Knowledge.updated_at)
     )
     await db.commit()
     
@@ -123,26 +141,37 @@ async def create_knowledge(
     user_id: int = Depends(get_current_user_id),
     db: AsyncSession = Depends(get_db)
 ):
-    """创建知识"""
-    # 生成向量
-    embedding = await ai_service.get_embedding(data.title + " " + data.content)
+    """创建知识（入库前检查重复，on_duplicate 决定重复时合并/跳过/强制保存）"""
+    if data.on_duplicate and data.on_duplicate not in ACTIONS:
+        raise HTTPException(status_code=400, detail=f"on_duplicate 可选：{'/'.join(ACTIONS)}")
     
-    knowledge = Knowledge(
-        user_id=user_id,
+    result = await dedup_service.save(
+        db, user_id,
         title=data.title,
         content=data.content,
         summary=data.summary,
         source=data.source,
         tags=data.tags,
         category_id=data.category_id,
-        embedding=embedding,
-        token_count=len(data.content)
+        on_duplicate=data.on_duplicate
     )
-    db.add(knowledge)
-    await db.commit()
-    await db.refresh(knowledge)
-    
-    return {"code": 0, "data": {"id": knowledge.id}, "message": "创建成功"}
+    messages = {"created": "创建成功", "merged": "已合并到相似的知识", "skipped": "已存在相似的知识，未重复保存"}
+    return {
+        "code": 0,
+        "data": {"id": result["id"], "status": result["status"], "duplicate": result["duplicate"]},
+        "message": messages[result["status"]]
+    }
+
+
+@router.post("/dedup")
+async def dedup_knowledge(
+    data: DedupRequest,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """批量去重已有知识（dry_run 时只返回分组，不删除）"""
+    result = await dedup_service.dedup_existing(db, user_id, data.threshold, data.dry_run)
+    return {"code": 0, "data": result}
 
 
 @router.put("/{knowledge_id}")
@@ -155,14 +184,27 @@ async def update_knowledge(
     """更新知识"""
     update_data = data.dict(exclude_unset=True)
     
-    # 如果内容变化，重新生成向量
-    if "content" in update_data or "title" in update_data:
-        result = await db.execute(select(Knowledge).where(Knowledge.id == knowledge_id))
+    knowledge = None
+    if "content" in update_data or "title" in update_data or "category_id" in update_data:
+        result = await db.execute(
+            select(Knowledge).where(Knowledge.id == knowledge_id, Knowledge.user_id == user_id)
+        )
         knowledge = result.scalar_one_or_none()
-        if knowledge:
-            new_title = update_data.get("title", knowledge.title)
-            new_content = update_data.get("content", knowledge.content)
-            update_data["embedding"] = await ai_service.get_embedding(new_title + " " + new_content)
+    
+    # 如果内容变化，重新生成向量
+    if knowledge and ("content" in update_data or "title" in update_data):
+        new_title = update_data.get("title", knowledge.title)
+        new_content = update_data.get("content", knowledge.content)
+        update_data["embedding"] = await ai_service.get_embedding(new_title + " " + new_content, user_id=user_id)
+        update_data["content_hash"] = content_hash(new_content)
+    
+    # 分类变化时同步分类计数
+    if knowledge and knowledge.status == 1 and "category_id" in update_data:
+        old_category_id = knowledge.category_id
+        new_category_id = update_data["category_id"]
+        if old_category_id != new_category_id:
+            await counter_service.adjust_category_count(db, old_category_id, -1)
+            await counter_service.adjust_category_count(db, new_category_id, 1)
     
     await db.execute(
         update(Knowledge)
@@ -170,6 +212,7 @@ async def update_knowledge(
         .values(**update_data)
     )
     await db.commit()
+    await answer_cache.invalidate([knowledge_id])
     
     return {"code": 0, "message": "更新成功"}
 
@@ -181,12 +224,19 @@ async def delete_knowledge(
     db: AsyncSession = Depends(get_db)
 ):
     """删除知识"""
-    await db.execute(
+    result = await db.execute(
         update(Knowledge)
-        .where(Knowledge.id == knowledge_id, Knowledge.user_id == user_id)
+        .where(Knowledge.id == knowledge_id, Knowledge.user_id == user_id, Knowledge.status == 1)
         .values(status=0)
+        .returning(Knowledge.category_id)
     )
+    deleted = result.first()
+    if deleted:
+        await counter_service.adjust_category_count(db, deleted.category_id, -1)
     await db.commit()
+    if deleted:
+        await counter_service.incr_user_stat(user_id, "knowledge", -1)
+        await answer_cache.invalidate([knowledge_id])
     
     return {"code": 0, "message": "删除成功"}
 
@@ -236,7 +286,8 @@ async def toggle_favorite(
     
     new_status = 0 if knowledge.is_favorite else 1
     await db.execute(
-        update(Knowledge).where(Knowledge.id == knowledge_id).values(is_favorite=new_status)
+        update(Knowledge).where(Knowledge.id == knowledge_id)
+        .values(is_favorite=new_status, updated_at=Knowledge.updated_at)
     )
     await db.commit()
     
@@ -252,3 +303,26 @@ async def create_from_chat(
     """从聊天创建知识"""
     data.source = "chat"
     return await create_knowledge(data, user_id, db)
+
+
+@router.post("/from-url")
+async def create_from_url(
+    data: KnowledgeFromUrl,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    """抓取网页保存为知识（同一网址重复保存时更新原记录）"""
+    url = data.url.strip()
+    if not web_scraper.is_valid_url(url):
+        raise HTTPException(status_code=400, detail="网址格式不正确")
+    
+    result = await web_knowledge_service.save_page(db, user_id, url, data.category_id, data.title)
+    if not result["success"]:
+        raise HTTPException(status_code=400, detail=f"网页抓取失败: {result['error']}")
+    
+    messages = {"created": "保存成功", "updated": "网页内容已更新", "unchanged": "网页内容未变化"}
+    return {
+        "code": 0,
+        "data": {"id": result["id"], "title": result["title"], "status": result["status"]},
+        "message": messages[result["status"]]
+    }
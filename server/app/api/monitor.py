@@ -1,14 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-from typing import Optional
-import json
-import uuid
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+import asyncio
 import psutil
 import os
 from datetime import datetime
 
-from app.core.redis import redis_client
-from app.core.security import get_current_user_id
+from app.core.config import settings
+from app.core.database import get_db
+from app.core.log_store import log_store, LOGS_KEY, ERRORS_KEY
+from app.core.loop_monitor import loop_monitor
+from app.core.security import get_current_user_id, get_admin_user_id
+from app.services.answer_cache import answer_cache
+from app.services.llm_cache import llm_cache
+from app.services.llm_router import llm_router
+from app.services.pricing import pricing_table
+from app.services.prompt_builder import prompt_builder
+from app.services.ai_scheduler import ai_scheduler
+from app.services.monitor_pipeline import monitor_pipeline, DEFAULT_CONFIG
+from app.services.monitor_service import monitor_service, MESSAGE_LIMIT, STATUSES
+from app.services.web_scraper import web_scraper
 from app.core.security_middleware import (
     get_security_events, get_security_stats, 
     get_blacklist, add_to_blacklist, remove_from_blacklist
@@ -16,13 +29,6 @@ from app.core.security_middleware import (
 
 router = APIRouter()
 
-# 系统日志存储（内存中，重启后清空）
-system_logs = []
-system_errors = []
-MAX_LOGS = 500
-
-LIST_LIMIT = 200
-
 
 class MonitorMessage(BaseModel):
     source: str
@@ -35,21 +41,43 @@ class UpdateStatus(BaseModel):
     status: str
 
 
-def _key(user_id: int) -> str:
-    return f"monitor:messages:{user_id}"
+class IncomingMessage(BaseModel):
+    source: Optional[str] = None
+    content: str
+    time: Optional[str] = None
+
+
+class IngestRequest(BaseModel):
+    messages: List[IncomingMessage] = Field(..., max_length=1000)
+
+
+class MonitorConfigUpdate(BaseModel):
+    enabled: Optional[bool] = None
+    keywords: Optional[List[str]] = None
+    autoSave: Optional[bool] = None
+    minLength: Optional[int] = Field(None, ge=0, le=10000)
+
+
+MAX_KEYWORDS = 500
+MAX_KEYWORD_LENGTH = 50
+
+
+def _check_status(status: Optional[str]):
+    if status is not None and status not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"无效的状态，可选：{'/'.join(STATUSES)}")
 
 
 @router.get("/messages")
-async def get_messages(user_id: int = Depends(get_current_user_id)):
-    key = _key(user_id)
-    data = await redis_client.lrange(key, 0, LIST_LIMIT - 1)
-    items = []
-    for item in data:
-        try:
-            items.append(json.loads(item))
-        except Exception:
-            continue
-    return {"code": 0, "data": items}
+async def get_messages(
+    status: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    size: int = Query(MESSAGE_LIMIT, ge=1, le=MESSAGE_LIMIT),
+    user_id: int = Depends(get_current_user_id)
+):
+    """获取监控消息（按时间倒序，可按状态过滤）"""
+    _check_status(status)
+    result = await monitor_service.list_messages(user_id, status, page, size)
+    return {"code": 0, "data": result["items"], "total": result["total"]}
 
 
 @router.post("/messages")
@@ -57,16 +85,9 @@ async def add_message(
     message: MonitorMessage,
     user_id: int = Depends(get_current_user_id),
 ):
-    key = _key(user_id)
-    item = {
-        "id": str(uuid.uuid4()),
-        "source": message.source,
-        "content": message.content,
-        "status": message.status or "pending",
-        "time": message.time or datetime.now().strftime("%H:%M")
-    }
-    await redis_client.lpush(key, json.dumps(item))
-    await redis_client.ltrim(key, 0, LIST_LIMIT - 1)
+    status = message.status or "pending"
+    _check_status(status)
+    item = await monitor_service.add_message(user_id, message.source, message.content, status, message.time)
     return {"code": 0, "data": item}
 
 
@@ -76,93 +97,116 @@ async def update_message(
     update: UpdateStatus,
     user_id: int = Depends(get_current_user_id),
 ):
-    key = _key(user_id)
-    data = await redis_client.lrange(key, 0, LIST_LIMIT - 1)
-    updated = False
-    new_list = []
-    for raw in data:
-        try:
-            obj = json.loads(raw)
-            if obj.get("id") == message_id:
-                obj["status"] = update.status
-                updated = True
-            new_list.append(json.dumps(obj))
-        except Exception:
-            new_list.append(raw)
-    if updated:
-        if new_list:
-            await redis_client.delete(key)
-            await redis_client.lpush(key, *new_list)
-        return {"code": 0, "message": "updated"}
-    raise HTTPException(status_code=404, detail="消息不存在")
+    _check_status(update.status)
+    item = await monitor_service.update_status(user_id, message_id, update.status)
+    if item is None:
+        raise HTTPException(status_code=404, detail="消息不存在")
+    return {"code": 0, "message": "updated"}
 
 
 @router.post("/messages/clear")
 async def clear_messages(user_id: int = Depends(get_current_user_id)):
-    key = _key(user_id)
-    await redis_client.delete(key)
+    await monitor_service.clear(user_id)
     return {"code": 0, "message": "cleared"}
 
 
-# ============ 系统监控 API ============
-
-def add_log(level: str, message: str):
-    """添加系统日志"""
-    global system_logs
-    log = {
-        "level": level,
-        "message": message,
-        "time": datetime.now().strftime("%H:%M:%S")
-    }
-    system_logs.insert(0, log)
-    if len(system_logs) > MAX_LOGS:
-        system_logs = system_logs[:MAX_LOGS]
-
-
-def add_error(error_type: str, message: str, stack: str = None):
-    """添加异常记录"""
-    global system_errors
-    err = {
-        "type": error_type,
-        "message": message,
-        "stack": stack,
-        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+@router.post("/messages/batch")
+async def ingest_messages(
+    request: IngestRequest,
+    user_id: int = Depends(get_current_user_id),
+):
+    """批量提交待监控的消息（异步处理：长度过滤、关键词匹配、去重、按配置自动入库）"""
+    if not settings.MONITOR_PIPELINE_ENABLED:
+        raise HTTPException(status_code=503, detail="消息监控采集未启用")
+    accepted = monitor_pipeline.submit(user_id, [m.model_dump() for m in request.messages])
+    return {"code": 0, "data": {"accepted": accepted, "rejected": len(request.messages) - accepted}}
+
+
+def _config_dict(config) -> dict:
+    if config is None:
+        return dict(DEFAULT_CONFIG)
+    return {
+        "enabled": config.enabled,
+        "keywords": config.keywords or [],
+        "autoSave": config.auto_save,
+        "minLength": config.min_length
     }
-    system_errors.insert(0, err)
-    if len(system_errors) > 100:
-        system_errors = system_errors[:100]
 
 
-# 初始化一些默认日志
-if not system_logs:
-    system_logs = [
-        {"level": "info", "message": "服务启动成功", "time": datetime.now().strftime("%H:%M:%S")},
-        {"level": "info", "message": "数据库连接成功", "time": datetime.now().strftime("%H:%M:%S")},
-        {"level": "info", "message": "Redis 连接成功", "time": datetime.now().strftime("%H:%M:%S")},
-    ]
+@router.get("/config")
+async def get_monitor_config(
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    config = await monitor_pipeline.get_config(db, user_id)
+    return {"code": 0, "data": _config_dict(config)}
+
+
+@router.put("/config")
+async def update_monitor_config(
+    update: MonitorConfigUpdate,
+    user_id: int = Depends(get_current_user_id),
+    db: AsyncSession = Depends(get_db)
+):
+    values = {}
+    if update.enabled is not None:
+        values["enabled"] = update.enabled
+    if update.autoSave is not None:
+        values["auto_save"] = update.autoSave
+    if update.minLength is not None:
+        values["min_length"] = update.minLength
+    if update.keywords is not None:
+        keywords = list(dict.fromkeys(k.strip() for k in update.keywords if k and k.strip()))
+        if len(keywords) > MAX_KEYWORDS:
+            raise HTTPException(status_code=400, detail=f"关键词最多 {MAX_KEYWORDS} 个")
+        if any(len(k) > MAX_KEYWORD_LENGTH for k in keywords):
+            raise HTTPException(status_code=400, detail=f"单个关键词不能超过 {MAX_KEYWORD_LENGTH} 个字符")
+        values["keywords"] = keywords
+    config = await monitor_pipeline.save_config(db, user_id, values)
+    return {"code": 0, "data": _config_dict(config)}
+
+
+# ============ 系统监控 API ============
+
+def _parse_levels(level: Optional[str]) -> Optional[set]:
+    if not level:
+        return None
+    return {item.strip().lower() for item in level.split(',') if item.strip()}
 
 
 @router.get("/logs")
-async def get_logs(page: int = 1, limit: int = 50):
-    """获取系统日志"""
-    start = (page - 1) * limit
-    end = start + limit
-    logs = system_logs[start:end]
-    return {"code": 0, "data": {"logs": logs, "total": len(system_logs)}}
+async def get_logs(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    level: Optional[str] = Query(None, description="级别过滤，逗号分隔，如 warning,error"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    admin_id: int = Depends(get_admin_user_id)
+):
+    """获取系统日志（所有进程，按时间倒序；cursor 传上一页返回的 nextCursor）"""
+    result = await log_store.read(LOGS_KEY, limit, cursor, _parse_levels(level), start, end)
+    return {"code": 0, "data": {"logs": result["items"], "nextCursor": result["nextCursor"], "total": result["total"]}}
 
 
 @router.get("/errors")
-async def get_errors(limit: int = 20):
-    """获取异常记录"""
-    errors = system_errors[:limit]
-    return {"code": 0, "data": {"errors": errors, "total": len(system_errors)}}
+async def get_errors(
+    limit: int = Query(20, ge=1, le=200),
+    cursor: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    admin_id: int = Depends(get_admin_user_id)
+):
+    """获取异常记录（含未捕获异常的堆栈）"""
+    result = await log_store.read(ERRORS_KEY, limit, cursor, None, start, end)
+    return {"code": 0, "data": {"errors": result["items"], "nextCursor": result["nextCursor"], "total": result["total"]}}
 
 
 @router.get("/stats")
 async def get_system_stats():
     """获取系统状态"""
     try:
-        cpu_percent = psutil.cpu_percent(interval=0.1)
+        # 不阻塞采样：返回与上一次调用之间的平均使用率（启动时已预热）
+        cpu_percent = psutil.cpu_percent(interval=None)
         memory = psutil.virtual_memory()
         disk = psutil.disk_usage('/')
         
@@ -184,7 +228,14 @@ async def get_system_stats():
                 "cpu": round(cpu_percent, 1),
                 "memory": round(memory.percent, 1),
                 "disk": round(disk.percent, 1),
-                "uptime": uptime
+                "uptime": uptime,
+                "llmCache": llm_cache.get_stats(),
+                "llmRoutes": llm_router.get_stats(),
+                "aiScheduler": ai_scheduler.get_stats(),
+                "webCache": web_scraper.get_stats(),
+                "monitorPipeline": monitor_pipeline.get_stats(),
+                "answerCache": answer_cache.get_stats(),
+                "promptBuilder": prompt_builder.get_stats()
             }
         }
     except Exception as e:
@@ -194,16 +245,22 @@ async def get_system_stats():
                 "cpu": 0,
                 "memory": 0,
                 "disk": 0,
-                "uptime": "未知"
+                "uptime": "未知",
+                "llmCache": llm_cache.get_stats(),
+                "llmRoutes": llm_router.get_stats(),
+                "aiScheduler": ai_scheduler.get_stats(),
+                "webCache": web_scraper.get_stats(),
+                "monitorPipeline": monitor_pipeline.get_stats(),
+                "answerCache": answer_cache.get_stats(),
+                "promptBuilder": prompt_builder.get_stats()
             }
         }
 
 
 @router.delete("/logs")
-async def clear_logs():
+async def clear_logs(admin_id: int = Depends(get_admin_user_id)):
     """清空日志"""
-    global system_logs
-    system_logs = []
+    await log_store.clear(LOGS_KEY)
     return {"code": 0, "message": "日志已清空"}
 
 
@@ -245,3 +302,52 @@ async def remove_blacklist_api(ip: str):
     """从黑名单移除IP"""
     remove_from_blacklist(ip)
     return {"code": 0, "message": f"IP {ip} 已从黑名单移除"}
+
+
+# ============ 事件循环诊断（管理员） ============
+
+@router.get("/loop/blocking")
+async def get_loop_blocking(limit: int = Query(20, ge=1, le=100), admin_id: int = Depends(get_admin_user_id)):
+    """最近的事件循环阻塞事件（耗时 + 阻塞时的调用栈）"""
+    return {
+        "code": 0,
+        "data": {
+            "thresholdMs": round(loop_monitor.threshold * 1000),
+            "events": loop_monitor.get_events(limit)
+        }
+    }
+
+
+# ============ 价格表（管理员） ============
+
+@router.get("/pricing")
+async def get_pricing(admin_id: int = Depends(get_admin_user_id)):
+    """当前加载的价格表版本"""
+    return {"code": 0, "data": pricing_table.get_info()}
+
+
+@router.post("/pricing/reload")
+async def reload_pricing(admin_id: int = Depends(get_admin_user_id)):
+    """重新加载价格文件（本进程立即生效，其他进程在 PRICING_CHECK_INTERVAL 内同步）"""
+    try:
+        info = pricing_table.reload()  # 文件很小，直接在事件循环中加载，避免与成本计算并发修改
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"code": 0, "message": "价格表已重新加载", "data": info}
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    all_threads: bool = False,
+    admin_id: int = Depends(get_admin_user_id)
+):
+    """按需采样分析，返回折叠栈（可直接交给 flamegraph.pl 或 speedscope）"""
+    if seconds > settings.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"采样时间不能超过 {settings.PROFILE_MAX_SECONDS} 秒")
+    # 采样在线程中进行，事件循环照常处理请求
+    output = await asyncio.to_thread(loop_monitor.profile, seconds, interval_ms / 1000, all_threads)
+    if output is None:
+        raise HTTPException(status_code=409, detail="已有采样分析正在进行")
+    return PlainTextResponse(output)
@@ -55,7 +55,7 @@ async def upload_and_parse_image(
     data_url = f"data:{mime_type};base64,{b64_data}"
     
     # 调用 AI 解析图片
-    result = await ai_service.parse_image(data_url, prompt)
+    result = await ai_service.parse_image(data_url, prompt, user_id=user_id)
     
     if result.get("success"):
         return {
@@ -65,7 +65,8 @@ async def upload_and_parse_image(
                 "model": result.get("model", ""),
                 "provider": result.get("provider", ""),
                 "input_tokens": result.get("input_tokens", 0),
-                "output_tokens": result.get("output_tokens", 0)
+                "output_tokens": result.get("output_tokens", 0),
+                "cost": round(result.get("cost", 0) / 10000, 4)  # 转换为元
             }
         }
     else:
@@ -98,7 +99,7 @@ async def upload_and_parse_file(
         raise HTTPException(status_code=400, detail="文件不能超过 30MB")
     
     # 调用文档解析
-    result = await ai_service.parse_document(content, filename, prompt)
+    result = await ai_service.parse_document(content, filename, prompt, user_id=user_id)
     
     if result.get("success"):
         return {
@@ -108,7 +109,8 @@ async def upload_and_parse_file(
                 "model": result.get("model", ""),
                 "provider": result.get("provider", ""),
                 "input_tokens": result.get("input_tokens", 0),
-                "output_tokens": result.get("output_tokens", 0)
+                "output_tokens": result.get("output_tokens", 0),
+                "cost": round(result.get("cost", 0) / 10000, 4)  # 转换为元
             }
         }
     else:
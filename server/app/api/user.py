@@ -3,15 +3,16 @@ from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 
 from app.core.database import get_db
 from app.core.security import verify_password, get_password_hash, create_access_token, get_current_user_id
 from app.core.security_middleware import record_login_attempt, get_client_ip
 from app.models.user import User
-from app.models.knowledge import Knowledge
-from app.models.conversation import Conversation, Message
+from app.models.conversation import Message
+from app.services.counter_service import counter_service
+from app.services.intent import intent_detector
 
 router = APIRouter()
 
@@ -68,6 +69,8 @@ class AIConfigUpdate(BaseModel):
     # 通用设置
     system_prompt: Optional[str] = None
     enable_rag: Optional[bool] = True
+    # 自定义指令词：{"save": [...], "search": [...]}，在内置词表基础上扩展
+    intent_keywords: Optional[Dict[str, List[str]]] = None
 
 
 @router.post("/register")
@@ -134,10 +137,9 @@ async def get_user_info(user_id: int = Depends(get_current_user_id), db: AsyncSe
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
-    # 获取知识数量
-    knowledge_count = await db.scalar(
-        select(func.count()).select_from(Knowledge).where(Knowledge.user_id == user_id, Knowledge.status == 1)
-    )
+    # 获取知识数量（计数缓存）
+    stats = await counter_service.get_user_stats(db, user_id)
+    knowledge_count = stats["knowledge"]
     
     return {
         "code": 0,
@@ -155,25 +157,11 @@ async def get_user_info(user_id: int = Depends(get_current_user_id), db: AsyncSe
 @router.get("/stats")
 async def get_stats(user_id: int = Depends(get_current_user_id), db: AsyncSession = Depends(get_db)):
     """获取统计数据"""
-    knowledge_count = await db.scalar(
-        select(func.count()).select_from(Knowledge).where(Knowledge.user_id == user_id, Knowledge.status == 1)
-    )
-    
-    conversation_count = await db.scalar(
-        select(func.count()).select_from(Conversation).where(Conversation.user_id == user_id, Conversation.status == 1)
-    )
-    
-    message_count = await db.scalar(
-        select(func.count()).select_from(Message).where(Message.user_id == user_id, Message.role == "assistant")
-    )
+    stats = await counter_service.get_user_stats(db, user_id)
     
     return {
         "code": 0,
-        "data": {
-            "knowledge": knowledge_count or 0,
-            "conversation": conversation_count or 0,
-            "aiCalls": message_count or 0
-        }
+        "data": stats
     }
 
 
@@ -199,6 +187,7 @@ async def save_ai_config(config: AIConfigUpdate, user_id: int = Depends(get_curr
     user.settings = json.dumps(current_settings)
     
     await db.commit()
+    intent_detector.remember_user(user_id, config.intent_keywords)
     
     return {"code": 0, "message": "配置已保存"}
 
@@ -224,6 +213,11 @@ async def get_ai_config(user_id: int = Depends(get_current_user_id), db: AsyncSe
     return {"code": 0, "data": ai_config}
 
 
+def _cache_hit_ratio(cached_tokens: Optional[int], input_tokens: Optional[int]) -> float:
+    """服务商前缀缓存命中的输入 token 占比"""
+    return round((cached_tokens or 0) / input_tokens, 3) if input_tokens else 0
+
+
 @router.get("/ai-usage")
 async def get_ai_usage(
     days: int = 1,
@@ -288,6 +282,7 @@ async def get_ai_usage(
             "inputTokens": row.input_tokens or 0,
             "outputTokens": row.output_tokens or 0,
             "cachedTokens": row.cached_tokens or 0,
+            "cacheHitRatio": _cache_hit_ratio(row.cached_tokens, row.input_tokens),
             "cost": round((row.cost or 0) / 10000, 4)  # 转换为元
         })
     
@@ -305,6 +300,7 @@ async def get_ai_usage(
                 "inputTokens": total_row.input_tokens or 0,
                 "outputTokens": total_row.output_tokens or 0,
                 "cachedTokens": total_row.cached_tokens or 0,
+                "cacheHitRatio": _cache_hit_ratio(total_row.cached_tokens, total_row.input_tokens),
                 "cost": round((total_row.cost or 0) / 10000, 4)  # 转换为元
             },
             "models": models
@@ -15,6 +15,7 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "your-secret-key-change-this"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+    ADMIN_USER_IDS: str = ""  # 管理员用户 ID，逗号分隔（可访问诊断接口）
     
     # 智谱AI (聊天 + Embedding + 视觉) - 免费模型
     ZHIPU_API_KEY: str = ""
@@ -29,13 +30,128 @@ class Settings(BaseSettings):
     QWEN_BASE_URL: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
     QWEN_CHAT_MODEL: str = "qwen-turbo"
     QWEN_DOC_MODEL: str = "qwen-doc-turbo"
+    DASHSCOPE_BASE_URL: str = "https://dashscope.aliyuncs.com"  # DashScope 原生协议地址
     
     # 腾讯云 COS (文件存储)
     COS_SECRET_ID: str = ""
     COS_SECRET_KEY: str = ""
     COS_BUCKET: str = ""
     COS_REGION: str = "ap-guangzhou"
+    COS_DOMAIN: str = ""  # 自定义访问域名（如压测时指向本地模拟服务 127.0.0.1:9100），为空时使用默认域名
+    COS_SCHEME: str = "https"
     
+    # 总结/标签响应缓存
+    LLM_CACHE_TTL: int = 3600  # 秒
+    LLM_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+
+    # 模型路由（故障转移 + 熔断 + 对冲请求）
+    LLM_FAILOVER_ENABLED: bool = True
+    LLM_OWN_KEY_FAILOVER: bool = False  # 用户自带密钥的请求失败时是否转移到平台密钥（费用由平台承担）
+    LLM_BREAKER_FAILURES: int = 5  # 连续失败多少次熔断
+    LLM_BREAKER_COOLDOWN: float = 30.0  # 熔断冷却时间（秒）
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_PERCENTILE: float = 0.95  # 超过该延迟分位数仍未返回则发起对冲请求
+
+    # 上游调用准入调度
+    AI_MAX_CONCURRENCY: int = 20  # 全局并发上限
+    AI_USER_MAX_CONCURRENCY: int = 3  # 单用户并发上限
+    AI_PROVIDER_LIMITS: str = "zhipu:300:1000000,qwen:300:1000000"  # 服务商:RPM:TPM
+    AI_QUEUE_TIMEOUT: float = 60.0  # 排队超时（秒）
+
+    # 网页抓取缓存
+    WEB_CACHE_FRESH_TTL: int = 600  # 新鲜期内直接使用缓存（秒）
+    WEB_CACHE_TTL: int = 86400  # 过期后带条件请求重新验证，超过该时间彻底删除
+    WEB_CACHE_NEGATIVE_TTL: int = 60  # 抓取失败的缓存时间
+    WEB_CACHE_MAX_ENTRIES: int = 2000
+    WEB_FETCH_MAX_BYTES: int = 2 * 1024 * 1024  # 单个页面最多下载的字节数
+    WEB_FETCH_TEXT_MULTIPLE: int = 4  # 提取到的可见文本达到正文上限的多少倍后停止下载
+    WEB_FETCH_MAX_URLS: int = 5  # 一条消息最多抓取的网页数
+    WEB_FETCH_CONCURRENCY: int = 5  # 单条消息的并发抓取数
+    WEB_FETCH_PER_HOST: int = 2  # 同一域名的并发抓取数
+    WEB_CONTEXT_TOKEN_BUDGET: int = 6000  # 合并后网页内容的 token 预算
+    HTML_EXTRACTOR_ENGINE: str = "auto"  # auto/lxml/stdlib，auto 时优先使用 lxml
+
+    # 网页知识重抓
+    WEB_RECRAWL_ENABLED: bool = True
+    WEB_RECRAWL_INTERVAL: int = 86400  # 网页保存多久后重新抓取（秒）
+    WEB_RECRAWL_CHECK_INTERVAL: int = 600  # 后台检查间隔（秒）
+    WEB_RECRAWL_BATCH: int = 20  # 每次最多重抓的网址数
+    WEB_RECRAWL_FETCH_TIMEOUT: float = 35.0
+
+    # 知识入库去重
+    DEDUP_ENABLED: bool = True
+    DEDUP_SIMILARITY_THRESHOLD: float = 0.95  # 向量余弦相似度不低于该值视为重复
+    DEDUP_DEFAULT_ACTION: str = "skip"  # 未指定时的处理方式：merge / skip / force
+    DEDUP_NEIGHBORS: int = 5  # 批量去重时每条比较的近邻数
+
+    # 模型价格表
+    PRICING_FILE: str = "pricing.json"  # 相对路径以 server 目录为基准
+    PRICING_CHECK_INTERVAL: int = 60  # 检查价格文件是否变化的间隔（秒）
+
+    # 对话提示词 token 预算
+    PROMPT_TOKENIZER: str = "auto"  # auto（安装了 tiktoken 时按编码计数）/ heuristic（按字符估算）
+    PROMPT_CONTEXT_WINDOWS: str = ""  # 按模型设置上下文窗口，如 "glm-4-flash=128000,qwen-turbo=131072"
+    PROMPT_DEFAULT_CONTEXT_WINDOW: int = 32768
+    PROMPT_MAX_INPUT_TOKENS: int = 8000  # 输入 token 上限（控制成本，低于上下文窗口时以此为准）
+    PROMPT_SHARES: str = "web=0.5,knowledge=0.3,history=0.2"  # 各来源的预算比例，用不完的分给其他来源
+    PROMPT_TEMPLATE_RESERVE: int = 300  # 为提示词模板预留的 token 数
+    PROMPT_LAYOUT: str = "cache"  # cache（稳定前缀在前，参考内容随当前消息发送）/ legacy（参考内容放在系统提示词中）
+    PROMPT_CACHE_HINT_PROVIDERS: str = "qwen"  # 支持显式缓存标记（cache_control）的服务商
+    PROMPT_CACHE_MIN_TOKENS: int = 1024  # 稳定前缀不少于该长度才加缓存标记（服务商的最小缓存长度）
+
+    # 知识库问答缓存（相同引用下的相似问题直接复用回答）
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIMILARITY: float = 0.95  # 问题向量余弦相似度不低于该值视为同一问题
+    ANSWER_CACHE_BUCKET_SIZE: int = 20  # 每个桶最多保留的问题数
+    ANSWER_CACHE_TTL: int = 86400  # 缓存过期时间（秒）
+
+    # 消息监控采集（关键词匹配 + 自动入库）
+    MONITOR_PIPELINE_ENABLED: bool = True
+    MONITOR_QUEUE_SIZE: int = 10000  # 待处理消息队列上限，满时拒收
+    MONITOR_BATCH_SIZE: int = 200  # 每批最多处理的消息数
+    MONITOR_BATCH_WAIT: float = 0.5  # 凑批最多等待（秒）
+    MONITOR_EMBED_BATCH: int = 32  # 自动入库时每次向量化的条数
+    MONITOR_DEDUP_TTL: int = 86400  # 重复内容判定窗口（秒）
+    MONITOR_CONFIG_TTL: int = 60  # 用户监控配置在进程内的缓存时间（秒）
+
+    # 监控指标（/metrics）
+    METRICS_ENABLED: bool = True
+
+    # 事件循环阻塞检测
+    LOOP_MONITOR_ENABLED: bool = True
+    LOOP_LAG_INTERVAL: float = 0.5  # 心跳间隔（秒）
+    LOOP_BLOCK_THRESHOLD: float = 0.25  # 阻塞超过该时间记录调用栈（秒）
+    LOOP_BLOCK_EVENTS: int = 50  # 保留最近多少条阻塞事件
+    PROFILE_MAX_SECONDS: int = 60  # 采样分析最长时间
+
+    # 日志
+    LOG_LEVEL: str = "INFO"
+    LOG_LEVELS: str = ""  # 按模块设置级别，如 "app.services.ai_service=DEBUG,sqlalchemy.engine=INFO"
+    LOG_FORMAT: str = "json"  # json/text
+    LOG_FILE: str = ""  # 为空时只输出到标准输出
+    LOG_QUEUE_SIZE: int = 10000  # 待写出日志上限，满了丢弃
+    LOG_DEBUG_SAMPLE_RATE: float = 1.0  # DEBUG 日志采样比例
+    LOG_RATE_LIMIT_BURST: int = 20  # 同一代码位置每个窗口最多输出的条数（ERROR 不限）
+    LOG_RATE_LIMIT_WINDOW: float = 10.0  # 限流窗口（秒）
+    DB_ECHO: bool = False  # 打印所有 SQL（同步输出，仅用于本地调试）
+    SLOW_QUERY_MS: int = 500  # 超过该耗时的 SQL 记录为慢查询
+
+    # 系统日志存储（Redis Stream，供监控接口查询）
+    LOG_STORE_ENABLED: bool = True
+    LOG_STORE_LEVEL: str = "INFO"
+    LOG_STORE_MAX_LOGS: int = 5000
+    LOG_STORE_MAX_ERRORS: int = 1000
+    LOG_STORE_FLUSH_INTERVAL: float = 1.0  # 批量写入间隔（秒）
+
+    # 链路追踪
+    TRACE_EXPORTER: str = ""  # 空为不导出（仍生成 trace_id），file/otlp
+    TRACE_SAMPLE_RATE: float = 1.0
+    TRACE_FILE: str = "traces.jsonl"
+    TRACE_OTLP_ENDPOINT: str = "http://127.0.0.1:4318"  # OTLP/HTTP 接收地址
+    TRACE_SERVICE_NAME: str = "ai-knowledge-base"
+    TRACE_QUEUE_SIZE: int = 10000  # 待导出 span 上限
+    TRACE_FLUSH_INTERVAL: float = 2.0  # 导出间隔（秒）
+
     class Config:
         env_file = ".env"
 
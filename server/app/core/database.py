@@ -1,16 +1,58 @@
+import logging
+import time
+
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import text
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import text, exc, event
 from .config import settings
+from .metrics import DB_POOL_CHECKOUT, DB_POOL_TIMEOUTS
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+slow_query_logger = logging.getLogger("app.db.slow")
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """统计从连接池取连接的等待时间（连接池满时排队）"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            DB_POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            DB_POOL_CHECKOUT.observe(time.perf_counter() - start)
+
 
 engine = create_async_engine(
     settings.DATABASE_URL,
-    echo=settings.DEBUG,
+    echo=settings.DB_ECHO,
+    poolclass=TimedQueuePool,
     pool_pre_ping=True,
     pool_size=10,
     max_overflow=20
 )
 
+tracer.instrument_engine(engine.sync_engine)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _query_start(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _query_end(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - context._query_start) * 1000
+    if elapsed_ms >= settings.SLOW_QUERY_MS:
+        slow_query_logger.warning(
+            "慢查询 %.0fms: %s", elapsed_ms, statement[:1000],
+            extra={"duration_ms": round(elapsed_ms)}
+        )
+
 AsyncSessionLocal = async_sessionmaker(
     engine,
     class_=AsyncSession,
@@ -19,6 +61,15 @@ AsyncSessionLocal = async_sessionmaker(
 
 Base = declarative_base()
 
+# 已有数据库的增量字段
+SCHEMA_UPGRADES = [
+    "ALTER TABLE knowledge ADD COLUMN IF NOT EXISTS source_url VARCHAR(2048)",
+    "ALTER TABLE knowledge ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE knowledge ADD COLUMN IF NOT EXISTS fetched_at TIMESTAMP",
+    "CREATE INDEX IF NOT EXISTS idx_knowledge_source_url ON knowledge (source_url)",
+    "CREATE INDEX IF NOT EXISTS idx_knowledge_user_hash ON knowledge (user_id, content_hash)",
+]
+
 
 async def get_db():
     async with AsyncSessionLocal() as session:
@@ -33,11 +84,14 @@ async def init_db():
     try:
         async with engine.begin() as conn:
             await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
-            print("✅ pgvector 扩展已启用")
+            logger.info("pgvector 扩展已启用")
     except Exception as e:
-        print(f"⚠️ pgvector 扩展未安装，向量搜索功能将不可用")
+        logger.warning("pgvector 扩展未安装，向量搜索功能将不可用: %s", e)
     
     # 再创建表
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    print("✅ 数据库表创建完成")
+        # create_all 不会给已有表加列，新增字段在这里补齐（幂等）
+        for statement in SCHEMA_UPGRADES:
+            await conn.execute(text(statement))
+    logger.info("数据库表创建完成")
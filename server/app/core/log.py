@@ -0,0 +1,180 @@
+"""日志
+
+- 所有日志先进入内存队列（QueueHandler），由后台线程写出，请求路径上不做 IO；队列满时丢弃并计数
+- JSON（默认）或文本格式，带 trace_id（与链路追踪、X-Trace-Id 响应头一致，用于关联同一请求的所有日志）
+- 按模块设置级别：LOG_LEVELS="app.services.ai_service=DEBUG,sqlalchemy.engine=INFO"
+- DEBUG 日志按比例采样；同一代码位置的日志按时间窗口限流，被抑制的条数附在窗口后的第一条日志上
+- 业务代码统一使用 logging.getLogger(__name__)，参数用 %s 占位延迟格式化
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .config import settings
+from .tracing import TraceIdFilter
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s %(name)s [trace=%(trace_id)s] %(message)s'
+SECURITY_LOG_FILE = 'security.log'
+SECURITY_FORMAT = '%(asctime)s - %(levelname)s - [trace=%(trace_id)s] %(message)s'
+
+_RESERVED = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'trace_id', 'suppressed'}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'trace_id': None if getattr(record, 'trace_id', '-') == '-' else record.trace_id,
+        }
+        # logger.info(..., extra={...}) 传入的结构化字段
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith('_'):
+                data[key] = value
+        if getattr(record, 'suppressed', 0):
+            data['suppressed'] = record.suppressed
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """DEBUG 采样 + 按代码位置限流（ERROR 及以上不受限制）"""
+
+    def __init__(self, debug_sample_rate: float = 1.0, burst: int = 20, window: float = 10.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+        self.burst = burst
+        self.window = window
+        self._windows: Dict[tuple, List] = {}  # (文件, 行号) -> [窗口开始时间, 已输出条数, 已抑制条数]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        if record.levelno <= logging.DEBUG and self.debug_sample_rate < 1.0 \
+                and random.random() >= self.debug_sample_rate:
+            return False
+        if self.burst <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            state = self._windows.get(key)
+            if state is None or now - state[0] >= self.window:
+                if state and state[2]:
+                    record.suppressed = state[2]
+                state = self._windows[key] = [now, 0, 0]
+            if state[1] >= self.burst:
+                state[2] += 1
+                return False
+            state[1] += 1
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """入队前在调用方线程完成消息格式化（trace_id 等上下文只在调用方可见），队列满时丢弃"""
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_type = record.exc_info[0].__name__
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            text += f" (此前 {record.suppressed} 条相同位置的日志被限流)"
+        return text
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[_QueueHandler] = None
+
+
+def _parse_levels(value: str) -> Dict[str, str]:
+    levels = {}
+    for item in value.split(','):
+        name, _, level = item.strip().partition('=')
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(extra_handlers: Optional[List[logging.Handler]] = None):
+    """初始化日志（幂等），应用启动时调用一次；extra_handlers 同样运行在日志线程中"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    formatter = JsonFormatter() if settings.LOG_FORMAT == 'json' else _TextFormatter(TEXT_FORMAT)
+    handlers = []
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(formatter)
+    handlers.append(stream)
+    if settings.LOG_FILE:
+        file_handler = logging.handlers.RotatingFileHandler(
+            settings.LOG_FILE, maxBytes=50 * 1024 * 1024, backupCount=5, encoding='utf-8'
+        )
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    # 安全事件单独写一份文件（原来由安全中间件同步写入）
+    security_handler = logging.handlers.RotatingFileHandler(
+        SECURITY_LOG_FILE, maxBytes=20 * 1024 * 1024, backupCount=3, encoding='utf-8'
+    )
+    security_handler.setFormatter(_TextFormatter(SECURITY_FORMAT))
+    security_handler.addFilter(logging.Filter('security'))
+    handlers.append(security_handler)
+    handlers.extend(extra_handlers or [])
+
+    _queue_handler = _QueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(TraceIdFilter())
+    _queue_handler.addFilter(SamplingFilter(
+        settings.LOG_DEBUG_SAMPLE_RATE, settings.LOG_RATE_LIMIT_BURST, settings.LOG_RATE_LIMIT_WINDOW
+    ))
+
+    root = logging.getLogger()
+    root.handlers = [_queue_handler]
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name, level in _parse_levels(settings.LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_dropped() -> int:
+    return _queue_handler.dropped if _queue_handler else 0
@@ -0,0 +1,152 @@
+"""系统日志 / 异常存储（Redis Stream）
+
+- 日志线程里的 handler 只把记录追加到内存缓冲，后台任务每秒批量 XADD（一个 pipeline）
+- 两个流：monitor:logs（INFO 及以上）和 monitor:errors（ERROR 及以上或带异常堆栈），
+  写入时按 MAXLEN 近似裁剪，相当于环形缓冲；所有进程写同一个流，监控接口看到的是整个集群的日志
+- 读取按流 ID（毫秒时间戳）倒序翻页：cursor 为上一页最后一条的 ID，支持级别和时间范围过滤
+"""
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from .config import settings
+from .redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+LOGS_KEY = "monitor:logs"
+ERRORS_KEY = "monitor:errors"
+MAX_MESSAGE_LENGTH = 2000
+MAX_STACK_LENGTH = 8000
+MAX_SCAN = 5000  # 带级别过滤时单次请求最多扫描的条数
+
+
+class _StoreHandler(logging.Handler):
+    """运行在日志线程中，只做内存追加（deque.append 线程安全）"""
+
+    def __init__(self, store: 'LogStore', level: str):
+        super().__init__(level)
+        self.store = store
+
+    def emit(self, record: logging.LogRecord):
+        # 写入失败产生的日志不再回写，避免循环
+        if record.name == __name__:
+            return
+        try:
+            entry = {
+                "level": record.levelname.lower(),
+                "logger": record.name,
+                "message": record.getMessage()[:MAX_MESSAGE_LENGTH],
+                "time": datetime.fromtimestamp(record.created).strftime("%Y-%m-%d %H:%M:%S"),
+                "trace_id": getattr(record, "trace_id", "-"),
+            }
+            if len(self.store.pending_logs) == self.store.pending_logs.maxlen:
+                self.store.dropped += 1
+            self.store.pending_logs.append(entry)
+            if record.levelno >= logging.ERROR or record.exc_text:
+                error = {
+                    **entry,
+                    "type": getattr(record, "exc_type", None) or record.levelname,
+                    "stack": (record.exc_text or "")[:MAX_STACK_LENGTH],
+                }
+                self.store.pending_errors.append(error)
+        except Exception:
+            self.handleError(record)
+
+
+class LogStore:
+    def __init__(self):
+        buffer_size = settings.LOG_STORE_MAX_LOGS
+        self.pending_logs: deque = deque(maxlen=buffer_size)
+        self.pending_errors: deque = deque(maxlen=buffer_size)
+        self.dropped = 0
+        self.handler = _StoreHandler(self, settings.LOG_STORE_LEVEL.upper())
+
+    # ============ 写入 ============
+
+    @staticmethod
+    def _drain(buffer: deque) -> List[Dict]:
+        items = []
+        while buffer:
+            items.append(buffer.popleft())
+        return items
+
+    async def flush(self):
+        logs = self._drain(self.pending_logs)
+        errors = self._drain(self.pending_errors)
+        if logs:
+            await redis_client.xadd_many(LOGS_KEY, logs, settings.LOG_STORE_MAX_LOGS)
+        if errors:
+            await redis_client.xadd_many(ERRORS_KEY, errors, settings.LOG_STORE_MAX_ERRORS)
+
+    async def run_flusher(self):
+        """后台写入循环"""
+        try:
+            while True:
+                await asyncio.sleep(settings.LOG_STORE_FLUSH_INTERVAL)
+                try:
+                    await self.flush()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("写入日志存储失败: %s", e)
+        finally:
+            try:
+                await self.flush()
+            except Exception:
+                pass
+
+    # ============ 读取 ============
+
+    @staticmethod
+    def _stream_id(value: datetime) -> str:
+        return str(int(value.timestamp() * 1000))
+
+    async def read(
+        self,
+        key: str,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        levels: Optional[Set[str]] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> Dict:
+        """倒序读取，返回 {items, nextCursor, total}；nextCursor 为 None 表示没有更多"""
+        max_id = f"({cursor}" if cursor else (self._stream_id(end) if end else "+")
+        min_id = self._stream_id(start) if start else "-"
+        # 带过滤时多读一些，减少往返
+        chunk = limit if not levels else min(max(limit * 4, 100), 1000)
+        items: List[Dict] = []
+        scanned = 0
+        last_id = None
+        exhausted = False
+        while len(items) < limit and scanned < MAX_SCAN:
+            batch = await redis_client.xrevrange(key, max_id, min_id, count=chunk)
+            for entry_id, fields in batch:
+                scanned += 1
+                last_id = entry_id
+                if levels and fields.get("level") not in levels:
+                    continue
+                items.append({"id": entry_id, **fields})
+                if len(items) >= limit:
+                    break
+            if len(items) >= limit:
+                break
+            if len(batch) < chunk:
+                # 已读到范围末尾
+                exhausted = True
+                break
+            max_id = f"({last_id}"
+        return {
+            "items": items,
+            "nextCursor": None if exhausted else last_id,
+            "total": await redis_client.xlen(key)
+        }
+
+    async def clear(self, key: str):
+        await redis_client.delete(key)
+
+
+log_store = LogStore()
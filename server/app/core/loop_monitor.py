@@ -0,0 +1,158 @@
+"""事件循环阻塞检测 + 采样分析
+
+- 心跳任务：每隔 interval 在事件循环中 sleep 一次，实际多等的时间即调度延迟（同时上报 Prometheus）
+- 看门狗线程：心跳超过阈值没有更新，说明某个回调正在阻塞事件循环，
+  此时对事件循环线程的调用栈采样，阻塞结束后记录一条事件（耗时 + 出现最多的调用栈）
+- 按需采样分析：在单独线程中定时采样调用栈，输出 flamegraph.pl / speedscope 可直接读取的折叠栈格式
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .config import settings
+from .metrics import EVENT_LOOP_LAG, EVENT_LOOP_LAG_LAST, EVENT_LOOP_BLOCKS
+
+MAX_STACK_DEPTH = 64
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def collapse_stack(frame) -> str:
+    """把调用栈折叠成 "外层;...;内层" 形式"""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+def format_stack(frame) -> List[str]:
+    """可读的调用栈（内层在最后），用于阻塞事件"""
+    lines = []
+    while frame is not None and len(lines) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        lines.append(f"{code.co_filename}:{frame.f_lineno} in {code.co_name}")
+        frame = frame.f_back
+    return list(reversed(lines))
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = 0.5, threshold: float = 0.25, max_events: int = 50):
+        self.interval = interval
+        self.threshold = threshold
+        self.events: deque = deque(maxlen=max_events)
+        self._loop_thread_id: Optional[int] = None
+        self._beat = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._profile_lock = threading.Lock()
+
+    # ============ 生命周期 ============
+
+    def start(self):
+        """在事件循环线程中调用"""
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    # ============ 心跳 / 看门狗 ============
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - start - self.interval)
+            EVENT_LOOP_LAG.observe(lag)
+            EVENT_LOOP_LAG_LAST.set(lag)
+            self._beat = time.monotonic()
+
+    def _watch(self):
+        # 心跳本身每 interval 更新一次，超过 interval + threshold 没有更新才算阻塞
+        limit = self.interval + self.threshold
+        check_every = min(self.threshold / 2, 0.05)
+        blocked_since: Optional[float] = None
+        stacks: Counter = Counter()
+        readable: Dict[str, List[str]] = {}
+        while not self._stop.wait(check_every):
+            silent = time.monotonic() - self._beat
+            if silent > limit:
+                if blocked_since is None:
+                    blocked_since = self._beat + self.interval
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    key = collapse_stack(frame)
+                    stacks[key] += 1
+                    if key not in readable:
+                        readable[key] = format_stack(frame)
+                continue
+            if blocked_since is not None:
+                self._record(time.monotonic() - blocked_since, stacks, readable)
+                blocked_since = None
+                stacks = Counter()
+                readable = {}
+
+    def _record(self, duration: float, stacks: Counter, readable: Dict[str, List[str]]):
+        EVENT_LOOP_BLOCKS.inc()
+        top = stacks.most_common(1)
+        self.events.appendleft({
+            'time': datetime.now().isoformat(),
+            'durationMs': round(duration * 1000),
+            'samples': sum(stacks.values()),
+            'stack': readable.get(top[0][0], []) if top else [],
+            'collapsed': [f"{key} {count}" for key, count in stacks.most_common(5)]
+        })
+
+    def get_events(self, limit: int = 50) -> List[dict]:
+        return list(self.events)[:limit]
+
+    # ============ 采样分析 ============
+
+    def profile(self, seconds: float, interval: float = 0.005, all_threads: bool = False) -> Optional[str]:
+        """阻塞采样 seconds 秒（需在线程池中调用），返回折叠栈文本；已有分析在进行时返回 None"""
+        if not self._profile_lock.acquire(blocking=False):
+            return None
+        try:
+            me = threading.get_ident()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            counts: Counter = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == me:
+                        continue
+                    if not all_threads and thread_id != self._loop_thread_id:
+                        continue
+                    key = collapse_stack(frame)
+                    if all_threads:
+                        key = f"{names.get(thread_id, thread_id)};{key}"
+                    counts[key] += 1
+                time.sleep(interval)
+            return '\n'.join(f"{key} {count}" for key, count in counts.most_common()) + '\n'
+        finally:
+            self._profile_lock.release()
+
+
+loop_monitor = LoopMonitor(
+    interval=settings.LOOP_LAG_INTERVAL,
+    threshold=settings.LOOP_BLOCK_THRESHOLD,
+    max_events=settings.LOOP_BLOCK_EVENTS
+)
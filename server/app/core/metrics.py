@@ -0,0 +1,236 @@
+"""Prometheus 指标
+
+- 请求路径上只做计数器/直方图的原子累加，不做任何阻塞采样
+- 缓存命中、调度队列、熔断状态、连接池占用等已有统计在抓取时读取（不在热路径上重复计数）
+- 事件循环延迟和阻塞次数由 loop_monitor 上报
+- 多进程部署（uvicorn --workers）时每个进程独立统计，需按进程分别抓取
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+import psutil
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from .tracing import tracer
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+# ============ HTTP ============
+
+HTTP_REQUESTS = Counter(
+    'http_requests_total', 'HTTP 请求数', ['method', 'route', 'status']
+)
+HTTP_DURATION = Histogram(
+    'http_request_duration_seconds', 'HTTP 请求耗时', ['method', 'route'], buckets=HTTP_BUCKETS
+)
+HTTP_IN_PROGRESS = Gauge('http_requests_in_progress', '处理中的 HTTP 请求数')
+
+# ============ 上游 AI ============
+
+UPSTREAM_DURATION = Histogram(
+    'ai_upstream_request_duration_seconds', '上游 AI 调用耗时', ['provider', 'model', 'outcome'],
+    buckets=UPSTREAM_BUCKETS
+)
+UPSTREAM_TOKENS = Counter(
+    'ai_upstream_tokens_total', '上游 AI 消耗的 token 数', ['provider', 'model', 'kind']
+)
+UPSTREAM_COST = Counter(
+    'ai_upstream_cost_yuan_total', '上游 AI 调用成本（元）', ['provider', 'model']
+)
+PROMPT_TOKENS = Counter(
+    'ai_prompt_tokens_total', '对话输入 token 数（projected 为发送前预估，actual 为服务商返回）', ['model', 'kind']
+)
+AI_QUEUE_WAIT = Histogram(
+    'ai_scheduler_queue_wait_seconds', '上游调用排队耗时', ['priority'], buckets=UPSTREAM_BUCKETS
+)
+
+# ============ 数据库 / Redis ============
+
+DB_POOL_CHECKOUT = Histogram(
+    'db_pool_checkout_wait_seconds', '从连接池取连接的等待时间', buckets=FAST_BUCKETS
+)
+DB_POOL_TIMEOUTS = Counter('db_pool_checkout_timeouts_total', '连接池取连接超时次数')
+REDIS_COMMAND_DURATION = Histogram(
+    'redis_command_duration_seconds', 'Redis 命令耗时', ['command'], buckets=FAST_BUCKETS
+)
+REDIS_COMMAND_ERRORS = Counter('redis_command_errors_total', 'Redis 命令失败次数', ['command'])
+
+# ============ 安全 / 运行时 ============
+
+RATE_LIMIT_REJECTIONS = Counter(
+    'rate_limit_rejections_total', '被安全中间件拒绝的请求数', ['reason']
+)
+EVENT_LOOP_LAG = Histogram(
+    'event_loop_lag_seconds', '事件循环调度延迟', buckets=FAST_BUCKETS
+)
+EVENT_LOOP_LAG_LAST = Gauge('event_loop_lag_last_seconds', '最近一次探测到的事件循环延迟')
+EVENT_LOOP_BLOCKS = Counter('event_loop_blocks_total', '事件循环被阻塞超过阈值的次数')
+
+ROUTE_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+# ============ 记录 ============
+
+def observe_upstream(provider: Optional[str], model: str, seconds: float, outcome: str = 'ok'):
+    UPSTREAM_DURATION.labels(provider or 'custom', model or 'unknown', outcome).observe(seconds)
+
+
+@contextmanager
+def upstream_timer(provider: Optional[str], model: str):
+    """统计一次上游调用的耗时和结果（同时记录 span）"""
+    start = time.perf_counter()
+    try:
+        with tracer.span('ai.upstream', kind='client', provider=provider or 'custom', model=model or 'unknown'):
+            yield
+    except Exception:
+        observe_upstream(provider, model, time.perf_counter() - start, 'error')
+        raise
+    observe_upstream(provider, model, time.perf_counter() - start)
+
+
+def record_ai_usage(
+    provider: Optional[str], model: str, input_tokens: int = 0, output_tokens: int = 0,
+    cached_tokens: int = 0, cost: int = 0
+):
+    """记录 token 消耗和成本（cost 单位：万分之一元）"""
+    provider = provider or 'custom'
+    model = model or 'unknown'
+    for kind, value in (('input', input_tokens), ('output', output_tokens), ('cached', cached_tokens)):
+        if value:
+            UPSTREAM_TOKENS.labels(provider, model, kind).inc(value)
+    if cost:
+        UPSTREAM_COST.labels(provider, model).inc(cost / 10000)
+
+
+def record_prompt_tokens(model: str, projected: int, actual: int):
+    model = model or 'unknown'
+    PROMPT_TOKENS.labels(model, 'projected').inc(projected)
+    PROMPT_TOKENS.labels(model, 'actual').inc(actual)
+
+
+# ============ 抓取时读取的统计 ============
+
+class _ScrapeCollector:
+    """抓取时调用各模块的 get_stats，转换成指标"""
+
+    def __init__(self):
+        self._sources: List[Callable[[], list]] = []
+
+    def add(self, source: Callable[[], list]):
+        self._sources.append(source)
+
+    def collect(self):
+        for source in self._sources:
+            try:
+                yield from source()
+            except Exception:
+                # 单个来源出错不影响其他指标
+                continue
+
+
+_collector = _ScrapeCollector()
+REGISTRY.register(_collector)
+
+
+def watch_cache(name: str, cache):
+    """缓存命中统计（cache.stats 中的计数 + get_stats() 中的 hitRatio）"""
+    def source():
+        events = CounterMetricFamily('cache_events', '缓存事件数', labels=['cache', 'event'])
+        for event, value in cache.stats.items():
+            events.add_metric([name, event], value)
+        ratio = GaugeMetricFamily('cache_hit_ratio', '缓存命中率', labels=['cache'])
+        ratio.add_metric([name], cache.get_stats().get('hitRatio', 0))
+        return [events, ratio]
+    _collector.add(source)
+
+
+def watch_scheduler(scheduler):
+    def source():
+        stats = scheduler.get_stats()
+        active = GaugeMetricFamily('ai_scheduler_active', '正在执行的上游调用数')
+        active.add_metric([], stats['active'])
+        waiting = GaugeMetricFamily('ai_scheduler_waiting', '排队中的上游调用数')
+        waiting.add_metric([], stats['waiting'])
+        admitted = CounterMetricFamily('ai_scheduler_admitted', '已放行的上游调用数')
+        admitted.add_metric([], stats['admitted'])
+        timeouts = CounterMetricFamily('ai_scheduler_timeouts', '排队超时次数')
+        timeouts.add_metric([], stats['timeouts'])
+        return [active, waiting, admitted, timeouts]
+    _collector.add(source)
+
+
+def watch_router(router):
+    def source():
+        state = GaugeMetricFamily('llm_route_state', '路由熔断状态（0 关闭 1 半开 2 打开）', labels=['route'])
+        error = GaugeMetricFamily('llm_route_error_rate', '路由 EWMA 错误率', labels=['route'])
+        for route in router.get_stats():
+            state.add_metric([route['route']], ROUTE_STATES.get(route['state'], 0))
+            error.add_metric([route['route']], route['errorRate'])
+        return [state, error]
+    _collector.add(source)
+
+
+def watch_pool(pool):
+    """连接池占用（QueuePool 的 size/checkedout/overflow）"""
+    def source():
+        gauge = GaugeMetricFamily('db_pool_connections', '数据库连接池连接数', labels=['state'])
+        gauge.add_metric(['size'], pool.size())
+        gauge.add_metric(['checked_out'], pool.checkedout())
+        gauge.add_metric(['overflow'], max(0, pool.overflow()))
+        return [gauge]
+    _collector.add(source)
+
+
+def _system_source():
+    # interval=None 不阻塞：返回与上一次调用之间的 CPU 使用率
+    cpu = GaugeMetricFamily('system_cpu_percent', '系统 CPU 使用率')
+    cpu.add_metric([], psutil.cpu_percent(interval=None))
+    memory = GaugeMetricFamily('system_memory_percent', '系统内存使用率')
+    memory.add_metric([], psutil.virtual_memory().percent)
+    return [cpu, memory]
+
+
+_collector.add(_system_source)
+
+
+# ============ HTTP 中间件 ============
+
+class MetricsMiddleware:
+    """纯 ASGI 中间件：按路由模板（而不是实际路径）统计，避免路径参数导致标签爆炸"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            # 路由匹配后 FastAPI 会把 route 写回 scope
+            route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+            method = scope.get('method', 'GET')
+            HTTP_REQUESTS.labels(method, route, str(status[0])).inc()
+            HTTP_DURATION.labels(method, route).observe(time.perf_counter() - start)
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
@@ -1,7 +1,26 @@
 import redis.asyncio as redis
 import json
+import time
 from typing import Optional, List
 from .config import settings
+from .metrics import REDIS_COMMAND_DURATION, REDIS_COMMAND_ERRORS
+from .tracing import tracer
+
+
+class TimedRedis(redis.Redis):
+    """按命令统计耗时"""
+
+    async def execute_command(self, *args, **options):
+        command = str(args[0]).lower() if args else 'unknown'
+        start = time.perf_counter()
+        try:
+            with tracer.span(f"redis.{command}", leaf=True, kind='client'):
+                return await super().execute_command(*args, **options)
+        except Exception:
+            REDIS_COMMAND_ERRORS.labels(command).inc()
+            raise
+        finally:
+            REDIS_COMMAND_DURATION.labels(command).observe(time.perf_counter() - start)
 
 
 class RedisClient:
@@ -9,7 +28,7 @@ class RedisClient:
         self.redis = None
     
     async def connect(self):
-        self.redis = redis.from_url(settings.REDIS_URL, decode_responses=True)
+        self.redis = TimedRedis.from_url(settings.REDIS_URL, decode_responses=True)
     
     async def close(self):
         if self.redis:
@@ -38,18 +57,73 @@ class RedisClient:
     async def set(self, key: str, value: str, ex: int = 300):
         await self.redis.set(key, value, ex=ex)
     
-    async def delete(self, key: str):
-        await self.redis.delete(key)
+    async def set_nx(self, key: str, value: str, ex: int) -> bool:
+        """仅当键不存在时写入（用作简单的分布式锁）"""
+        return bool(await self.redis.set(key, value, ex=ex, nx=True))
+    
+    async def delete(self, *keys: str):
+        if keys:
+            await self.redis.delete(*keys)
+
+    # 哈希操作（用于计数缓存、监控消息）
+    async def hgetall(self, key: str) -> dict:
+        return await self.redis.hgetall(key)
+
+    async def hmget(self, key: str, fields: List[str]) -> list:
+        return await self.redis.hmget(key, fields)
+
+    async def hset_mapping(self, key: str, mapping: dict, ex: int = None):
+        await self.redis.hset(key, mapping=mapping)
+        if ex:
+            await self.redis.expire(key, ex)
 
-    # 列表操作（用于监控消息）
-    async def lrange(self, key: str, start: int, end: int):
+    async def eval(self, script: str, keys: List[str], args: list):
+        return await self.redis.eval(script, len(keys), *keys, *args)
+
+    async def eval_many(self, script: str, keys: List[str], args_list: List[list]) -> list:
+        """同一脚本按多组参数执行（一个 pipeline）"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for args in args_list:
+                pipe.eval(script, len(keys), *keys, *args)
+            return await pipe.execute()
+
+    async def set_nx_many(self, keys: List[str], value: str, ex: int) -> List[bool]:
+        """批量 SET NX（一个 pipeline），返回每个键是否写入成功"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.set(key, value, ex=ex, nx=True)
+            return [bool(r) for r in await pipe.execute()]
+
+    # 列表操作（用于回答缓存）
+    async def lrange(self, key: str, start: int, end: int) -> list:
         return await self.redis.lrange(key, start, end)
 
-    async def lpush(self, key: str, *values):
-        return await self.redis.lpush(key, *values)
+    # 流操作（用于系统日志）
+    async def xadd_many(self, key: str, entries: List[dict], maxlen: int):
+        """批量追加（一个 pipeline），按 maxlen 近似裁剪"""
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for fields in entries:
+                pipe.xadd(key, fields, maxlen=maxlen, approximate=True)
+            await pipe.execute()
+
+    async def xrevrange(self, key: str, max: str = "+", min: str = "-", count: int = None):
+        return await self.redis.xrevrange(key, max=max, min=min, count=count)
+
+    async def xlen(self, key: str) -> int:
+        return await self.redis.xlen(key)
+
+    # 有序集合操作（用于 LRU 索引、监控消息索引）
+    async def zadd(self, key: str, mapping: dict):
+        return await self.redis.zadd(key, mapping)
+
+    async def zcard(self, key: str) -> int:
+        return await self.redis.zcard(key)
+
+    async def zrevrange(self, key: str, start: int, end: int) -> list:
+        return await self.redis.zrevrange(key, start, end)
 
-    async def ltrim(self, key: str, start: int, end: int):
-        return await self.redis.ltrim(key, start, end)
+    async def zpopmin(self, key: str, count: int = 1):
+        return await self.redis.zpopmin(key, count)
 
 
 redis_client = RedisClient()
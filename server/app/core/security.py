@@ -38,3 +38,11 @@ async def get_current_user_id(token: str = Depends(oauth2_scheme)) -> int:
         return int(user_id)
     except JWTError:
         raise credentials_exception
+
+
+async def get_admin_user_id(user_id: int = Depends(get_current_user_id)) -> int:
+    """仅允许 ADMIN_USER_IDS 中的用户访问"""
+    admin_ids = {int(x) for x in settings.ADMIN_USER_IDS.split(',') if x.strip()}
+    if user_id not in admin_ids:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="需要管理员权限")
+    return user_id
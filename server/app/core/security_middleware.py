@@ -12,13 +12,11 @@ from collections import defaultdict
 from datetime import datetime
 import re
 
-# 配置安全日志
+from app.core.metrics import RATE_LIMIT_REJECTIONS
+
+# 安全日志（由 app.core.log 经队列异步写入 security.log）
 security_logger = logging.getLogger('security')
 security_logger.setLevel(logging.INFO)
-if not security_logger.handlers:
-    handler = logging.FileHandler('security.log', encoding='utf-8')
-    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-    security_logger.addHandler(handler)
 
 # 内存存储（生产环境建议用 Redis）
 rate_limit_store: Dict[str, list] = defaultdict(list)
@@ -49,6 +47,8 @@ XSS_PATTERNS = [
     r'<object',
     r'<embed',
 ]
+# 合并成一个正则，一次扫描
+XSS_RE = re.compile('|'.join(f'(?:{p})' for p in XSS_PATTERNS), re.IGNORECASE)
 
 
 def get_client_ip(request: Request) -> str:
@@ -133,11 +133,7 @@ def check_xss(content: str) -> bool:
     if not content:
         return True
     
-    content_lower = content.lower()
-    for pattern in XSS_PATTERNS:
-        if re.search(pattern, content_lower, re.IGNORECASE):
-            return False
-    return True
+    return XSS_RE.search(content) is None
 
 
 def sanitize_input(content: str) -> str:
@@ -160,6 +156,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         # 1. 检查 IP 黑名单
         if ip in ip_blacklist:
             log_security_event('blacklist_block', ip, f'黑名单IP尝试访问: {path}', 'warning')
+            RATE_LIMIT_REJECTIONS.labels('blacklist').inc()
             return JSONResponse(
                 status_code=403,
                 content={"code": 403, "message": "访问被拒绝"}
@@ -168,6 +165,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
         # 2. 检查请求频率
         if not check_rate_limit(ip, path):
             log_security_event('rate_limit', ip, f'请求频率超限: {path}', 'warning')
+            RATE_LIMIT_REJECTIONS.labels('rate_limit').inc()
             return JSONResponse(
                 status_code=429,
                 content={"code": 429, "message": "请求过于频繁，请稍后再试"}
@@ -178,6 +176,7 @@ class SecurityMiddleware(BaseHTTPMiddleware):
             is_locked, remaining = check_login_lockout(ip)
             if is_locked:
                 log_security_event('login_lockout', ip, f'登录锁定中，剩余 {remaining} 秒', 'warning')
+                RATE_LIMIT_REJECTIONS.labels('login_lockout').inc()
                 return JSONResponse(
                     status_code=423,
                     content={"code": 423, "message": f"登录失败次数过多，请 {remaining} 秒后再试"}
@@ -0,0 +1,288 @@
+"""链路追踪
+
+- 与 OpenTelemetry 兼容的 span 模型：trace_id/span_id/parent，用 contextvars 在协程和子任务间传递
+- HTTP 请求为根 span，支持 W3C traceparent 请求头，响应头返回 X-Trace-Id
+- 数据库查询、Redis 命令只在已有链路中记录（叶子 span），后台循环里的零散调用不会各自成为一条链路
+- 导出：JSONL 文件（TRACE_EXPORTER=file）或 OTLP/HTTP JSON（TRACE_EXPORTER=otlp，如本地 OpenTelemetry Collector）
+- span 结束时只入队，由后台任务批量导出；队列满时丢弃最旧的 span
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3}
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'kind', 'sampled',
+                 'start_ns', 'end_ns', 'attributes', 'error')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 kind: str = 'internal', attributes: Optional[Dict] = None):
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.sampled = sampled
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> dict:
+        return {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'start': self.start_ns,
+            'durationMs': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+            'error': self.error
+        }
+
+
+_current: ContextVar[Optional[Span]] = ContextVar('current_span', default=None)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class Tracer:
+    def __init__(self):
+        self.exporter = settings.TRACE_EXPORTER
+        self.enabled = bool(self.exporter)
+        self.sample_rate = settings.TRACE_SAMPLE_RATE
+        self._queue: deque = deque(maxlen=settings.TRACE_QUEUE_SIZE)
+        self.dropped = 0
+        self._client = None
+
+    # ============ 创建 span ============
+
+    def current_span(self) -> Optional[Span]:
+        return _current.get()
+
+    def current_trace_id(self) -> Optional[str]:
+        span = _current.get()
+        return span.trace_id if span else None
+
+    def start(self, name: str, parent: Optional[Span] = None, leaf: bool = False,
+              kind: str = 'internal', traceparent: Optional[str] = None, **attributes) -> Optional[Span]:
+        """创建 span（不修改当前上下文）；leaf=True 且没有父 span 时返回 None"""
+        parent = parent or _current.get()
+        if parent is not None:
+            if leaf and not parent.sampled:
+                return None
+            return Span(name, parent.trace_id, parent.span_id, parent.sampled, kind, attributes)
+        if leaf:
+            return None
+        match = TRACEPARENT_RE.match(traceparent or '')
+        if match:
+            # 沿用上游传入的链路和采样决定
+            trace_id, parent_id, flags = match.groups()
+            return Span(name, trace_id, parent_id, self.enabled and flags == '01', kind, attributes)
+        sampled = self.enabled and random.random() < self.sample_rate
+        return Span(name, os.urandom(16).hex(), None, sampled, kind, attributes)
+
+    def end(self, span: Optional[Span], error: Optional[BaseException] = None):
+        if span is None or span.end_ns:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        if span.sampled:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append(span)
+
+    @contextmanager
+    def span(self, name: str, leaf: bool = False, kind: str = 'internal', **attributes):
+        """在当前上下文中开启一个 span（可用于同步和异步代码）"""
+        span = self.start(name, leaf=leaf, kind=kind, **attributes)
+        if span is None:
+            yield None
+            return
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.end(span, e)
+            raise
+        finally:
+            _current.reset(token)
+            self.end(span)
+
+    # ============ 自动埋点 ============
+
+    def instrument_engine(self, sync_engine):
+        """为 SQLAlchemy 引擎的每条 SQL 记录 span"""
+        from sqlalchemy import event
+
+        @event.listens_for(sync_engine, 'before_cursor_execute')
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            context._trace_span = self.start('db.query', leaf=True, kind='client',
+                                             **{'db.statement': statement[:500]})
+
+        @event.listens_for(sync_engine, 'after_cursor_execute')
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            self.end(getattr(context, '_trace_span', None))
+
+        @event.listens_for(sync_engine, 'handle_error')
+        def _error(exception_context):
+            context = exception_context.execution_context
+            if context is not None:
+                self.end(getattr(context, '_trace_span', None), exception_context.original_exception)
+
+    # ============ 导出 ============
+
+    def _drain(self) -> List[Span]:
+        spans = []
+        while self._queue:
+            spans.append(self._queue.popleft())
+        return spans
+
+    def _write_file(self, spans: List[Span]):
+        with open(settings.TRACE_FILE, 'a', encoding='utf-8') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + '\n')
+
+    def _otlp_payload(self, spans: List[Span]) -> dict:
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': settings.TRACE_SERVICE_NAME}}
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': 'app.core.tracing'},
+                    'spans': [{
+                        'traceId': s.trace_id,
+                        'spanId': s.span_id,
+                        'parentSpanId': s.parent_id or '',
+                        'name': s.name,
+                        'kind': SPAN_KINDS.get(s.kind, 1),
+                        'startTimeUnixNano': str(s.start_ns),
+                        'endTimeUnixNano': str(s.end_ns),
+                        'attributes': [{'key': k, 'value': _otlp_value(v)} for k, v in s.attributes.items()],
+                        'status': {'code': 2, 'message': s.error} if s.error else {'code': 1}
+                    } for s in spans]
+                }]
+            }]
+        }
+
+    async def flush(self):
+        spans = self._drain()
+        if not spans:
+            return
+        if self.exporter == 'file':
+            await asyncio.to_thread(self._write_file, spans)
+        elif self.exporter == 'otlp':
+            import httpx
+            if self._client is None:
+                self._client = httpx.AsyncClient(timeout=5.0)
+            response = await self._client.post(
+                settings.TRACE_OTLP_ENDPOINT.rstrip('/') + '/v1/traces', json=self._otlp_payload(spans)
+            )
+            response.raise_for_status()
+
+    async def run_exporter(self):
+        """后台导出循环"""
+        try:
+            while True:
+                await asyncio.sleep(settings.TRACE_FLUSH_INTERVAL)
+                try:
+                    await self.flush()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("链路导出失败: %s", e)
+        finally:
+            # 关闭时导出剩余的 span
+            try:
+                await self.flush()
+            except Exception:
+                pass
+            if self._client is not None:
+                await self._client.aclose()
+
+
+tracer = Tracer()
+
+
+class TraceIdFilter(logging.Filter):
+    """给日志记录加上 trace_id 字段（格式串中用 %(trace_id)s）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = tracer.current_trace_id() or '-'
+        return True
+
+
+class TracingMiddleware:
+    """纯 ASGI 中间件：每个 HTTP 请求一个根 span"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get('headers') or [])
+        traceparent = headers.get(b'traceparent', b'').decode('latin-1')
+        method = scope.get('method', 'GET')
+        span = tracer.start(f"HTTP {method}", kind='server', traceparent=traceparent,
+                            **{'http.method': method, 'http.target': scope.get('path', '')})
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                span.set(**{'http.status_code': message['status']})
+                message.setdefault('headers', [])
+                message['headers'] = list(message['headers']) + [
+                    (b'x-trace-id', span.trace_id.encode()),
+                    (b'traceparent', span.traceparent.encode())
+                ]
+            await send(message)
+
+        token = _current.set(span)
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            route = getattr(scope.get('route'), 'path', None)
+            if route:
+                span.name = f"HTTP {method} {route}"
+                span.set(**{'http.route': route})
+            tracer.end(span, error)
@@ -2,5 +2,6 @@ from .user import User
 from .conversation import Conversation, Message
 from .knowledge import Knowledge, Category, Tag
 from .file_storage import FileStorage
+from .monitor import MonitorConfig
 
-__all__ = ["User", "Conversation", "Message", "Knowledge", "Category", "Tag", "FileStorage"]
+__all__ = ["User", "Conversation", "Message", "Knowledge", "Category", "Tag", "FileStorage", "MonitorConfig"]
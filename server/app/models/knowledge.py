@@ -17,8 +17,11 @@ class Knowledge(Base):
     title = Column(String(255), nullable=False)
     content = Column(Text, nullable=False)
     summary = Column(Text)
-    source = Column(String(50), default="manual", index=True)  # chat/manual/import
+    source = Column(String(50), default="manual", index=True)  # chat/manual/import/web/monitor
     source_id = Column(String(100))
+    source_url = Column(String(2048))  # 网页来源地址（source=web），索引见 SCHEMA_UPGRADES
+    content_hash = Column(String(64))  # 正文 sha256，入库去重、网页重抓时判断内容是否变化
+    fetched_at = Column(DateTime)  # 最近一次抓取时间
     tags = Column(JSON, default=[])
     embedding = Column(VECTOR_TYPE)  # 向量（需要 pgvector 扩展）
     token_count = Column(Integer, default=0)
@@ -0,0 +1,17 @@
+"""消息监控配置模型"""
+from sqlalchemy import Column, Integer, DateTime, Boolean, ForeignKey, JSON
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class MonitorConfig(Base):
+    __tablename__ = "monitor_config"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    enabled = Column(Boolean, default=True)
+    keywords = Column(JSON, default=[])  # 监控关键词，为空时不按关键词过滤
+    auto_save = Column(Boolean, default=False)  # 命中后自动保存到知识库
+    min_length = Column(Integer, default=50)  # 最小内容长度才触发
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
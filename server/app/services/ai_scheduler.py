@@ -0,0 +1,244 @@
+"""上游 AI 调用准入调度
+
+- 全局并发上限 + 单用户并发上限
+- 按用户加权公平排队（WFQ），一个用户的批量任务不会饿死其他用户
+- 每个服务商两个令牌桶：RPM（请求数/分钟）和 TPM（token/分钟）
+- 优先级：交互式聊天 > 普通请求 > 后台任务（向量/文档解析）
+- 排队耗时统计
+"""
+import asyncio
+import itertools
+import re
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import AI_QUEUE_WAIT
+
+PRIORITY_INTERACTIVE = 0  # 聊天
+PRIORITY_NORMAL = 1  # 总结、标签、图片识别
+PRIORITY_BACKGROUND = 2  # 向量化、文档解析
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_NORMAL: "normal",
+    PRIORITY_BACKGROUND: "background"
+}
+
+_CJK_RE = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
+class SchedulerTimeout(Exception):
+    """排队超时"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数（中文约 1 字 1 token，其他约 4 字符 1 token）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """距离可以消费 amount 还需等待的秒数"""
+        self._refill()
+        # 单次请求超过桶容量时，只要桶满即可放行，避免永远等待
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def adjust(self, delta: float):
+        """按实际用量修正（可为负数，形成欠账）"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+
+class Ticket:
+    def __init__(self, provider: Optional[str], user_id: Optional[int], priority: int, tokens: int,
+                 start_tag: float, finish_tag: float, seq: int):
+        self.provider = provider
+        self.user_id = user_id
+        self.priority = priority
+        self.tokens = tokens
+        self.start_tag = start_tag
+        self.finish_tag = finish_tag
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def sort_key(self) -> Tuple[int, float, int]:
+        return (self.priority, self.finish_tag, self.seq)
+
+
+class AIScheduler:
+    def __init__(self, max_concurrency: int, user_concurrency: int, provider_limits: Dict[str, Tuple[int, int]],
+                 queue_timeout: float = 60.0):
+        self.max_concurrency = max_concurrency
+        self.user_concurrency = user_concurrency
+        self.queue_timeout = queue_timeout
+        self.rpm_buckets = {p: TokenBucket(rpm) for p, (rpm, _) in provider_limits.items()}
+        self.tpm_buckets = {p: TokenBucket(tpm) for p, (_, tpm) in provider_limits.items()}
+        self._waiting: List[Ticket] = []
+        self._active = 0
+        self._user_active: Dict[Optional[int], int] = defaultdict(int)
+        self._user_finish: Dict[Optional[int], float] = defaultdict(float)
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._queue_times: Dict[int, deque] = defaultdict(lambda: deque(maxlen=500))
+        self._stats = {"admitted": 0, "timeouts": 0}
+
+    # ============ 调度 ============
+
+    def _bucket_wait(self, ticket: Ticket) -> float:
+        if ticket.provider not in self.rpm_buckets:
+            return 0.0
+        return max(
+            self.rpm_buckets[ticket.provider].wait_time(1),
+            self.tpm_buckets[ticket.provider].wait_time(ticket.tokens)
+        )
+
+    def _dispatch(self):
+        self._timer = None
+        min_wait = None
+        self._waiting.sort(key=lambda t: t.sort_key)
+        for ticket in list(self._waiting):
+            if self._active >= self.max_concurrency:
+                break
+            if ticket.future.done():
+                self._waiting.remove(ticket)
+                continue
+            if self._user_active[ticket.user_id] >= self.user_concurrency:
+                continue
+            wait = self._bucket_wait(ticket)
+            if wait > 0:
+                min_wait = wait if min_wait is None else min(min_wait, wait)
+                continue
+            # 放行
+            if ticket.provider in self.rpm_buckets:
+                self.rpm_buckets[ticket.provider].consume(1)
+                self.tpm_buckets[ticket.provider].consume(ticket.tokens)
+            self._waiting.remove(ticket)
+            self._active += 1
+            self._user_active[ticket.user_id] += 1
+            self._virtual_time = max(self._virtual_time, ticket.start_tag)
+            ticket.future.set_result(True)
+        if min_wait is not None and self._waiting:
+            self._timer = asyncio.get_running_loop().call_later(min_wait, self._dispatch)
+
+    def _schedule_dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    async def acquire(self, provider: Optional[str], user_id: Optional[int] = None,
+                      priority: int = PRIORITY_NORMAL, tokens: int = 0, weight: float = 1.0) -> Ticket:
+        # 加权公平排队：每个用户的虚拟完成时间独立递增
+        start = max(self._virtual_time, self._user_finish[user_id])
+        finish = start + 1.0 / weight
+        self._user_finish[user_id] = finish
+        ticket = Ticket(provider, user_id, priority, tokens, start, finish, next(self._seq))
+        self._waiting.append(ticket)
+        self._schedule_dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._cancel(ticket)
+            self._stats["timeouts"] += 1
+            raise SchedulerTimeout("AI 服务繁忙，请稍后再试")
+        except asyncio.CancelledError:
+            self._cancel(ticket)
+            raise
+        queue_time = time.monotonic() - ticket.enqueued_at
+        self._queue_times[priority].append(queue_time)
+        AI_QUEUE_WAIT.labels(PRIORITY_NAMES.get(priority, str(priority))).observe(queue_time)
+        self._stats["admitted"] += 1
+        return ticket
+
+    def _cancel(self, ticket: Ticket):
+        if ticket.future.done() and not ticket.future.cancelled():
+            # 已放行但调用方不再需要
+            self.release(ticket)
+        else:
+            ticket.future.cancel()
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+
+    def release(self, ticket: Ticket):
+        self._active -= 1
+        self._user_active[ticket.user_id] -= 1
+        if self._user_active[ticket.user_id] <= 0:
+            self._user_active.pop(ticket.user_id, None)
+        self._schedule_dispatch()
+
+    def record_usage(self, ticket: Ticket, actual_tokens: int):
+        """按上游返回的实际 token 数修正 TPM 令牌桶"""
+        if ticket.provider in self.tpm_buckets and actual_tokens:
+            self.tpm_buckets[ticket.provider].adjust(actual_tokens - ticket.tokens)
+
+    @asynccontextmanager
+    async def slot(self, provider: Optional[str], user_id: Optional[int] = None,
+                   priority: int = PRIORITY_NORMAL, tokens: int = 0):
+        ticket = await self.acquire(provider, user_id, priority, tokens)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    # ============ 统计 ============
+
+    def get_stats(self) -> dict:
+        queue_times = {}
+        for priority, samples in self._queue_times.items():
+            ordered = sorted(samples)
+            queue_times[PRIORITY_NAMES.get(priority, str(priority))] = {
+                "count": len(ordered),
+                "avgMs": round(sum(ordered) / len(ordered) * 1000, 1) if ordered else 0,
+                "p95Ms": round(ordered[int(len(ordered) * 0.95) - 1] * 1000, 1) if ordered else 0
+            }
+        return {
+            "active": self._active,
+            "waiting": len(self._waiting),
+            "admitted": self._stats["admitted"],
+            "timeouts": self._stats["timeouts"],
+            "queueTime": queue_times
+        }
+
+
+def _parse_provider_limits(value: str) -> Dict[str, Tuple[int, int]]:
+    """解析 "zhipu:300:1000000,qwen:300:1000000" 格式的服务商限额"""
+    limits = {}
+    for item in value.split(','):
+        parts = item.strip().split(':')
+        if len(parts) == 3:
+            limits[parts[0]] = (int(parts[1]), int(parts[2]))
+    return limits
+
+
+ai_scheduler = AIScheduler(
+    max_concurrency=settings.AI_MAX_CONCURRENCY,
+    user_concurrency=settings.AI_USER_MAX_CONCURRENCY,
+    provider_limits=_parse_provider_limits(settings.AI_PROVIDER_LIMITS),
+    queue_timeout=settings.AI_QUEUE_TIMEOUT
+)
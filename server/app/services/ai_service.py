@@ -3,14 +3,44 @@ from openai import AsyncOpenAI
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, text
 from app.core.config import settings
+from app.core.metrics import upstream_timer, record_ai_usage
 from app.core.redis import redis_client
+from app.core.tracing import tracer
 from app.models.knowledge import Knowledge
 from app.models.user import User
+from app.services.intent import intent_detector
+from app.services.answer_cache import answer_cache
 from app.services.web_scraper import web_scraper
+from app.services.llm_cache import llm_cache
+from app.services.pricing import pricing_table
+from app.services.prompt_builder import prompt_builder
+from app.services.llm_router import llm_router, UpstreamError
+from app.services.ai_scheduler import (
+    ai_scheduler, estimate_tokens,
+    PRIORITY_INTERACTIVE, PRIORITY_NORMAL, PRIORITY_BACKGROUND
+)
+import asyncio
 import json
+from contextlib import asynccontextmanager
+from datetime import datetime
 import httpx
 import base64
+import logging
 import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# 对话预处理各阶段超时（秒）；数据库查询不设超时，避免取消进行中的查询破坏会话
+STAGE_TIMEOUTS = {
+    "web": 35.0,
+    "context": 2.0,
+    "embedding": 10.0
+}
+
+CHAT_MAX_TOKENS = 2000  # 对话回复的最大 token 数
+KNOWLEDGE_CONTEXT_REFS = 3  # 放进提示词的知识引用条数
+HISTORY_MESSAGES = 6  # 放进提示词的历史消息条数
 
 
 class AIService:
@@ -27,121 +57,158 @@ class AIService:
         )
         # 视觉模型列表（轮换使用）
         self.vision_models = settings.VISION_MODELS.split(',')
-        self.vision_model_index = 0
+    
+    def _vision_routes(self) -> List[dict]:
+        return [{"provider": "zhipu", "model": m} for m in self.vision_models]
     
     def get_next_vision_model(self) -> str:
-        """获取下一个视觉模型（轮换）"""
-        model = self.vision_models[self.vision_model_index]
-        self.vision_model_index = (self.vision_model_index + 1) % len(self.vision_models)
-        return model
+        """获取下一个视觉模型（轮换，跳过熔断中的模型，优先延迟低的）"""
+        return llm_router.pick(self._vision_routes())["model"]
+    
+    def _chat_routes(self, user_config: Dict[str, Any], web_search: bool) -> List[dict]:
+        """构建候选路由（按优先级），由路由器根据健康度故障转移
+
+        用户配置了自己的密钥时默认只走用户的服务商，不转移到平台密钥（LLM_OWN_KEY_FAILOVER）
+        """
+        routes = []
+        if web_search:
+            # 联网搜索
+            if user_config.get('search_api_key'):
+                routes.append({
+                    "key": f"user:{user_config.get('search_base_url')}:{user_config.get('search_model')}",
+                    "own_key": True,
+                    "provider": user_config.get('search_provider') or 'qwen',
+                    "model": user_config.get('search_model', settings.QWEN_CHAT_MODEL),
+                    "client": self.get_client(
+                        user_config.get('search_base_url', settings.QWEN_BASE_URL),
+                        user_config.get('search_api_key')
+                    ),
+                    "extra_body": {"enable_search": True}
+                })
+                if not settings.LLM_OWN_KEY_FAILOVER:
+                    return routes
+            # 只转移到同样支持联网搜索的路由，不退化为普通聊天（否则回答会冒充搜索结果）
+            routes.append({
+                "provider": "qwen",
+                "model": settings.QWEN_CHAT_MODEL,
+                "client": self.qwen_client,
+                "extra_body": {"enable_search": True}
+            })
+        else:
+            # 普通聊天
+            if user_config.get('chat_api_key'):
+                routes.append({
+                    "key": f"user:{user_config.get('chat_base_url')}:{user_config.get('chat_model')}",
+                    "own_key": True,
+                    "provider": user_config.get('chat_provider') or 'zhipu',
+                    "model": user_config.get('chat_model', settings.CHAT_MODEL),
+                    "client": self.get_client(
+                        user_config.get('chat_base_url', settings.ZHIPU_BASE_URL),
+                        user_config.get('chat_api_key')
+                    )
+                })
+                if not settings.LLM_OWN_KEY_FAILOVER:
+                    return routes
+            routes.append({"provider": "zhipu", "model": settings.CHAT_MODEL, "client": self.client})
+            if settings.QWEN_API_KEY:
+                routes.append({"provider": "qwen", "model": settings.QWEN_CHAT_MODEL, "client": self.qwen_client})
+        return routes
     
     async def get_user_ai_config(self, db: AsyncSession, user_id: int) -> Dict[str, Any]:
-        """获取用户AI配置"""
+        """获取用户AI配置（同时把用户的指令扩展词表登记到本进程的意图识别）"""
         try:
             result = await db.execute(select(User).where(User.id == user_id))
             user = result.scalar_one_or_none()
+            ai_config = {}
             if user and user.settings:
                 settings_data = json.loads(user.settings) if isinstance(user.settings, str) else user.settings
-                return settings_data.get('ai_config', {})
+                ai_config = settings_data.get('ai_config', {})
+            intent_detector.remember_user(user_id, ai_config.get('intent_keywords'))
+            return ai_config
         except Exception as e:
-            print(f"获取用户配置失败: {e}")
+            logger.warning("获取用户配置失败: %s", e)
         return {}
     
     def get_client(self, base_url: str, api_key: str) -> AsyncOpenAI:
         """根据配置创建客户端"""
         return AsyncOpenAI(api_key=api_key, base_url=base_url)
     
-    def calculate_cost(self, provider: str, model: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0) -> int:
+    def calculate_cost(self, provider: str, model: str, input_tokens: int, output_tokens: int, cached_tokens: int = 0,
+                       at: Optional[datetime] = None) -> int:
         """计算成本（返回单位：万分之一元）
-        
-        价格表（每百万token）：
-        - 智谱 glm-4.5-flash: 免费
-        - 智谱 glm-4-flash: 免费
-        - 智谱 embedding-2: 0.5元/M
-        - 通义 qwen-turbo: 输入0.3元/M 输出0.6元/M 缓存0.06元/M
-        - 通义 qwen-flash: 输入0.15元/M 输出1.5元/M
-        - DeepSeek chat: 输入1元/M 输出2元/M 缓存0.1元/M
+
+        价格见 pricing.json（按版本、生效时间管理）；指定 at 时按当时生效的价格版本计算，用于复算历史成本
         """
-        # 价格配置（单位：元/百万token）
-        PRICES = {
-            'zhipu': {
-                'glm-4.5-flash': {'input': 0, 'output': 0, 'cached': 0},
-                'glm-4-flash': {'input': 0, 'output': 0, 'cached': 0},
-                'glm-4-flash-250414': {'input': 0, 'output': 0, 'cached': 0},
-                'glm-4v-flash': {'input': 0, 'output': 0, 'cached': 0},
-                'glm-4.1v-thinking-flash': {'input': 0, 'output': 0, 'cached': 0},
-                'embedding-2': {'input': 0.5, 'output': 0, 'cached': 0},
-                'default': {'input': 0, 'output': 0, 'cached': 0}
-            },
-            'qwen': {
-                'qwen-turbo': {'input': 0.3, 'output': 0.6, 'cached': 0.06},
-                'qwen-flash': {'input': 0.15, 'output': 1.5, 'cached': 0.03},
-                'qwen-plus': {'input': 0.8, 'output': 2, 'cached': 0.16},
-                'qwen-max': {'input': 2, 'output': 6, 'cached': 0.4},
-                'qwen-doc-turbo': {'input': 0.6, 'output': 1, 'cached': 0},
-                'qwen-long': {'input': 0.5, 'output': 2, 'cached': 0},
-                'qwen-vl-plus': {'input': 1.5, 'output': 1.5, 'cached': 0},
-                'qwen-vl-max': {'input': 3, 'output': 3, 'cached': 0},
-                'text-embedding-v3': {'input': 0.7, 'output': 0, 'cached': 0},
-                'default': {'input': 0.3, 'output': 0.6, 'cached': 0.06}
-            },
-            'deepseek': {
-                'deepseek-chat': {'input': 1, 'output': 2, 'cached': 0.1},
-                'deepseek-reasoner': {'input': 4, 'output': 16, 'cached': 0.4},
-                'default': {'input': 1, 'output': 2, 'cached': 0.1}
-            },
-            'openai': {
-                'gpt-4o-mini': {'input': 1.1, 'output': 4.4, 'cached': 0.55},
-                'gpt-4o': {'input': 18, 'output': 72, 'cached': 9},
-                'text-embedding-3-small': {'input': 0.15, 'output': 0, 'cached': 0},
-                'default': {'input': 1.1, 'output': 4.4, 'cached': 0.55}
-            },
-            'kimi': {
-                'moonshot-v1-auto': {'input': 0, 'output': 0, 'cached': 0},  # 限时免费
-                'default': {'input': 12, 'output': 12, 'cached': 0}
-            }
-        }
-        
-        # 获取价格
-        provider_prices = PRICES.get(provider, PRICES.get('zhipu'))
-        model_price = provider_prices.get(model, provider_prices.get('default'))
-        
-        # 计算非缓存的输入token
-        non_cached_input = max(0, input_tokens - cached_tokens)
-        
-        # 计算成本（元）
-        cost_yuan = (
-            non_cached_input * model_price['input'] / 1000000 +
-            output_tokens * model_price['output'] / 1000000 +
-            cached_tokens * model_price['cached'] / 1000000
-        )
-        
-        # 转换为万分之一元（保留精度）
-        return int(cost_yuan * 10000)
+        return pricing_table.quote(provider, model, input_tokens, output_tokens, cached_tokens, at)[0]
     
-    async def get_embedding(self, text: str, user_config: Dict[str, Any] = None) -> Optional[List[float]]:
+    def _record_usage(self, provider: Optional[str], model: str, input_tokens: int, output_tokens: int = 0,
+                      cached_tokens: int = 0) -> int:
+        """记录上游 token 消耗和成本指标，返回成本（万分之一元）"""
+        cost = self.calculate_cost(provider, model, input_tokens, output_tokens, cached_tokens)
+        record_ai_usage(provider, model, input_tokens, output_tokens, cached_tokens, cost)
+        return cost
+    
+    async def get_embedding(
+        self,
+        text: str,
+        user_config: Dict[str, Any] = None,
+        user_id: int = None,
+        priority: int = PRIORITY_BACKGROUND
+    ) -> Optional[List[float]]:
         """获取文本的向量表示"""
         try:
-            # 使用用户配置或默认配置
+            # 使用用户配置或默认配置（用户自己的密钥不占用服务商限额）
             if user_config and user_config.get('embedding_api_key'):
                 client = self.get_client(
                     user_config.get('embedding_base_url', settings.ZHIPU_BASE_URL),
                     user_config.get('embedding_api_key')
                 )
                 model = user_config.get('embedding_model', settings.EMBEDDING_MODEL)
+                provider = None
             else:
                 client = self.client
                 model = settings.EMBEDDING_MODEL
+                provider = 'zhipu'
             
-            response = await client.embeddings.create(
-                model=model,
-                input=text
-            )
+            async with ai_scheduler.slot(provider, user_id, priority, estimate_tokens(text)) as ticket:
+                with upstream_timer(provider, model):
+                    response = await client.embeddings.create(
+                        model=model,
+                        input=text
+                    )
+                ai_scheduler.record_usage(ticket, response.usage.total_tokens if response.usage else 0)
+            if response.usage:
+                self._record_usage(provider, model, response.usage.total_tokens)
             return response.data[0].embedding
         except Exception as e:
-            print(f"Embedding API 错误: {e}")
+            logger.warning("Embedding API 错误: %s", e)
             return None
-    
+
+    async def get_embeddings(
+        self,
+        texts: List[str],
+        user_id: int = None,
+        priority: int = PRIORITY_BACKGROUND
+    ) -> List[Optional[List[float]]]:
+        """批量获取向量（一次请求），失败时返回与输入等长的 None 列表"""
+        if not texts:
+            return []
+        model = settings.EMBEDDING_MODEL
+        try:
+            async with ai_scheduler.slot('zhipu', user_id, priority, sum(estimate_tokens(t) for t in texts)) as ticket:
+                with upstream_timer('zhipu', model):
+                    response = await self.client.embeddings.create(model=model, input=texts)
+                ai_scheduler.record_usage(ticket, response.usage.total_tokens if response.usage else 0)
+            if response.usage:
+                self._record_usage('zhipu', model, response.usage.total_tokens)
+            vectors: List[Optional[List[float]]] = [None] * len(texts)
+            for item in response.data:
+                vectors[item.index] = item.embedding
+            return vectors
+        except Exception as e:
+            logger.warning("批量 Embedding API 错误: %s", e)
+            return [None] * len(texts)
+
     async def search_knowledge(
         self, 
         db: AsyncSession, 
@@ -150,75 +217,131 @@ class AIService:
         limit: int = 5
     ) -> List[dict]:
         """搜索知识库（向量搜索 + 关键词搜索）"""
+        query_embedding = await self.get_embedding(query, user_id=user_id, priority=PRIORITY_INTERACTIVE)
+        return await self.search_knowledge_by_embedding(db, user_id, query, query_embedding, limit)
+    
+    async def search_knowledge_by_embedding(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        query: str,
+        query_embedding: Optional[List[float]],
+        limit: int = 5
+    ) -> List[dict]:
+        """用已计算好的查询向量搜索知识库（向量结果不足时用关键词补充；向量为空时只做关键词搜索）"""
         results = []
-        
-        # 尝试向量搜索
-        query_embedding = await self.get_embedding(query)
         if query_embedding is not None:
-            try:
-                embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-                sql = text("""
-                    SELECT id, title, content, summary, tags, 
-                           1 - (embedding <=> cast(:embedding as vector)) as similarity
-                    FROM knowledge
-                    WHERE user_id = :user_id AND status = 1 AND embedding IS NOT NULL
-                    ORDER BY embedding <=> cast(:embedding as vector)
-                    LIMIT :limit
-                """)
-                result = await db.execute(sql, {
-                    "embedding": embedding_str,
+            results = await self._vector_search(db, user_id, query_embedding, limit)
+        
+        # 关键词搜索作为补充
+        if len(results) < limit:
+            seen = {r["id"] for r in results}
+            for item in await self._keyword_search(db, user_id, query, limit):
+                if item["id"] not in seen:
+                    seen.add(item["id"])
+                    results.append(item)
+        
+        return results[:limit]
+    
+    async def _vector_search(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        query_embedding: List[float],
+        limit: int = 5,
+        min_similarity: float = 0.7
+    ) -> List[dict]:
+        """向量搜索（余弦相似度）"""
+        results = []
+        try:
+            embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
+            sql = text("""
+                SELECT id, title, content, summary, tags, 
+                       1 - (embedding <=> cast(:embedding as vector)) as similarity
+                FROM knowledge
+                WHERE user_id = :user_id AND status = 1 AND embedding IS NOT NULL
+                ORDER BY embedding <=> cast(:embedding as vector)
+                LIMIT :limit
+            """)
+            result = await db.execute(sql, {
+                "embedding": embedding_str,
+                "user_id": user_id,
+                "limit": limit
+            })
+            rows = result.fetchall()
+            for row in rows:
+                if row.similarity > min_similarity:
+                    results.append({
+                        "id": row.id,
+                        "title": row.title,
+                        "content": row.content,
+                        "summary": row.summary,
+                        "similarity": round(row.similarity, 3)
+                    })
+        except Exception as e:
+            logger.warning("向量搜索失败: %s", e)
+            await db.rollback()
+        return results
+    
+    async def _keyword_search(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        query: str,
+        limit: int = 5
+    ) -> List[dict]:
+        """关键词搜索（标题/正文 ILIKE，最多取前 3 个关键词）"""
+        results = []
+        try:
+            # 提取关键词
+            keywords = [w for w in query.replace('？', '').replace('?', '').split() if len(w) >= 2]
+            if not keywords:
+                keywords = [query[:10]]
+            
+            keyword_sql = text("""
+                SELECT id, title, content, summary, tags
+                FROM knowledge
+                WHERE user_id = :user_id AND status = 1
+                AND (title ILIKE :kw OR content ILIKE :kw)
+                LIMIT :limit
+            """)
+            
+            for kw in keywords[:3]:
+                result = await db.execute(keyword_sql, {
                     "user_id": user_id,
+                    "kw": f"%{kw}%",
                     "limit": limit
                 })
                 rows = result.fetchall()
                 for row in rows:
-                    if row.similarity > 0.7:
+                    if not any(r["id"] == row.id for r in results):
                         results.append({
                             "id": row.id,
                             "title": row.title,
                             "content": row.content,
-                            "similarity": round(row.similarity, 3)
+                            "summary": row.summary,
+                            "similarity": 0.8
                         })
-            except Exception as e:
-                print(f"向量搜索失败: {e}")
-                await db.rollback()
-        
-        # 关键词搜索作为补充
-        if len(results) < limit:
+        except Exception as e:
+            logger.warning("关键词搜索失败: %s", e)
+            await db.rollback()
+        return results
+    
+    async def _timed_stage(self, timings: Dict[str, Any], name: str, coro, timeout: float = None, default=None):
+        """执行一个预处理阶段并记录耗时（毫秒），超时返回默认值"""
+        start = time.perf_counter()
+        with tracer.span(f"chat.{name}") as span:
             try:
-                # 提取关键词
-                keywords = [w for w in query.replace('？', '').replace('?', '').split() if len(w) >= 2]
-                if not keywords:
-                    keywords = [query[:10]]
-                
-                keyword_sql = text("""
-                    SELECT id, title, content, summary, tags
-                    FROM knowledge
-                    WHERE user_id = :user_id AND status = 1
-                    AND (title ILIKE :kw OR content ILIKE :kw)
-                    LIMIT :limit
-                """)
-                
-                for kw in keywords[:3]:
-                    result = await db.execute(keyword_sql, {
-                        "user_id": user_id,
-                        "kw": f"%{kw}%",
-                        "limit": limit
-                    })
-                    rows = result.fetchall()
-                    for row in rows:
-                        if not any(r["id"] == row.id for r in results):
-                            results.append({
-                                "id": row.id,
-                                "title": row.title,
-                                "content": row.content,
-                                "similarity": 0.8
-                            })
-            except Exception as e:
-                print(f"关键词搜索失败: {e}")
-                await db.rollback()
-        
-        return results[:limit]
+                if timeout:
+                    return await asyncio.wait_for(coro, timeout)
+                return await coro
+            except asyncio.TimeoutError:
+                logger.warning("对话阶段 %s 超时（%ss），已跳过", name, timeout)
+                if span:
+                    span.set(timeout=True)
+                return default
+            finally:
+                timings[name] = round((time.perf_counter() - start) * 1000)
     
     async def chat(
         self,
@@ -227,98 +350,180 @@ class AIService:
         conversation_id: int,
         message: str,
         use_knowledge: bool = False,
-        web_search: bool = False
+        web_search: bool = False,
+        search_intent: Optional[bool] = None,
+        user_config: Optional[dict] = None
     ) -> dict:
-        """AI对话（带知识库RAG + 可选联网搜索 + 网页抓取）"""
+        """AI对话（带知识库RAG + 可选联网搜索 + 网页抓取）
+
+        user_config 为调用方已读取的用户 AI 配置（识别指令意图前需要先读取），传入时不再重复查询。
+
+        调用模型前的准备步骤按依赖关系并发执行：
+        - 用户配置（数据库）、网页抓取、聊天上下文（Redis）互不依赖，同时开始
+        - 知识库检索：向量化可以立即开始（自动检索模式需先拿到配置），
+          SQL 查询等配置查询结束后再执行（同一个数据库会话不能并发查询）
+        """
+        timings: Dict[str, Any] = {}
+        
+        # 0. 检测是否包含URL（多个链接并发抓取）
+        urls = web_scraper.extract_urls(message)[:settings.WEB_FETCH_MAX_URLS]
         
         # 获取用户AI配置
-        user_config = await self.get_user_ai_config(db, user_id)
+        if user_config is not None:
+            config_task = asyncio.get_running_loop().create_future()
+            config_task.set_result(user_config)
+        else:
+            config_task = asyncio.ensure_future(
+                self._timed_stage(timings, "config", self.get_user_ai_config(db, user_id))
+            )
         
-        # 0. 检测是否包含URL，如果有则抓取网页内容
-        url = web_scraper.extract_url(message)
-        web_content = ""
-        if url:
-            print(f"[DEBUG] 检测到URL: {url}")
-            result = await web_scraper.fetch_url(url)
-            print(f"[DEBUG] 抓取结果: success={result['success']}, title={result.get('title', '')}, content_len={len(result.get('content', ''))}")
-            if result['success']:
-                web_content = f"\n\n【网页内容】\n标题: {result['title']}\n网址: {result['url']}\n\n{result['content']}"
-                print(f"[DEBUG] web_content 长度: {len(web_content)}")
-                # 检查是否包含免费模型关键词
-                if 'GLM-4.5-Flash' in result.get('content', ''):
-                    print("[DEBUG] ✅ 内容包含 GLM-4.5-Flash")
+        # 抓取网页内容
+        async def fetch_web() -> Optional[dict]:
+            if not urls:
+                return None
+            logger.debug("检测到URL: %s", urls)
+            # 每个页面单独限时，总耗时约为最慢的一个页面
+            return await self._timed_stage(
+                timings, "web", web_scraper.fetch_urls(urls, timeout=STAGE_TIMEOUTS["web"])
+            )
+        
+        # 获取聊天上下文
+        async def load_context() -> List[dict]:
+            return await self._timed_stage(
+                timings, "context", redis_client.get_chat_context(user_id, conversation_id),
+                timeout=STAGE_TIMEOUTS["context"], default=[]
+            )
+        
+        # 检索知识库，返回 (是否检索, 结果, 问题向量)
+        async def search() -> tuple:
+            if web_search or urls:
+                return False, [], None
+            if not use_knowledge:
+                # 开启了自动检索 + 包含查找关键词 → 检索
+                user_config = await config_task
+                if search_intent is None:
+                    is_search = intent_detector.is_search(message, user_id)
                 else:
-                    print("[DEBUG] ❌ 内容不包含 GLM-4.5-Flash")
-            else:
-                web_content = f"\n\n【网页抓取失败】{result['error']}"
-                print(f"[DEBUG] 抓取失败: {result['error']}")
+                    is_search = search_intent
+                if not (user_config.get('enable_rag', False) and is_search):
+                    return False, [], None
+            # 用户点了知识库按钮 → 强制检索，无需等待配置
+            query_embedding = await self._timed_stage(
+                timings, "embedding",
+                self.get_embedding(message, user_id=user_id, priority=PRIORITY_INTERACTIVE),
+                timeout=STAGE_TIMEOUTS["embedding"]
+            )
+            await config_task
+            try:
+                found = await self._timed_stage(
+                    timings, "search",
+                    self.search_knowledge_by_embedding(db, user_id, message, query_embedding)
+                )
+            except Exception as e:
+                logger.warning("知识库检索失败: %s", e)
+                found = []
+            return True, found, query_embedding
         
-        # 1. 获取聊天上下文
-        context_messages = await redis_client.get_chat_context(user_id, conversation_id)
+        tasks = [config_task, asyncio.ensure_future(fetch_web()),
+                 asyncio.ensure_future(load_context()), asyncio.ensure_future(search())]
+        try:
+            user_config, web_result, context_messages, (should_search, references, query_embedding) = \
+                await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        logger.debug("预处理耗时(ms): %s", timings, extra={"timings": timings})
         
-        # 2. 检索知识库
-        references = []
-        knowledge_context = ""
-        should_search = False
+        # 知识库问答缓存：相同引用（及版本）下的相似问题直接复用回答，省掉模型调用
+        answer_bucket = None
+        if answer_cache.enabled and should_search and references and query_embedding is not None:
+            cache_model = self._chat_routes(user_config, False)[0]["model"]
+            answer_bucket = await answer_cache.bucket_key(db, user_id, cache_model, references)
+            cached = await answer_cache.lookup(answer_bucket, query_embedding) if answer_bucket else None
+            if cached:
+                timings["answerCache"] = {"hit": True, "similarity": cached["similarity"]}
+                await redis_client.add_chat_message(user_id, conversation_id, {"role": "user", "content": message})
+                await redis_client.add_chat_message(user_id, conversation_id, {
+                    "role": "assistant", "content": cached["reply"]
+                })
+                return {
+                    "reply": cached["reply"],
+                    "references": references,
+                    "tokens_used": 0,
+                    "input_tokens": 0,
+                    "output_tokens": 0,
+                    "cached_tokens": 0,
+                    "model_name": cached["model"],
+                    "provider": cached["provider"],
+                    "cost": 0,
+                    "timings": timings
+                }
         
-        # 检测是否包含查找关键词
-        search_keywords = ['查找', '查一下', '帮我查', '搜索', '搜一下', '找一下', '找找', '查询', '检索', '有没有保存', '保存过']
-        has_search_keyword = any(kw in message for kw in search_keywords)
+        web_content = ""
+        if web_result:
+            for page in web_result['pages']:
+                logger.debug("抓取结果: url=%s, success=%s, title=%s, error=%s, 耗时=%sms",
+                             page['url'], page['success'], page['title'], page['error'], page['ms'])
+            timings["web_pages"] = [
+                {"url": page["url"], "ms": page["ms"], "success": page["success"]}
+                for page in web_result["pages"]
+            ]
+            web_content = f"\n\n{web_result['content']}"
+            logger.debug("web_content 长度: %s", len(web_content))
         
-        if not web_search and not url:
-            if use_knowledge:
-                # 用户点了知识库按钮 → 强制检索
-                should_search = True
-            elif user_config.get('enable_rag', False) and has_search_keyword:
-                # 开启了自动检索 + 包含查找关键词 → 检索
-                should_search = True
+        # 预处理：提取免费模型信息（只取模型名称，不受 token 预算影响）
+        free_models_hint = ""
+        if urls and web_content and ('免费' in message or 'free' in message.lower()):
+            # 查找所有包含"免费模型"的行
+            free_models = []
+            for line in web_content.split('\n'):
+                if '免费模型' in line and '|' in line:
+                    # 提取模型名称
+                    match = re.search(r'\[([^\]]+)\]', line)
+                    if match:
+                        free_models.append(match.group(1))
+            if free_models:
+                free_models_hint = f"\n\n=== 免费模型列表（已从网页提取）===\n" + "\n".join([f"• {m}" for m in free_models]) + "\n=== 以上是免费模型 ==="
+                logger.debug("提取到免费模型: %s", free_models)
         
-        if should_search:
-            try:
-                references = await self.search_knowledge(db, user_id, message)
-                if references:
-                    knowledge_context = "\n\n相关知识参考：\n" + "\n".join([
-                        f"- {ref['title']}: {ref['content']}"
-                        for ref in references[:3]
-                    ])
-            except Exception as e:
-                print(f"知识库检索失败: {e}")
+        # 3. 构建消息：网页内容、知识引用、历史消息按模型的 token 预算裁剪（备用路由的模型不同时重新构建）
+        prompts: Dict[str, tuple] = {}
         
-        # 3. 构建消息
-        if url and web_content:
-            # 预处理：提取免费模型信息
-            free_models_hint = ""
-            if '免费' in message or 'free' in message.lower():
-                # 查找所有包含"免费模型"的行
-                lines = web_content.split('\n')
-                free_models = []
-                for line in lines:
-                    if '免费模型' in line and '|' in line:
-                        # 提取模型名称
-                        match = re.search(r'\[([^\]]+)\]', line)
-                        if match:
-                            free_models.append(match.group(1))
-                if free_models:
-                    free_models_hint = f"\n\n=== 免费模型列表（已从网页提取）===\n" + "\n".join([f"• {m}" for m in free_models]) + "\n=== 以上是免费模型 ==="
-                    print(f"[DEBUG] 提取到免费模型: {free_models}")
+        def build_messages(model: str) -> tuple:
+            if model in prompts:
+                return prompts[model]
+            fitted = prompt_builder.fit(
+                model, message,
+                web=web_content,
+                references=references[:KNOWLEDGE_CONTEXT_REFS],
+                history=context_messages[-HISTORY_MESSAGES:],
+                max_output=CHAT_MAX_TOKENS
+            )
+            knowledge_context = ""
+            if fitted["references"]:
+                knowledge_context = "相关知识参考：\n" + "\n".join([
+                    f"- {ref['title']}: {ref['content']}"
+                    for ref in fitted["references"]
+                ])
             
-            # 如果提取到了免费模型，直接告诉 AI 答案
-            if free_models_hint:
-                system_prompt = f"""你是一个智能助手。用户问的是免费模型，我已经从网页中提取出来了：
-{free_models_hint}
-
-请直接把上面的免费模型列表告诉用户，并简单介绍每个模型的用途。"""
-            else:
-                system_prompt = f"""你是一个智能助手。我已经抓取了用户发送的网页内容：
-
-{web_content}
-
-请根据上述内容回答用户的问题。直接给出答案，不要说"没有找到"或"建议访问网页"。"""
-        elif web_search:
-            system_prompt = "你是一个智能助手，可以联网搜索最新信息来回答用户问题。请根据搜索结果给出准确、有用的回答。"
-        elif message.startswith("[转发的聊天记录]"):
-            # 处理转发的聊天记录
-            system_prompt = """你是用户的私人AI助手。用户转发了一段聊天记录给你。
+            # 带参考内容的模式拆成 开场 / 参考内容 / 要求 三段，按布局组装
+            context = ""
+            if urls and web_content:
+                # 如果提取到了免费模型，直接告诉 AI 答案
+                if free_models_hint:
+                    intro = "你是一个智能助手。用户问的是免费模型，我已经从网页中提取出来了"
+                    context = free_models_hint.strip()
+                    instruction = "请直接把上面的免费模型列表告诉用户，并简单介绍每个模型的用途。"
+                else:
+                    intro = "你是一个智能助手。我已经抓取了用户发送的网页内容"
+                    context = fitted["web"].strip()
+                    instruction = '请根据上述内容回答用户的问题。直接给出答案，不要说"没有找到"或"建议访问网页"。'
+            elif web_search:
+                system_prompt = "你是一个智能助手，可以联网搜索最新信息来回答用户问题。请根据搜索结果给出准确、有用的回答。"
+            elif message.startswith("[转发的聊天记录]"):
+                # 处理转发的聊天记录
+                system_prompt = """你是用户的私人AI助手。用户转发了一段聊天记录给你。
 
 请仔细阅读这段聊天记录，然后询问用户需要什么帮助：
 - 总结这段对话的主要内容
@@ -328,77 +533,81 @@ class AIService:
 - 继续聊这个话题
 
 请先简要说明你看到了什么内容，然后询问用户需要你做什么。"""
-        else:
-            if should_search and knowledge_context:
-                # 开启了知识库模式，且找到了内容
-                system_prompt = f"""你是用户的私人AI助手。我从知识库中搜索到以下内容：
-
-{knowledge_context}
-
-请直接把找到的内容告诉用户。"""
-            elif should_search and not knowledge_context:
-                # 开启了知识库模式，但没有找到
-                system_prompt = """你是用户的私人AI助手。当前开启了知识库检索模式，但没有找到相关记录。
-请告诉用户"知识库中暂无此记录"，建议用户可以先保存相关内容，或者关闭知识库模式进行普通对话。"""
             else:
-                # 普通聊天模式
-                system_prompt = """你是用户的私人AI助手。你可以：
+                if should_search and knowledge_context:
+                    # 开启了知识库模式，且找到了内容
+                    intro = "你是用户的私人AI助手。我从知识库中搜索到以下内容"
+                    context = knowledge_context
+                    instruction = "请直接把找到的内容告诉用户。"
+                elif should_search and not knowledge_context:
+                    # 开启了知识库模式，但没有找到
+                    system_prompt = """你是用户的私人AI助手。当前开启了知识库检索模式，但没有找到相关记录。
+请告诉用户"知识库中暂无此记录"，建议用户可以先保存相关内容，或者关闭知识库模式进行普通对话。"""
+                else:
+                    # 普通聊天模式
+                    system_prompt = """你是用户的私人AI助手。你可以：
 1. 回答问题、聊天
 2. 帮用户保存信息到知识库（用户说"帮我保存：xxx"）
 3. 分析用户上传的文件
 
 如果用户想查找知识库内容，需要先点击"知识库"按钮开启检索模式。
 请根据对话历史给出有帮助的回答。"""
-        
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        
-        # 添加历史上下文
-        for ctx in context_messages[-6:]:
-            messages.append({"role": ctx["role"], "content": ctx["content"]})
-        
-        # 添加当前消息
-        messages.append({"role": "user", "content": message})
-        
-        # 4. 调用AI（优先使用用户配置）
-        if web_search:
-            # 联网搜索
-            if user_config.get('search_api_key'):
-                search_client = self.get_client(
-                    user_config.get('search_base_url', settings.QWEN_BASE_URL),
-                    user_config.get('search_api_key')
-                )
-                search_model = user_config.get('search_model', settings.QWEN_CHAT_MODEL)
-            else:
-                search_client = self.qwen_client
-                search_model = settings.QWEN_CHAT_MODEL
             
-            response = await search_client.chat.completions.create(
-                model=search_model,
-                messages=messages,
-                extra_body={"enable_search": True},
-                temperature=0.7,
-                max_tokens=2000
-            )
-        else:
-            # 普通聊天
-            if user_config.get('chat_api_key'):
-                chat_client = self.get_client(
-                    user_config.get('chat_base_url', settings.ZHIPU_BASE_URL),
-                    user_config.get('chat_api_key')
-                )
-                chat_model = user_config.get('chat_model', settings.CHAT_MODEL)
-            else:
-                chat_client = self.client
-                chat_model = settings.CHAT_MODEL
+            user_content = message
+            if context and settings.PROMPT_LAYOUT == "cache":
+                # 稳定前缀在前：系统提示词只含固定说明，参考内容随当前消息发送，
+                # 系统提示词 + 历史消息在多轮对话中保持不变，可以命中服务商的前缀缓存
+                system_prompt = f"{intro}（见用户消息开头的参考内容）。\n\n{instruction}"
+                user_content = f"【参考内容】\n{context}\n\n【用户消息】\n{message}"
+            elif context:
+                system_prompt = f"{intro}：\n\n{context}\n\n{instruction}"
+            
+            messages = [
+                {"role": "system", "content": system_prompt}
+            ]
+            
+            # 添加历史上下文（Redis 中保存的是原始消息，不含参考内容）
+            for ctx in fitted["history"]:
+                messages.append({"role": ctx["role"], "content": ctx["content"]})
+            
+            # 添加当前消息
+            messages.append({"role": "user", "content": user_content})
             
-            response = await chat_client.chat.completions.create(
-                model=chat_model,
+            projected = prompt_builder.count_messages(messages, model)
+            prompts[model] = (messages, projected)
+            timings.setdefault("prompt", {})[model] = {
+                "projected": projected, "budget": fitted["budget"], "truncated": fitted["truncated"]
+            }
+            return prompts[model]
+        
+        # 4. 调用AI（优先使用用户配置，失败/超时由路由器转移到其他服务商）
+        # 准入排队在路由器计时之外：排队超时不算服务商失败，排队时间也不计入延迟
+        @asynccontextmanager
+        async def admit_chat(route: dict):
+            await prompt_builder.warm([route["model"]])  # 用户自定义的模型第一次使用时在线程中加载编码表
+            _, projected = build_messages(route["model"])
+            provider = None if route.get("own_key") else route["provider"]
+            async with ai_scheduler.slot(provider, user_id, PRIORITY_INTERACTIVE, projected + CHAT_MAX_TOKENS) as ticket:
+                yield ticket
+        
+        async def call_chat(route: dict, ticket):
+            messages, _ = build_messages(route["model"])
+            # 支持显式缓存的服务商：在稳定前缀（系统提示词 + 历史消息）末尾加缓存标记
+            messages = prompt_builder.with_cache_hint(messages, route["provider"], route["model"])
+            kwargs = {"extra_body": route["extra_body"]} if route.get("extra_body") else {}
+            response = await route["client"].chat.completions.create(
+                model=route["model"],
                 messages=messages,
                 temperature=0.7,
-                max_tokens=2000
+                max_tokens=CHAT_MAX_TOKENS,
+                **kwargs
             )
+            ai_scheduler.record_usage(ticket, response.usage.total_tokens if response.usage else 0)
+            return response
+        
+        response, used_route = await llm_router.call(
+            self._chat_routes(user_config, web_search), call_chat, admit=admit_chat
+        )
         
         reply = response.choices[0].message.content
         
@@ -419,15 +628,21 @@ class AIService:
                 cached_tokens = getattr(usage, 'prompt_cache', 0) or 0
         
         # 确定使用的模型和服务商
-        if web_search:
-            used_model = search_model
-            used_provider = 'qwen'
-        else:
-            used_model = chat_model
-            used_provider = 'zhipu'
+        used_model = used_route["model"]
+        used_provider = used_route["provider"]
+        
+        # 记录预估与实际输入 token 数（用于校正预算）
+        projected = prompts[used_model][1]
+        timings["prompt"][used_model]["actual"] = input_tokens
+        prompt_builder.record(used_model, projected, input_tokens)
         
         # 计算成本（单位：万分之一元）
-        cost = self.calculate_cost(used_provider, used_model, input_tokens, output_tokens, cached_tokens)
+        cost = self._record_usage(used_provider, used_model, input_tokens, output_tokens, cached_tokens)
+        pricing_version = pricing_table.current_version()
+        
+        # 只缓存首选路由的回答，转移到备用服务商的回答不放进首选模型的桶
+        if answer_bucket and reply and used_model == cache_model:
+            await answer_cache.store(answer_bucket, query_embedding, references, reply, used_model, used_provider)
         
         # 5. 缓存到Redis
         await redis_client.add_chat_message(user_id, conversation_id, {
@@ -448,91 +663,117 @@ class AIService:
             "cached_tokens": cached_tokens,
             "model_name": used_model,
             "provider": used_provider,
-            "cost": cost
+            "cost": cost,
+            "pricing_version": pricing_version,
+            "timings": timings
         }
     
-    async def summarize(self, content: str) -> dict:
+    async def _cached_completion(self, messages: List[dict], temperature: float, user_id: int = None) -> str:
+        """确定性提示词的补全（相同模型+提示词+温度命中缓存，并发相同请求合并）"""
+        model = settings.CHAT_MODEL
+        key = llm_cache.make_key(model, messages, temperature)
+        tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        
+        async def call_upstream() -> str:
+            async with ai_scheduler.slot('zhipu', user_id, PRIORITY_NORMAL, tokens) as ticket:
+                with upstream_timer('zhipu', model):
+                    response = await self.client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature
+                    )
+                ai_scheduler.record_usage(ticket, response.usage.total_tokens if response.usage else 0)
+            if response.usage:
+                self._record_usage('zhipu', model, response.usage.prompt_tokens, response.usage.completion_tokens)
+            return response.choices[0].message.content
+        
+        return await llm_cache.get_or_call(key, call_upstream)
+    
+    async def summarize(self, content: str, user_id: int = None) -> dict:
         """AI总结内容"""
-        response = await self.client.chat.completions.create(
-            model=settings.CHAT_MODEL,
-            messages=[
+        reply = await self._cached_completion(
+            [
                 {
                     "role": "system",
                     "content": "你是一个内容总结专家。请为以下内容生成一个简洁的标题（不超过20字）和摘要（不超过100字）。以JSON格式返回：{\"title\": \"标题\", \"summary\": \"摘要\"}"
                 },
                 {"role": "user", "content": content}
             ],
-            temperature=0.3
+            temperature=0.3,
+            user_id=user_id
         )
         
-        import json
         try:
-            result = json.loads(response.choices[0].message.content)
+            result = json.loads(reply)
             return result
         except:
             return {"title": content[:20], "summary": content[:100]}
     
-    async def generate_tags(self, content: str) -> List[str]:
+    async def generate_tags(self, content: str, user_id: int = None) -> List[str]:
         """AI生成标签"""
-        response = await self.chat_client.chat.completions.create(
-            model=settings.CHAT_MODEL,
-            messages=[
+        reply = await self._cached_completion(
+            [
                 {
                     "role": "system",
                     "content": "你是一个内容分析专家。请为以下内容生成3-5个相关标签，以JSON数组格式返回，如：[\"标签1\", \"标签2\"]"
                 },
                 {"role": "user", "content": content}
             ],
-            temperature=0.3
+            temperature=0.3,
+            user_id=user_id
         )
         
-        import json
         try:
-            tags = json.loads(response.choices[0].message.content)
+            tags = json.loads(reply)
             return tags[:5]
         except:
             return []
     
-    async def parse_file(self, file_url: str, prompt: str = "描述这个文件的内容") -> dict:
+    async def parse_file(self, file_url: str, prompt: str = "描述这个文件的内容", user_id: int = None) -> dict:
         """使用 Qwen-Doc-Turbo 解析文件（图片/PDF/Word/Excel）
         
         需要使用 DashScope 原生协议
         """
         try:
             async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation",
-                    headers={
-                        "Authorization": f"Bearer {settings.QWEN_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": settings.QWEN_DOC_MODEL,
-                        "input": {
-                            "messages": [
-                                {"role": "system", "content": "You are a helpful assistant."},
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {"type": "text", "text": prompt},
-                                        {"type": "doc_url", "doc_url": [file_url]}
+                async with ai_scheduler.slot('qwen', user_id, PRIORITY_BACKGROUND, estimate_tokens(prompt)):
+                    with upstream_timer('qwen', settings.QWEN_DOC_MODEL):
+                        response = await client.post(
+                            f"{settings.DASHSCOPE_BASE_URL}/api/v1/services/aigc/text-generation/generation",
+                            headers={
+                                "Authorization": f"Bearer {settings.QWEN_API_KEY}",
+                                "Content-Type": "application/json"
+                            },
+                            json={
+                                "model": settings.QWEN_DOC_MODEL,
+                                "input": {
+                                    "messages": [
+                                        {"role": "system", "content": "You are a helpful assistant."},
+                                        {
+                                            "role": "user",
+                                            "content": [
+                                                {"type": "text", "text": prompt},
+                                                {"type": "doc_url", "doc_url": [file_url]}
+                                            ]
+                                        }
                                     ]
                                 }
-                            ]
-                        }
-                    }
-                )
+                            }
+                        )
                 
                 result = response.json()
                 
                 if "output" in result and "choices" in result["output"]:
                     content = result["output"]["choices"][0]["message"]["content"]
                     usage = result.get("usage", {})
+                    cost = self._record_usage('qwen', settings.QWEN_DOC_MODEL,
+                                              usage.get("input_tokens", 0), usage.get("output_tokens", 0))
                     return {
                         "success": True,
                         "content": content,
                         "input_tokens": usage.get("input_tokens", 0),
                         "output_tokens": usage.get("output_tokens", 0),
+                        "cost": cost,
                         "model": settings.QWEN_DOC_MODEL,
                         "provider": "qwen"
                     }
@@ -543,7 +784,7 @@ class AIService:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    async def parse_file_base64(self, file_data: bytes, file_type: str, prompt: str = "描述这个文件的内容") -> dict:
+    async def parse_file_base64(self, file_data: bytes, file_type: str, prompt: str = "描述这个文件的内容", user_id: int = None) -> dict:
         """使用 base64 编码解析本地文件"""
         try:
             # 转换为 base64
@@ -568,33 +809,41 @@ class AIService:
             # 对于图片，可以用 image_url 方式
             if file_type.lower() in ['jpg', 'jpeg', 'png', 'gif']:
                 async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.post(
-                        "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {settings.QWEN_API_KEY}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": "qwen-vl-plus",
-                            "messages": [
-                                {
-                                    "role": "user",
-                                    "content": [
-                                        {"type": "text", "text": prompt},
-                                        {"type": "image_url", "image_url": {"url": data_url}}
+                    async with ai_scheduler.slot('qwen', user_id, PRIORITY_NORMAL, estimate_tokens(prompt)):
+                        with upstream_timer('qwen', 'qwen-vl-plus'):
+                            response = await client.post(
+                                f"{settings.QWEN_BASE_URL}/chat/completions",
+                                headers={
+                                    "Authorization": f"Bearer {settings.QWEN_API_KEY}",
+                                    "Content-Type": "application/json"
+                                },
+                                json={
+                                    "model": "qwen-vl-plus",
+                                    "messages": [
+                                        {
+                                            "role": "user",
+                                            "content": [
+                                                {"type": "text", "text": prompt},
+                                                {"type": "image_url", "image_url": {"url": data_url}}
+                                            ]
+                                        }
                                     ]
                                 }
-                            ]
-                        }
-                    )
+                            )
                     
                     result = response.json()
                     if "choices" in result:
+                        usage = result.get("usage", {})
+                        cost = self._record_usage('qwen', 'qwen-vl-plus',
+                                                  usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
                         return {
                             "success": True,
                             "content": result["choices"][0]["message"]["content"],
                             "model": "qwen-vl-plus",
-                            "provider": "qwen"
+                            "provider": "qwen",
+                            "input_tokens": usage.get("prompt_tokens", 0),
+                            "output_tokens": usage.get("completion_tokens", 0),
+                            "cost": cost
                         }
                     else:
                         return {"success": False, "error": result.get("error", {}).get("message", "未知错误")}
@@ -605,7 +854,7 @@ class AIService:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    async def parse_document(self, file_data: bytes, filename: str, prompt: str = "请描述这个文件的内容") -> dict:
+    async def parse_document(self, file_data: bytes, filename: str, prompt: str = "请描述这个文件的内容", user_id: int = None) -> dict:
         """使用 qwen-doc-turbo 解析文档（支持 PDF/Word/Excel/PPT/图片）
         
         步骤：1. 通过 OpenAI 兼容接口上传文件获取 file_id  2. 调用 qwen-doc-turbo 解析
@@ -613,18 +862,19 @@ class AIService:
         try:
             async with httpx.AsyncClient(timeout=120.0) as client:
                 # 步骤1：通过 OpenAI 兼容接口上传文件
-                upload_response = await client.post(
-                    "https://dashscope.aliyuncs.com/compatible-mode/v1/files",
-                    headers={
-                        "Authorization": f"Bearer {settings.QWEN_API_KEY}"
-                    },
-                    files={
-                        "file": (filename, file_data),
-                    },
-                    data={
-                        "purpose": "file-extract"
-                    }
-                )
+                async with ai_scheduler.slot('qwen', user_id, PRIORITY_BACKGROUND):
+                    upload_response = await client.post(
+                        f"{settings.QWEN_BASE_URL}/files",
+                        headers={
+                            "Authorization": f"Bearer {settings.QWEN_API_KEY}"
+                        },
+                        files={
+                            "file": (filename, file_data),
+                        },
+                        data={
+                            "purpose": "file-extract"
+                        }
+                    )
                 
                 upload_result = upload_response.json()
                 
@@ -635,25 +885,26 @@ class AIService:
                     return {"success": False, "error": error_msg}
                 
                 # 步骤2：等待文件解析完成后调用 qwen-doc-turbo (OpenAI 兼容接口)
-                import asyncio
                 max_retries = 5
                 
                 for retry in range(max_retries):
-                    response = await client.post(
-                        "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions",
-                        headers={
-                            "Authorization": f"Bearer {settings.QWEN_API_KEY}",
-                            "Content-Type": "application/json"
-                        },
-                        json={
-                            "model": "qwen-doc-turbo",
-                            "messages": [
-                                {"role": "system", "content": "You are a helpful assistant."},
-                                {"role": "system", "content": f"fileid://{file_id}"},
-                                {"role": "user", "content": prompt}
-                            ]
-                        }
-                    )
+                    async with ai_scheduler.slot('qwen', user_id, PRIORITY_BACKGROUND, estimate_tokens(prompt)):
+                        with upstream_timer('qwen', 'qwen-doc-turbo'):
+                            response = await client.post(
+                                f"{settings.QWEN_BASE_URL}/chat/completions",
+                                headers={
+                                    "Authorization": f"Bearer {settings.QWEN_API_KEY}",
+                                    "Content-Type": "application/json"
+                                },
+                                json={
+                                    "model": "qwen-doc-turbo",
+                                    "messages": [
+                                        {"role": "system", "content": "You are a helpful assistant."},
+                                        {"role": "system", "content": f"fileid://{file_id}"},
+                                        {"role": "user", "content": prompt}
+                                    ]
+                                }
+                            )
                     
                     result = response.json()
                     
@@ -665,13 +916,16 @@ class AIService:
                     
                     if "choices" in result:
                         usage = result.get("usage", {})
+                        cost = self._record_usage('qwen', 'qwen-doc-turbo',
+                                                  usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
                         return {
                             "success": True,
                             "content": result["choices"][0]["message"]["content"],
                             "model": "qwen-doc-turbo",
                             "provider": "qwen",
                             "input_tokens": usage.get("prompt_tokens", 0),
-                            "output_tokens": usage.get("completion_tokens", 0)
+                            "output_tokens": usage.get("completion_tokens", 0),
+                            "cost": cost
                         }
                     else:
                         return {"success": False, "error": error_msg or "文档解析失败"}
@@ -681,99 +935,94 @@ class AIService:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    async def parse_image(self, image_data_url: str, prompt: str = "请描述这张图片的内容") -> dict:
-        """使用智谱 GLM 视觉模型解析图片（GLM-4V-Flash / GLM-4.1V-Thinking-Flash 轮换）"""
+    def _admit_vision(self, prompt: str, user_id: int = None):
+        """视觉模型调用的准入（由路由器在计时之前获取）"""
+        return lambda route: ai_scheduler.slot('zhipu', user_id, PRIORITY_NORMAL, estimate_tokens(prompt) + 2000)
+    
+    async def _call_vision(self, route: dict, image_data_url: str, prompt: str) -> dict:
+        """调用智谱视觉模型（已获得准入名额），返回失败时抛出异常以便路由器转移"""
+        vision_model = route["model"]
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            response = await client.post(
+                f"{settings.ZHIPU_BASE_URL}/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {settings.ZHIPU_API_KEY}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": vision_model,
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": [
+                                {"type": "image_url", "image_url": {"url": image_data_url}},
+                                {"type": "text", "text": prompt}
+                            ]
+                        }
+                    ],
+                    "max_tokens": 2000
+                }
+            )
+            
+            result = response.json()
+            # 只记录摘要，不输出完整响应（可能很大）
+            logger.debug("图片解析响应 model=%s keys=%s usage=%s",
+                         vision_model, list(result.keys()), result.get("usage"))
+            
+            if "choices" not in result:
+                error_msg = result.get("error", {}).get("message", "图片解析失败")
+                raise UpstreamError(error_msg)
+            
+            usage = result.get("usage", {})
+            cost = self._record_usage('zhipu', vision_model,
+                                      usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+            return {
+                "success": True,
+                "content": result["choices"][0]["message"]["content"],
+                "model": vision_model,
+                "provider": "zhipu",
+                "input_tokens": usage.get("prompt_tokens", 0),
+                "output_tokens": usage.get("completion_tokens", 0),
+                "cost": cost
+            }
+    
+    async def parse_image(self, image_data_url: str, prompt: str = "请描述这张图片的内容", user_id: int = None) -> dict:
+        """使用智谱 GLM 视觉模型解析图片（GLM-4V-Flash / GLM-4.1V-Thinking-Flash 轮换，失败自动切换）"""
         try:
-            # 获取下一个视觉模型
-            vision_model = self.get_next_vision_model()
+            # 轮换起点，由路由器按健康度排序并故障转移
+            first = self.get_next_vision_model()
+            routes = self._vision_routes()
+            routes.sort(key=lambda r: r["model"] != first)
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{settings.ZHIPU_BASE_URL}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {settings.ZHIPU_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": vision_model,
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "image_url", "image_url": {"url": image_data_url}},
-                                    {"type": "text", "text": prompt}
-                                ]
-                            }
-                        ],
-                        "max_tokens": 2000
-                    }
-                )
-                
-                result = response.json()
-                print(f"[DEBUG] 图片解析API响应 model={vision_model}: {result}")
-                
-                if "choices" in result:
-                    usage = result.get("usage", {})
-                    return {
-                        "success": True,
-                        "content": result["choices"][0]["message"]["content"],
-                        "model": vision_model,
-                        "provider": "zhipu",
-                        "input_tokens": usage.get("prompt_tokens", 0),
-                        "output_tokens": usage.get("completion_tokens", 0)
-                    }
-                else:
-                    error_msg = result.get("error", {}).get("message", "图片解析失败")
-                    print(f"[ERROR] 图片解析失败: {result}")
-                    return {"success": False, "error": f"图片解析失败: {error_msg}"}
-                    
+            result, _ = await llm_router.call(
+                routes,
+                lambda route, ticket: self._call_vision(route, image_data_url, prompt),
+                hedge=False,
+                admit=self._admit_vision(prompt, user_id)
+            )
+            return result
+        except UpstreamError as e:
+            logger.warning("图片解析失败: %s", e)
+            return {"success": False, "error": f"图片解析失败: {e}"}
         except Exception as e:
-            print(f"[ERROR] 图片解析异常: {e}")
+            logger.exception("图片解析异常: %s", e)
             return {"success": False, "error": str(e)}
     
-    async def parse_image_with_model(self, image_data_url: str, prompt: str, model: str = None) -> dict:
+    async def parse_image_with_model(self, image_data_url: str, prompt: str, model: str = None, user_id: int = None) -> dict:
         """使用指定的视觉模型解析图片"""
         try:
-            vision_model = model or self.get_next_vision_model()
+            if model:
+                routes = [{"provider": "zhipu", "model": model}]
+            else:
+                routes = [{"provider": "zhipu", "model": self.get_next_vision_model()}]
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(
-                    f"{settings.ZHIPU_BASE_URL}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {settings.ZHIPU_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": vision_model,
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "image_url", "image_url": {"url": image_data_url}},
-                                    {"type": "text", "text": prompt}
-                                ]
-                            }
-                        ],
-                        "max_tokens": 2000
-                    }
-                )
-                
-                result = response.json()
-                
-                if "choices" in result:
-                    usage = result.get("usage", {})
-                    return {
-                        "success": True,
-                        "content": result["choices"][0]["message"]["content"],
-                        "model": vision_model,
-                        "provider": "zhipu",
-                        "input_tokens": usage.get("prompt_tokens", 0),
-                        "output_tokens": usage.get("completion_tokens", 0)
-                    }
-                else:
-                    error_msg = result.get("error", {}).get("message", "图片解析失败")
-                    return {"success": False, "error": error_msg}
-                    
+            result, _ = await llm_router.call(
+                routes,
+                lambda route, ticket: self._call_vision(route, image_data_url, prompt),
+                hedge=False,
+                admit=self._admit_vision(prompt, user_id)
+            )
+            return result
         except Exception as e:
             return {"success": False, "error": str(e)}
 
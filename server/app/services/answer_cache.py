@@ -0,0 +1,148 @@
+"""知识库问答语义缓存
+
+- 只缓存知识库检索模式下的回答；检索（向量化 + 向量查询）照常执行，命中时省掉模型调用
+- 分桶：(用户, 模型, 引用的知识 id + updated_at)。引用集合或任意一条知识的版本变化，都会落到新的桶
+- 桶内按问题向量的余弦相似度查找（不低于 ANSWER_CACHE_SIMILARITY 视为同一问题）
+- 反向索引 answer:ref:{knowledge_id} 记录引用了该知识的桶，知识更新 / 删除时立即清除
+- 存在 Redis 中，多进程共享；向量以 float32 归一化后存储
+"""
+import base64
+import hashlib
+import json
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.redis import redis_client
+from app.models.knowledge import Knowledge
+
+logger = logging.getLogger(__name__)
+
+# KEYS: 桶, 引用知识的反向索引...；ARGV: 条目 JSON, 桶容量, 过期时间
+_STORE = """
+redis.call('LPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+for i = 2, #KEYS do
+    redis.call('SADD', KEYS[i], KEYS[1])
+    redis.call('EXPIRE', KEYS[i], ARGV[3])
+end
+return 1
+"""
+
+# KEYS: 反向索引...；删除其中记录的所有桶和索引本身
+_INVALIDATE = """
+local removed = 0
+for i = 1, #KEYS do
+    local buckets = redis.call('SMEMBERS', KEYS[i])
+    for _, bucket in ipairs(buckets) do
+        removed = removed + redis.call('DEL', bucket)
+    end
+    redis.call('DEL', KEYS[i])
+end
+return removed
+"""
+
+
+def _ref_key(knowledge_id: int) -> str:
+    return f"answer:ref:{knowledge_id}"
+
+
+def _normalize(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    def __init__(self):
+        self.enabled = settings.ANSWER_CACHE_ENABLED
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "invalidations": 0}
+
+    async def bucket_key(self, db: AsyncSession, user_id: int, model: str, references: List[dict]) -> Optional[str]:
+        """根据引用的知识及其当前版本计算桶；引用不是当前有效的知识时返回 None"""
+        ids = sorted({ref["id"] for ref in references})
+        result = await db.execute(
+            select(Knowledge.id, Knowledge.updated_at).where(
+                Knowledge.id.in_(ids), Knowledge.user_id == user_id, Knowledge.status == 1
+            )
+        )
+        versions = {row.id: row.updated_at for row in result}
+        if len(versions) != len(ids):
+            return None
+        signature = ",".join(
+            f"{i}@{versions[i].timestamp() if versions[i] else 0}" for i in ids
+        )
+        digest = hashlib.sha1(signature.encode("utf-8")).hexdigest()
+        return f"answer:{user_id}:{model}:{digest}"
+
+    async def lookup(self, bucket: str, query_embedding: List[float]) -> Optional[Dict]:
+        """桶内找最相似的问题，超过阈值返回缓存的回答"""
+        try:
+            raw_entries = await redis_client.lrange(bucket, 0, -1)
+        except Exception as e:
+            logger.warning("读取回答缓存失败: %s", e)
+            return None
+        entries = []
+        for raw in raw_entries:
+            try:
+                entries.append(json.loads(raw))
+            except ValueError:
+                continue
+        if not entries:
+            self.stats["misses"] += 1
+            return None
+        matrix = np.stack([np.frombuffer(base64.b64decode(e["embedding"]), dtype=np.float32) for e in entries])
+        scores = matrix @ _normalize(query_embedding)
+        best = int(np.argmax(scores))
+        if scores[best] < settings.ANSWER_CACHE_SIMILARITY:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        entry = entries[best]
+        entry["similarity"] = round(float(scores[best]), 4)
+        return entry
+
+    async def store(self, bucket: str, query_embedding: List[float], references: List[dict],
+                    reply: str, model: str, provider: str):
+        entry = {
+            "embedding": base64.b64encode(_normalize(query_embedding).tobytes()).decode("ascii"),
+            "reply": reply,
+            "model": model,
+            "provider": provider,
+            "created": int(time.time())
+        }
+        keys = [bucket] + [_ref_key(i) for i in sorted({ref["id"] for ref in references})]
+        try:
+            await redis_client.eval(_STORE, keys, [
+                json.dumps(entry, ensure_ascii=False), settings.ANSWER_CACHE_BUCKET_SIZE, settings.ANSWER_CACHE_TTL
+            ])
+            self.stats["stores"] += 1
+        except Exception as e:
+            logger.warning("写入回答缓存失败: %s", e)
+
+    async def invalidate(self, knowledge_ids: Iterable[int]):
+        """知识更新 / 删除后调用，清除引用了这些知识的缓存"""
+        keys = [_ref_key(i) for i in set(knowledge_ids) if i]
+        if not keys or not self.enabled:
+            return
+        try:
+            removed = await redis_client.eval(_INVALIDATE, keys, [])
+            self.stats["invalidations"] += removed or 0
+        except Exception as e:
+            logger.warning("清除回答缓存失败: %s", e)
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hitRatio": round(self.stats["hits"] / lookups, 3) if lookups else 0
+        }
+
+
+answer_cache = AnswerCache()
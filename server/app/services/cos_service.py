@@ -1,6 +1,7 @@
 """腾讯云 COS 文件存储服务"""
 from qcloud_cos import CosConfig, CosS3Client
 from app.core.config import settings
+from app.core.tracing import tracer
 import uuid
 from datetime import datetime
 import os
@@ -12,10 +13,15 @@ class COSService:
             Region=settings.COS_REGION,
             SecretId=settings.COS_SECRET_ID,
             SecretKey=settings.COS_SECRET_KEY,
+            Domain=settings.COS_DOMAIN or None,
+            Scheme=settings.COS_SCHEME,
         )
         self.client = CosS3Client(config)
         self.bucket = settings.COS_BUCKET
-        self.base_url = f"https://{settings.COS_BUCKET}.cos.{settings.COS_REGION}.myqcloud.com"
+        if settings.COS_DOMAIN:
+            self.base_url = f"{settings.COS_SCHEME}://{settings.COS_DOMAIN}"
+        else:
+            self.base_url = f"https://{settings.COS_BUCKET}.cos.{settings.COS_REGION}.myqcloud.com"
     
     def upload_file(self, file_data: bytes, filename: str, user_id: int, folder: str = "files") -> dict:
         """上传文件到 COS
@@ -37,12 +43,13 @@ class COSService:
             key = f"{folder}/user_{user_id}/{date_path}/{unique_name}"
             
             # 上传到 COS
-            self.client.put_object(
-                Bucket=self.bucket,
-                Body=file_data,
-                Key=key,
-                ContentType=self._get_content_type(ext)
-            )
+            with tracer.span("cos.put_object", kind="client", key=key, size=len(file_data)):
+                self.client.put_object(
+                    Bucket=self.bucket,
+                    Body=file_data,
+                    Key=key,
+                    ContentType=self._get_content_type(ext)
+                )
             
             # 返回访问 URL
             url = f"{self.base_url}/{key}"
@@ -60,10 +67,11 @@ class COSService:
     def delete_file(self, key: str) -> bool:
         """删除 COS 文件"""
         try:
-            self.client.delete_object(
-                Bucket=self.bucket,
-                Key=key
-            )
+            with tracer.span("cos.delete_object", kind="client", key=key):
+                self.client.delete_object(
+                    Bucket=self.bucket,
+                    Key=key
+                )
             return True
         except Exception:
             return False
@@ -0,0 +1,137 @@
+"""计数缓存服务
+
+- 用户统计（知识数/会话数/AI调用数）：缓存在 Redis 哈希中，写入时原子自增，
+  过期后从数据库重新统计（定期校准）。回填只在缓存不存在时写入，不覆盖并发请求已回填并自增过的计数
+- 分类计数：直接维护 categories.count 字段，与知识的增删在同一事务中更新；
+  启动时的全量校准用 Redis 锁保证多进程部署时只有一个进程执行
+"""
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func, text
+from typing import Dict, Optional
+
+from app.core.redis import redis_client
+from app.models.knowledge import Knowledge, Category
+from app.models.conversation import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+USER_STATS_TTL = 3600  # 1小时后从数据库重新校准
+USER_STATS_FIELDS = ("knowledge", "conversation", "aiCalls")
+CATEGORY_RECONCILE_LOCK_KEY = "counter:category:reconcile:lock"
+CATEGORY_RECONCILE_LOCK_TTL = 300  # 其他进程在此期间启动时跳过校准
+
+# 仅当计数已缓存时才自增，避免在空键上生成不完整的计数
+_INCR_IF_EXISTS = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+end
+return nil
+"""
+
+# 缓存不存在（或字段不全）时才回填，返回回填后缓存中的计数
+# ARGV: 过期时间, 字段1, 值1, 字段2, 值2, ...
+_SET_IF_MISSING = """
+local n = (#ARGV - 1) / 2
+for i = 1, n do
+    if redis.call('HEXISTS', KEYS[1], ARGV[2 * i]) == 0 then
+        redis.call('DEL', KEYS[1])
+        for j = 1, n do
+            redis.call('HSET', KEYS[1], ARGV[2 * j], ARGV[2 * j + 1])
+        end
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+        break
+    end
+end
+local fields = {}
+for i = 1, n do
+    fields[i] = ARGV[2 * i]
+end
+return redis.call('HMGET', KEYS[1], unpack(fields))
+"""
+
+
+def _stats_key(user_id: int) -> str:
+    return f"user:stats:{user_id}"
+
+
+class CounterService:
+    async def get_user_stats(self, db: AsyncSession, user_id: int) -> Dict[str, int]:
+        """获取用户统计（优先读缓存，未命中时从数据库统计并回填）"""
+        try:
+            cached = await redis_client.hgetall(_stats_key(user_id))
+            if cached and all(f in cached for f in USER_STATS_FIELDS):
+                return {f: max(0, int(cached[f])) for f in USER_STATS_FIELDS}
+        except Exception as e:
+            logger.warning("读取统计缓存失败: %s", e)
+        return await self.reconcile_user_stats(db, user_id)
+
+    async def reconcile_user_stats(self, db: AsyncSession, user_id: int) -> Dict[str, int]:
+        """从数据库统计用户计数并回填缓存
+
+        统计期间其他请求可能已经回填并自增过缓存，此时以缓存为准（只在缓存缺失时写入）。
+        """
+        knowledge_count = await db.scalar(
+            select(func.count()).select_from(Knowledge).where(Knowledge.user_id == user_id, Knowledge.status == 1)
+        )
+        conversation_count = await db.scalar(
+            select(func.count()).select_from(Conversation).where(Conversation.user_id == user_id, Conversation.status == 1)
+        )
+        message_count = await db.scalar(
+            select(func.count()).select_from(Message).where(Message.user_id == user_id, Message.role == "assistant")
+        )
+        stats = {
+            "knowledge": knowledge_count or 0,
+            "conversation": conversation_count or 0,
+            "aiCalls": message_count or 0
+        }
+        args = [USER_STATS_TTL]
+        for field in USER_STATS_FIELDS:
+            args += [field, stats[field]]
+        try:
+            cached = await redis_client.eval(_SET_IF_MISSING, [_stats_key(user_id)], args)
+            return {f: max(0, int(v)) for f, v in zip(USER_STATS_FIELDS, cached)}
+        except Exception as e:
+            logger.warning("写入统计缓存失败: %s", e)
+        return stats
+
+    async def incr_user_stat(self, user_id: int, field: str, amount: int = 1):
+        """计数自增（在数据库提交成功后调用）"""
+        if not amount:
+            return
+        try:
+            await redis_client.eval(_INCR_IF_EXISTS, [_stats_key(user_id)], [field, amount])
+        except Exception as e:
+            logger.warning("更新统计缓存失败: %s", e)
+
+    async def adjust_category_count(self, db: AsyncSession, category_id: Optional[int], delta: int):
+        """调整分类计数（不提交，随调用方事务一起提交）"""
+        if not category_id or not delta:
+            return
+        await db.execute(
+            update(Category)
+            .where(Category.id == category_id)
+            .values(count=func.greatest(func.coalesce(Category.count, 0) + delta, 0))
+        )
+
+    async def reconcile_category_counts(self, db: AsyncSession) -> bool:
+        """按知识表重新校准所有分类计数（启动时执行一次），其他进程正在或刚刚校准过时跳过，返回是否执行"""
+        if not await redis_client.set_nx(CATEGORY_RECONCILE_LOCK_KEY, "1", ex=CATEGORY_RECONCILE_LOCK_TTL):
+            return False
+        await db.execute(text("""
+            UPDATE categories c
+            SET count = s.cnt
+            FROM (
+                SELECT c2.id, COUNT(k.id) AS cnt
+                FROM categories c2
+                LEFT JOIN knowledge k ON k.category_id = c2.id AND k.status = 1
+                GROUP BY c2.id
+            ) s
+            WHERE c.id = s.id AND c.count IS DISTINCT FROM s.cnt
+        """))
+        await db.commit()
+        return True
+
+
+counter_service = CounterService()
@@ -0,0 +1,290 @@
+"""知识去重
+
+- 入库前检查：先按正文哈希精确匹配，再用 pgvector 找用户已有知识中最相近的一条，
+  相似度超过阈值视为重复
+- 调用方选择处理方式：merge（合并到已有条目）/ skip（不保存，返回已有条目）/ force（照常保存）
+- 批量去重：对已有数据按哈希和向量近邻分组，每组保留最早的一条，与它本身相似度达到阈值的条目软删除
+  （不按相似关系传递合并；支持 dry_run 预览）
+"""
+import hashlib
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.models.knowledge import Knowledge
+from app.services.ai_service import ai_service
+from app.services.answer_cache import answer_cache
+from app.services.counter_service import counter_service
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ("merge", "skip", "force")
+HASH_BACKFILL_BATCH = 500
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def _embedding_str(embedding: List[float]) -> str:
+    return '[' + ','.join(map(str, embedding)) + ']'
+
+
+class DedupService:
+    # ============ 入库前检查 ============
+
+    async def find_duplicate(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        content: str,
+        embedding: Optional[List[float]] = None,
+        threshold: Optional[float] = None
+    ) -> Optional[Dict]:
+        """返回 {id, title, similarity, match(exact/similar)}，没有重复时返回 None"""
+        digest = content_hash(content)
+        result = await db.execute(
+            select(Knowledge.id, Knowledge.title).where(
+                Knowledge.user_id == user_id,
+                Knowledge.status == 1,
+                Knowledge.content_hash == digest
+            ).order_by(Knowledge.id).limit(1)
+        )
+        row = result.first()
+        if row:
+            return {"id": row.id, "title": row.title, "similarity": 1.0, "match": "exact"}
+
+        if embedding is None:
+            return None
+        threshold = settings.DEDUP_SIMILARITY_THRESHOLD if threshold is None else threshold
+        try:
+            result = await db.execute(text("""
+                SELECT id, title, 1 - (embedding <=> cast(:embedding as vector)) AS similarity
+                FROM knowledge
+                WHERE user_id = :user_id AND status = 1 AND embedding IS NOT NULL
+                ORDER BY embedding <=> cast(:embedding as vector)
+                LIMIT 1
+            """), {"embedding": _embedding_str(embedding), "user_id": user_id})
+            row = result.first()
+        except Exception as e:
+            logger.warning("重复检测向量查询失败: %s", e)
+            await db.rollback()
+            return None
+        if row and row.similarity >= threshold:
+            return {"id": row.id, "title": row.title, "similarity": round(row.similarity, 4), "match": "similar"}
+        return None
+
+    async def save(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        title: str,
+        content: str,
+        summary: Optional[str] = None,
+        source: str = "manual",
+        tags: Optional[List[str]] = None,
+        category_id: Optional[int] = None,
+        embedding_text: Optional[str] = None,
+        on_duplicate: Optional[str] = None
+    ) -> Dict:
+        """去重后保存知识，返回 {status(created/merged/skipped), id, title, duplicate}"""
+        action = on_duplicate or settings.DEDUP_DEFAULT_ACTION
+        embedding = await ai_service.get_embedding(embedding_text or (title + " " + content), user_id=user_id)
+
+        duplicate = None
+        if settings.DEDUP_ENABLED and action != "force":
+            duplicate = await self.find_duplicate(db, user_id, content, embedding)
+
+        if duplicate and action == "skip":
+            return {"status": "skipped", "id": duplicate["id"], "title": duplicate["title"], "duplicate": duplicate}
+        if duplicate and action == "merge":
+            merged = await self._merge(db, user_id, duplicate["id"], content, summary, tags, category_id)
+            if merged:
+                return {"status": "merged", "id": duplicate["id"], "title": duplicate["title"], "duplicate": duplicate}
+
+        knowledge = Knowledge(
+            user_id=user_id,
+            title=title,
+            content=content,
+            summary=summary,
+            source=source,
+            tags=tags or [],
+            category_id=category_id,
+            embedding=embedding,
+            token_count=len(content),
+            content_hash=content_hash(content)
+        )
+        db.add(knowledge)
+        await counter_service.adjust_category_count(db, category_id, 1)
+        await db.commit()
+        await db.refresh(knowledge)
+        await counter_service.incr_user_stat(user_id, "knowledge", 1)
+        return {"status": "created", "id": knowledge.id, "title": title, "duplicate": duplicate}
+
+    async def _merge(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        knowledge_id: int,
+        content: str,
+        summary: Optional[str],
+        tags: Optional[List[str]],
+        category_id: Optional[int]
+    ) -> bool:
+        """合并到已有条目：标签取并集，补齐空的摘要/分类；新内容不在原文中时追加并重新向量化"""
+        result = await db.execute(
+            select(Knowledge).where(Knowledge.id == knowledge_id, Knowledge.user_id == user_id, Knowledge.status == 1)
+        )
+        existing = result.scalar_one_or_none()
+        if existing is None:
+            return False
+        existing.tags = list(dict.fromkeys((existing.tags or []) + (tags or [])))
+        if summary and not existing.summary:
+            existing.summary = summary
+        if category_id and not existing.category_id:
+            existing.category_id = category_id
+            await counter_service.adjust_category_count(db, category_id, 1)
+        if content.strip() not in existing.content:
+            existing.content = existing.content.rstrip() + "\n\n" + content.strip()
+            existing.content_hash = content_hash(existing.content)
+            existing.token_count = len(existing.content)
+            existing.embedding = await ai_service.get_embedding(
+                existing.title + " " + existing.content, user_id=user_id
+            )
+        await db.commit()
+        await answer_cache.invalidate([knowledge_id])
+        return True
+
+    # ============ 批量去重 ============
+
+    async def _backfill_hashes(self, db: AsyncSession, user_id: int) -> int:
+        """给没有正文哈希的历史数据补齐哈希"""
+        filled = 0
+        while True:
+            result = await db.execute(
+                select(Knowledge.id, Knowledge.content).where(
+                    Knowledge.user_id == user_id, Knowledge.status == 1, Knowledge.content_hash.is_(None)
+                ).limit(HASH_BACKFILL_BATCH)
+            )
+            rows = result.all()
+            if not rows:
+                break
+            # 按主键批量更新（executemany）
+            await db.execute(update(Knowledge), [
+                {"id": row.id, "content_hash": content_hash(row.content)} for row in rows
+            ])
+            await db.commit()
+            filled += len(rows)
+        return filled
+
+    async def dedup_existing(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        threshold: Optional[float] = None,
+        dry_run: bool = True
+    ) -> Dict:
+        """对用户已有知识去重，返回 {groups: [{keep, duplicates: [{id, similarity}]}], removed, hashed}"""
+        threshold = settings.DEDUP_SIMILARITY_THRESHOLD if threshold is None else threshold
+        hashed = await self._backfill_hashes(db, user_id)
+
+        pairs = []  # (较早的 id, 较晚的 id, 相似度)
+        result = await db.execute(text("""
+            SELECT MIN(id) AS keep_id, array_agg(id ORDER BY id) AS ids
+            FROM knowledge
+            WHERE user_id = :user_id AND status = 1 AND content_hash IS NOT NULL
+            GROUP BY content_hash
+            HAVING COUNT(*) > 1
+        """), {"user_id": user_id})
+        for row in result:
+            pairs.extend((row.keep_id, dup_id, 1.0) for dup_id in row.ids if dup_id != row.keep_id)
+
+        # 每条只和 id 更大的近邻比较，近邻查询走向量索引
+        try:
+            result = await db.execute(text("""
+                SELECT a.id AS keep_id, b.id AS dup_id, 1 - b.distance AS similarity
+                FROM knowledge a
+                CROSS JOIN LATERAL (
+                    SELECT k.id, k.embedding <=> a.embedding AS distance
+                    FROM knowledge k
+                    WHERE k.user_id = a.user_id AND k.status = 1 AND k.embedding IS NOT NULL AND k.id > a.id
+                    ORDER BY k.embedding <=> a.embedding
+                    LIMIT :neighbors
+                ) b
+                WHERE a.user_id = :user_id AND a.status = 1 AND a.embedding IS NOT NULL
+                  AND 1 - b.distance >= :threshold
+            """), {"user_id": user_id, "neighbors": settings.DEDUP_NEIGHBORS, "threshold": threshold})
+            pairs.extend((row.keep_id, row.dup_id, round(row.similarity, 4)) for row in result)
+        except Exception as e:
+            logger.warning("批量去重向量查询失败: %s", e)
+            await db.rollback()
+
+        groups = self._group(pairs)
+        removed = 0
+        if not dry_run and groups:
+            removed = await self._remove_duplicates(db, user_id, groups)
+        return {"groups": groups, "removed": removed, "hashed": hashed, "dryRun": dry_run}
+
+    @staticmethod
+    def _group(pairs: List[tuple]) -> List[Dict]:
+        """按 id 从小到大分组：每组以最小（最早）的 id 为保留项，只收入与保留项本身相似的条目
+
+        不做传递合并：A≈B、B≈C 但 C 与 A 不相似时，C 不会因为 B 被删除；
+        已经归入某组（保留或删除）的条目不再参与后面的分组。
+        """
+        similar: Dict[int, Dict[int, float]] = {}
+        for keep_id, dup_id, similarity in pairs:
+            dups = similar.setdefault(keep_id, {})
+            dups[dup_id] = max(dups.get(dup_id, 0), similarity)
+
+        assigned = set()
+        groups = []
+        for keep_id in sorted(similar):
+            if keep_id in assigned:
+                continue
+            dups = [{"id": dup_id, "similarity": similarity}
+                    for dup_id, similarity in sorted(similar[keep_id].items()) if dup_id not in assigned]
+            if dups:
+                assigned.add(keep_id)
+                assigned.update(d["id"] for d in dups)
+                groups.append({"keep": keep_id, "duplicates": dups})
+        return groups
+
+    async def _remove_duplicates(self, db: AsyncSession, user_id: int, groups: List[Dict]) -> int:
+        """软删除重复项，标签合并到保留项"""
+        removed = 0
+        touched: List[int] = []
+        for group in groups:
+            dup_ids = [d["id"] for d in group["duplicates"]]
+            result = await db.execute(
+                select(Knowledge).where(
+                    Knowledge.user_id == user_id, Knowledge.status == 1,
+                    Knowledge.id.in_([group["keep"]] + dup_ids)
+                )
+            )
+            rows = {k.id: k for k in result.scalars()}
+            keep = rows.get(group["keep"])
+            if keep is None:
+                continue
+            tags = list(keep.tags or [])
+            for dup_id in dup_ids:
+                dup = rows.get(dup_id)
+                if dup is None:
+                    continue
+                tags.extend(dup.tags or [])
+                dup.status = 0
+                await counter_service.adjust_category_count(db, dup.category_id, -1)
+                removed += 1
+            keep.tags = list(dict.fromkeys(tags))
+            touched.extend(rows)
+        await db.commit()
+        await answer_cache.invalidate(touched)
+        if removed:
+            await counter_service.incr_user_stat(user_id, "knowledge", -removed)
+        return removed
+
+
+dedup_service = DedupService()
@@ -0,0 +1,305 @@
+"""网页正文提取
+
+- 单次遍历：解析器边产生事件边切分文本块，只收集叶子块，嵌套 div 不会重复提取
+- 类 readability 打分：按文本长度、逗号数、链接密度、class/id 提示给祖先容器加分，取得分最高的容器作为正文
+- 可插拔解析后端：优先使用 C 实现的 lxml，未安装时回退到标准库 html.parser
+- 纯 CPU 计算，调用方应通过 asyncio.to_thread 放到线程池执行
+"""
+import re
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover
+    etree = None
+
+# 整个子树都跳过的标签
+SKIP_TAGS = {
+    'script', 'style', 'nav', 'footer', 'header', 'aside', 'noscript', 'iframe',
+    'svg', 'form', 'button', 'select', 'textarea', 'template'
+}
+# 块级标签：遇到开始/结束即切分文本块
+BLOCK_TAGS = {
+    'p', 'div', 'section', 'article', 'main', 'body', 'li', 'ul', 'ol', 'dl', 'dt', 'dd',
+    'td', 'th', 'tr', 'table', 'tbody', 'thead', 'pre', 'blockquote', 'figure', 'figcaption',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'br', 'hr', 'center'
+}
+# 段落类标签：文本块的得分记到其父级容器上
+PARAGRAPH_TAGS = {'p', 'li', 'dt', 'dd', 'td', 'th', 'pre', 'blockquote', 'figcaption',
+                  'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+HEADING_TAGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+VOID_TAGS = {'br', 'hr', 'img', 'input', 'meta', 'link', 'area', 'base', 'col', 'embed',
+             'source', 'track', 'wbr', 'param'}
+# 未闭合时遇到同名开始标签自动闭合（html.parser 不会补全）
+AUTO_CLOSE_TAGS = {'p', 'li', 'dt', 'dd', 'td', 'th', 'tr', 'option'}
+
+TAG_WEIGHTS = {'article': 30, 'main': 25, 'section': 5, 'pre': 3, 'blockquote': 3,
+               'td': 3, 'form': -3, 'ul': -3, 'ol': -3, 'dl': -3, 'li': -3}
+POSITIVE_RE = re.compile(r'article|content|post|entry|main|body|text|blog|story|detail', re.I)
+NEGATIVE_RE = re.compile(
+    r'comment|footer|sidebar|nav|menu|ad-|ads|share|related|promo|breadcrumb|widget|'
+    r'sponsor|cookie|banner|popup|modal|social|recommend|hidden', re.I
+)
+WHITESPACE_RE = re.compile(r'\s+')
+
+MIN_SCORED_LENGTH = 25  # 少于该长度的块不参与打分
+MIN_BLOCK_LENGTH = 10  # 少于该长度的非标题块不输出
+
+
+class _Block:
+    __slots__ = ('text', 'link_chars', 'heading', 'ancestors')
+
+    def __init__(self, text: str, link_chars: int, heading: bool, ancestors: Tuple[int, ...]):
+        self.text = text
+        self.link_chars = link_chars
+        self.heading = heading
+        self.ancestors = ancestors
+
+
+class ExtractHandler:
+    """解析事件处理器（lxml target 接口；标准库后端通过适配器调用同一组方法）"""
+
+    def __init__(self):
+        self.stack: List[Tuple[str, int]] = []  # (标签, 节点 id)
+        self.weights: Dict[int, float] = {}  # 节点 id -> class/id/标签权重
+        self.parents: Dict[int, Optional[int]] = {}  # 节点 id -> 父节点 id
+        self.scores: Dict[int, float] = {}  # 节点 id -> 累计内容得分
+        self.blocks: List[_Block] = []
+        self.title = ''
+        self.first_h1 = ''
+        self._next_id = 0
+        self._skip_depth = 0
+        self._in_title = False
+        self._link_depth = 0
+        self._buffer: List[str] = []
+        self._link_chars = 0
+        self.text_length = 0  # 已切出的可见文本总长度（用于流式读取时提前停止）
+
+    # ============ 事件 ============
+
+    def start(self, tag: str, attrs: Dict[str, str]):
+        tag = tag.lower()
+        if self._skip_depth:
+            if tag in SKIP_TAGS:
+                self._skip_depth += 1
+            return
+        if tag in SKIP_TAGS:
+            self._flush()
+            self._skip_depth = 1
+            return
+        if tag == 'title':
+            self._in_title = True
+            return
+        if tag == 'a':
+            self._link_depth += 1
+            return
+        if tag not in BLOCK_TAGS:
+            return
+        self._flush()
+        if tag in VOID_TAGS:
+            return
+        if tag in AUTO_CLOSE_TAGS and self.stack and self.stack[-1][0] == tag:
+            self.stack.pop()
+        node_id = self._next_id
+        self._next_id += 1
+        self.parents[node_id] = self.stack[-1][1] if self.stack else None
+        self.stack.append((tag, node_id))
+        weight = TAG_WEIGHTS.get(tag, 0)
+        hint = f"{attrs.get('class') or ''} {attrs.get('id') or ''}"
+        if hint.strip():
+            if NEGATIVE_RE.search(hint):
+                weight -= 25
+            if POSITIVE_RE.search(hint):
+                weight += 25
+        self.weights[node_id] = weight
+
+    def end(self, tag: str):
+        tag = tag.lower()
+        if self._skip_depth:
+            if tag in SKIP_TAGS:
+                self._skip_depth -= 1
+            return
+        if tag == 'title':
+            self._in_title = False
+            return
+        if tag == 'a':
+            self._link_depth = max(0, self._link_depth - 1)
+            return
+        if tag not in BLOCK_TAGS or tag in VOID_TAGS:
+            return
+        self._flush()
+        # 容错：弹出到最近的同名标签，找不到则忽略多余的结束标签
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                del self.stack[i:]
+                break
+
+    def data(self, text: str):
+        if self._skip_depth:
+            return
+        if self._in_title:
+            self.title += text
+            return
+        self._buffer.append(text)
+        if self._link_depth:
+            self._link_chars += len(text.strip())
+
+    def comment(self, text: str):
+        pass
+
+    def close(self) -> 'ExtractHandler':
+        self._flush()
+        return self
+
+    # ============ 切块与打分 ============
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        text = WHITESPACE_RE.sub(' ', ''.join(self._buffer)).strip()
+        link_chars = self._link_chars
+        self._buffer = []
+        self._link_chars = 0
+        if not text:
+            return
+
+        owner = self.stack[-1][0] if self.stack else ''
+        heading = owner in HEADING_TAGS
+        if heading and not self.first_h1 and owner == 'h1':
+            self.first_h1 = text
+        ancestors = tuple(node_id for _, node_id in self.stack)
+        self.text_length += len(text)
+        self.blocks.append(_Block(text, link_chars, heading, ancestors))
+
+        if len(text) < MIN_SCORED_LENGTH or heading:
+            return
+        link_density = min(1.0, link_chars / len(text))
+        score = (1 + text.count(',') + text.count('，') + min(len(text) // 100, 3)) * (1 - link_density)
+        if score <= 0:
+            return
+        # 段落类标签把得分交给父级容器，其他容器（如直接含文本的 div）自己也算一层
+        containers = ancestors[:-1] if owner in PARAGRAPH_TAGS else ancestors
+        for level, node_id in enumerate(reversed(containers[-3:])):
+            self.scores[node_id] = self.scores.get(node_id, 0.0) + score / (level + 1)
+
+    def _total(self, node_id: int) -> float:
+        return self.scores.get(node_id, 0.0) + self.weights.get(node_id, 0)
+
+    def _select(self) -> Optional[set]:
+        """选出正文容器，返回被采纳的节点 id 集合；没有候选时返回 None（输出全部文本块）"""
+        candidates = sorted(self.scores, key=self._total, reverse=True)
+        if not candidates or self._total(candidates[0]) <= 0:
+            return None
+        best = candidates[0]
+        best_total = self._total(best)
+
+        # 多个得分接近的候选（如列表页中的每一楼）落在同一个祖先下时，提升到该祖先
+        alternatives = [c for c in candidates[1:5] if self._total(c) >= best_total * 0.75]
+        if len(alternatives) >= 2:
+            node = self.parents.get(best)
+            while node is not None:
+                contained = sum(1 for c in alternatives if self._is_descendant(c, node))
+                if contained >= 2:
+                    best = node
+                    best_total = max(best_total, self._total(node))
+                    break
+                node = self.parents.get(node)
+
+        # 同级兄弟节点得分足够高时一并采纳（正文被拆成多个并列容器）
+        selected = {best}
+        parent = self.parents.get(best)
+        threshold = max(10.0, best_total * 0.2)
+        for node_id in self.scores:
+            if node_id != best and self.parents.get(node_id) == parent and self._total(node_id) >= threshold:
+                selected.add(node_id)
+        return selected
+
+    def _is_descendant(self, node_id: int, ancestor: int) -> bool:
+        node = self.parents.get(node_id)
+        while node is not None:
+            if node == ancestor:
+                return True
+            node = self.parents.get(node)
+        return False
+
+    def result(self) -> Dict[str, str]:
+        selected = self._select()
+        texts = []
+        for block in self.blocks:
+            if selected is not None and selected.isdisjoint(block.ancestors):
+                continue
+            if not block.heading and len(block.text) <= MIN_BLOCK_LENGTH:
+                continue
+            # 导航式的链接列表
+            if not block.heading and block.link_chars > len(block.text) * 0.5 and len(block.text) < 80:
+                continue
+            texts.append(block.text)
+
+        return {
+            'title': WHITESPACE_RE.sub(' ', self.title).strip() or self.first_h1,
+            'content': '\n\n'.join(texts)
+        }
+
+
+class _StdlibAdapter(HTMLParser):
+    """把 html.parser 的回调转给 ExtractHandler"""
+
+    def __init__(self, handler: ExtractHandler):
+        super().__init__(convert_charrefs=True)
+        self.handler = handler
+
+    def handle_starttag(self, tag, attrs):
+        self.handler.start(tag, {k: v for k, v in attrs})
+        if tag in VOID_TAGS:
+            self.handler.end(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handler.start(tag, {k: v for k, v in attrs})
+        self.handler.end(tag)
+
+    def handle_endtag(self, tag):
+        self.handler.end(tag)
+
+    def handle_data(self, data):
+        self.handler.data(data)
+
+
+class Extractor:
+    """增量提取器：可以边下载边 feed，读到足够的正文后提前 close"""
+
+    def __init__(self, engine: Optional[str] = None):
+        if not engine or engine == 'auto' or engine not in ENGINES:
+            engine = default_engine()
+        self.engine = engine
+        self.handler = ExtractHandler()
+        if engine == 'lxml':
+            self._parser = etree.HTMLParser(target=self.handler, remove_comments=True, no_network=True)
+        else:
+            self._parser = _StdlibAdapter(self.handler)
+
+    @property
+    def text_length(self) -> int:
+        return self.handler.text_length
+
+    def feed(self, text: str):
+        if text:
+            self._parser.feed(text)
+
+    def close(self) -> Dict[str, str]:
+        self._parser.close()
+        return self.handler.close().result()
+
+
+ENGINES = ('lxml', 'stdlib') if etree is not None else ('stdlib',)
+
+
+def default_engine() -> str:
+    return ENGINES[0]
+
+
+def extract(html: str, engine: Optional[str] = None) -> Dict[str, str]:
+    """提取网页标题和正文，返回 {'title', 'content'}"""
+    extractor = Extractor(engine)
+    extractor.feed(html)
+    return extractor.close()
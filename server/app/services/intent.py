@@ -0,0 +1,179 @@
+"""对话指令意图识别（保存 / 检索）
+
+- 所有指令词表在启动时编译成一个合并正则（在 C 实现的正则引擎中按首字符跳读），
+  一次扫描得到消息命中的全部类别，长消息（粘贴的大段文字）也只扫描一遍
+- 用户可以在 AI 配置中扩展词表：ai_config.intent_keywords = {"save": [...], "search": [...]}；
+  扩展后的正则按词表缓存，词表相同的用户共用
+- 用户词表在读取用户 AI 配置时登记到本进程：对话接口在识别意图之前读取配置（每条消息都从数据库读取），
+  所以本进程第一次收到该用户的消息、或其他进程保存了新配置时，词表也是最新的；清空扩展词后移除登记
+"""
+import re
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 类别
+SAVE = "save"  # 保存关键词
+QUERY = "query"  # 疑问词（包含时不当作保存指令）
+VAGUE = "vague"  # 指代词（"保存以上内容"）
+LAST_REPLY = "last_reply"  # 保存上一条回复
+SAVE_COMMAND = "save_command"  # 短消息中的保存口令
+SEARCH = "search"  # 知识库检索关键词
+
+DEFAULT_VOCABULARY: Dict[str, Tuple[str, ...]] = {
+    SAVE: ('保存', '记录', '记住', '存一下', '存下', '储存'),
+    QUERY: ('查', '找', '搜', '问', '什么', '怎么', '如何', '哪', '吗', '？', '?'),
+    VAGUE: ('以上', '这个', '这些', '那个', '上面', '刚才', '这段'),
+    LAST_REPLY: ('保存上条', '保存上一条', '存上条', '存上一条'),
+    SAVE_COMMAND: (
+        '保存', '存一下', '存下', '记一下', '记下', '收藏', '入库',
+        '帮我存', '帮我保存', '帮忙保存', '帮忙存', '存到知识库',
+        '保存到知识库', '存入知识库', '这个保存', '保存这个',
+        '记录一下', '记录下来', '存下来', '保存下来'
+    ),
+    SEARCH: ('查找', '查一下', '帮我查', '搜索', '搜一下', '找一下', '找找', '查询', '检索', '有没有保存', '保存过'),
+}
+
+# 用户可以扩展的类别
+USER_EXTENSIBLE = (SAVE, SEARCH)
+MAX_USER_KEYWORDS = 50
+MAX_USERS = 10000
+
+SHORT_COMMAND_LENGTH = 15  # 不超过该长度的消息中出现保存口令即视为保存上一条
+SAVE_CONTENT_RE = re.compile(r'(?:帮我)?(?:保存|记录|记住|储存)[：:]\s*(.+)', re.DOTALL)
+
+NOT_SAVE = {"is_save": False, "type": None, "content": None}
+
+
+class CompiledVocabulary:
+    """词表 -> 一个合并正则 + 每个词覆盖的类别
+
+    合并正则按词长降序排列，在每个起始位置取最长的词；较短的词如果是它的子串，
+    其类别已预先并入（"保存上一条" 同时命中 save / last_reply / save_command）。
+    下一次从匹配起点的后一位继续查找，不会漏掉与之部分重叠的词。
+    """
+
+    def __init__(self, vocabulary: Dict[str, Iterable[str]]):
+        own: Dict[str, set] = {}
+        for category, words in vocabulary.items():
+            for word in words:
+                key = word.strip().casefold()
+                if key:
+                    own.setdefault(key, set()).add(category)
+        self._covers: Dict[str, Dict[str, List[str]]] = {}
+        for word in own:
+            covers: Dict[str, List[str]] = {}
+            for other, categories in own.items():
+                if other in word:
+                    for category in categories:
+                        covers.setdefault(category, []).append(other)
+            self._covers[word] = covers
+        ordered = sorted(own, key=len, reverse=True)
+        self._pattern = re.compile('|'.join(re.escape(w) for w in ordered)) if ordered else None
+
+    def scan(self, text: str) -> Dict[str, List[str]]:
+        """一次扫描，返回 {类别: [命中的词]}"""
+        hits: Dict[str, List[str]] = {}
+        if self._pattern is None:
+            return hits
+        text = text.casefold()
+        search = self._pattern.search
+        match = search(text)
+        while match:
+            for category, words in self._covers[match.group()].items():
+                found = hits.setdefault(category, [])
+                for word in words:
+                    if word not in found:
+                        found.append(word)
+            match = search(text, match.start() + 1)
+        return hits
+
+
+def _freeze(extra: Optional[Dict[str, Iterable[str]]]) -> Tuple[Tuple[str, Tuple[str, ...]], ...]:
+    if not extra:
+        return ()
+    frozen = []
+    for category in USER_EXTENSIBLE:
+        words = extra.get(category) or []
+        cleaned = sorted({w.strip() for w in words if isinstance(w, str) and w.strip()})[:MAX_USER_KEYWORDS]
+        if cleaned:
+            frozen.append((category, tuple(cleaned)))
+    return tuple(frozen)
+
+
+@lru_cache(maxsize=256)
+def _compile(extra: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> CompiledVocabulary:
+    vocabulary = {category: list(words) for category, words in DEFAULT_VOCABULARY.items()}
+    for category, words in extra:
+        vocabulary[category].extend(words)
+        if category == SAVE:
+            # 用户自定义的保存词在短消息中同样作为保存口令
+            vocabulary[SAVE_COMMAND].extend(words)
+    return CompiledVocabulary(vocabulary)
+
+
+class IntentDetector:
+    def __init__(self):
+        self._default = _compile(())
+        self._user_vocabulary: "OrderedDict[int, tuple]" = OrderedDict()
+
+    # ============ 用户词表 ============
+
+    def remember_user(self, user_id: int, intent_keywords: Optional[Dict[str, List[str]]]):
+        """登记用户的扩展词表（读取 / 保存用户 AI 配置时调用）"""
+        frozen = _freeze(intent_keywords)
+        if frozen:
+            self._user_vocabulary[user_id] = frozen
+            self._user_vocabulary.move_to_end(user_id)
+            while len(self._user_vocabulary) > MAX_USERS:
+                self._user_vocabulary.popitem(last=False)
+        else:
+            self._user_vocabulary.pop(user_id, None)
+
+    def _vocabulary(self, user_id: Optional[int]) -> CompiledVocabulary:
+        frozen = self._user_vocabulary.get(user_id) if user_id is not None else None
+        return _compile(frozen) if frozen else self._default
+
+    # ============ 识别 ============
+
+    def detect(self, message: str, user_id: Optional[int] = None) -> Dict[str, List[str]]:
+        """返回消息命中的全部类别 {类别: [命中的词]}"""
+        return self._vocabulary(user_id).scan(message)
+
+    def save_intent(self, message: str, user_id: Optional[int] = None,
+                    hits: Optional[Dict[str, List[str]]] = None) -> dict:
+        """
+        检查消息是否是保存指令，返回 {"is_save": bool, "type": str, "content": str}
+        - type: "specific" (有具体内容), "vague" (模糊指令), "last_reply" (保存上一条)
+        """
+        msg = message.strip()
+        if hits is None:
+            hits = self.detect(msg, user_id)
+
+        if SAVE not in hits or QUERY in hits:
+            return dict(NOT_SAVE)
+
+        # "帮我保存：xxx" / "保存：xxx" - 有具体内容
+        match = SAVE_CONTENT_RE.search(msg)
+        if match:
+            content = match.group(1).strip()
+            if content and len(content) > 2:
+                return {"is_save": True, "type": "specific", "content": content}
+
+        # 模糊指令："保存以上内容"、"帮我记录这个"
+        if VAGUE in hits:
+            return {"is_save": True, "type": "vague", "content": None}
+
+        if LAST_REPLY in hits:
+            return {"is_save": True, "type": "last_reply", "content": None}
+
+        if len(msg) <= SHORT_COMMAND_LENGTH and SAVE_COMMAND in hits:
+            return {"is_save": True, "type": "last_reply", "content": None}
+
+        return dict(NOT_SAVE)
+
+    def is_search(self, message: str, user_id: Optional[int] = None) -> bool:
+        return SEARCH in self.detect(message, user_id)
+
+
+intent_detector = IntentDetector()
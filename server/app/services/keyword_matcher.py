@@ -0,0 +1,90 @@
+"""多关键词匹配（Aho–Corasick 自动机）
+
+- 一次扫描同时匹配全部关键词，耗时只与文本长度有关，与关键词数量无关
+- 不区分大小写；返回命中的关键词（保持配置中的原始写法）
+- compile_matcher 按关键词集合缓存，配置相同的用户共用同一个自动机
+"""
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+class KeywordMatcher:
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[str, ...]] = [()]
+        originals: Dict[str, str] = {}
+        for keyword in keywords:
+            word = keyword.strip().casefold()
+            if word and word not in originals:
+                originals[word] = keyword.strip()
+        for word, original in originals.items():
+            self._insert(word, original)
+        self._build()
+        self.keywords = tuple(originals.values())
+
+    def __len__(self) -> int:
+        return len(self.keywords)
+
+    def _insert(self, word: str, original: str):
+        state = 0
+        for ch in word:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            state = nxt
+        self._out[state] = self._out[state] + (original,)
+
+    def _build(self):
+        # 广度优先计算失败指针，并把失败链上的输出合并到当前节点
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                if self._out[self._fail[nxt]]:
+                    self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """逐个产出 (结束位置, 关键词)"""
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for i, ch in enumerate(text.casefold()):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                for keyword in out[state]:
+                    yield i, keyword
+
+    def find(self, text: str) -> List[str]:
+        """命中的关键词（去重，按首次出现顺序）"""
+        hits: Dict[str, None] = {}
+        for _, keyword in self.iter_matches(text):
+            hits.setdefault(keyword, None)
+        return list(hits)
+
+    def contains_any(self, text: str) -> bool:
+        for _ in self.iter_matches(text):
+            return True
+        return False
+
+
+@lru_cache(maxsize=1024)
+def _compile(keywords: Tuple[str, ...]) -> KeywordMatcher:
+    return KeywordMatcher(keywords)
+
+
+def compile_matcher(keywords: Iterable[str]) -> KeywordMatcher:
+    """编译（或取缓存中的）自动机"""
+    return _compile(tuple(sorted({k.strip() for k in keywords if k and k.strip()})))
@@ -0,0 +1,113 @@
+"""确定性提示词响应缓存
+
+- 键：(模型, 提示词哈希, temperature)
+- 过期时间 + 总字节预算（LRU 淘汰）
+- 单飞合并：相同请求并发时只调用一次上游；发起请求的调用方被取消时，等待中的请求重新选出一个发起者，
+  不会跟着被取消（只有上游真正的异常才会传给所有等待者）
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List
+from app.core.config import settings
+
+
+class _LeaderCancelled(Exception):
+    """合并请求的发起者被取消（通知等待者重试）"""
+
+
+class LLMResponseCache:
+    def __init__(self, ttl: int = 3600, max_bytes: int = 16 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (过期时间, 大小, 值)
+        self._bytes = 0
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(model: str, messages: List[dict], temperature: float) -> str:
+        prompt = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return f"{model}:{temperature}:{prompt_hash}"
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any):
+        size = len(json.dumps(value, ensure_ascii=False).encode('utf-8')) + len(key)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, size, value)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_call(self, key: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """命中缓存直接返回；否则合并相同的并发请求，只调用一次上游"""
+        while True:
+            value = self.get(key)
+            if value is not None:
+                self.stats["hits"] += 1
+                return value
+
+            pending = self._inflight.get(key)
+            if pending is not None:
+                self.stats["coalesced"] += 1
+                try:
+                    return await asyncio.shield(pending)
+                except _LeaderCancelled:
+                    # 发起者被取消：重新查找，由第一个重试的请求接替发起
+                    self.stats["coalesced"] -= 1
+                    continue
+
+            self.stats["misses"] += 1
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            try:
+                value = await factory()
+            except asyncio.CancelledError:
+                future.set_exception(_LeaderCancelled())
+                future.exception()  # 避免无人等待时出现未获取异常的警告
+                raise
+            except BaseException as e:
+                future.set_exception(e)
+                future.exception()
+                raise
+            else:
+                self.set(key, value)
+                future.set_result(value)
+                return value
+            finally:
+                self._inflight.pop(key, None)
+
+    def get_stats(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "maxBytes": self.max_bytes,
+            "hitRatio": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 3) if lookups else 0
+        }
+
+
+llm_cache = LLMResponseCache(ttl=settings.LLM_CACHE_TTL, max_bytes=settings.LLM_CACHE_MAX_BYTES)
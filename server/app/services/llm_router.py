@@ -0,0 +1,289 @@
+"""多服务商 LLM 路由
+
+- 按服务商/模型统计 EWMA 延迟和错误率
+- 连续失败后熔断，熔断中的路由不参与排序（全部熔断时直接失败）；冷却后进入半开，
+  同一时间只放行一个探测请求，探测成功恢复、失败重新熔断
+- 按健康度排序依次故障转移
+- 主请求超过历史延迟分位数仍未返回时，向备选路由发起对冲请求
+- 本地准入排队（ai_scheduler）在计时之外：调用方传入 admit，获得名额后才开始计时和调用；
+  排队超时不计为路由失败，也不触发故障转移 / 对冲
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import observe_upstream
+from app.core.tracing import tracer
+from app.services.ai_scheduler import SchedulerTimeout
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamError(Exception):
+    """上游返回了错误结果（用于触发故障转移）"""
+
+
+Admit = Callable[[dict], AsyncContextManager]
+
+
+@asynccontextmanager
+async def _admitted(route: dict):
+    yield None
+
+
+class RouteStats:
+    def __init__(self):
+        self.ewma_latency: Optional[float] = None
+        self.ewma_error = 0.0
+        self.samples = deque(maxlen=200)  # 最近成功请求的延迟
+        self.consecutive_failures = 0
+        self.state = "closed"  # closed/open/half_open
+        self.opened_at = 0.0
+        self.probing = False  # 半开状态下是否已有探测请求在执行
+        self.calls = 0
+        self.failures = 0
+
+
+class LLMRouter:
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        hedge_enabled: bool = True,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 20,
+        failover_enabled: bool = True
+    ):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.failover_enabled = failover_enabled
+        self._stats: Dict[str, RouteStats] = {}
+        self._rotation = 0
+
+    @staticmethod
+    def route_key(route: dict) -> str:
+        return route.get("key") or f"{route['provider']}:{route['model']}"
+
+    def _get(self, route: dict) -> RouteStats:
+        key = self.route_key(route)
+        if key not in self._stats:
+            self._stats[key] = RouteStats()
+        return self._stats[key]
+
+    # ============ 健康度 ============
+
+    def _state(self, stats: RouteStats) -> str:
+        if stats.state == "open" and time.monotonic() - stats.opened_at >= self.cooldown:
+            stats.state = "half_open"  # 冷却结束，等待一次探测
+            stats.probing = False
+        return stats.state
+
+    def is_available(self, route: dict) -> bool:
+        """路由当前能否接收请求：熔断中不能；半开时只有探测名额空闲才能"""
+        stats = self._get(route)
+        state = self._state(stats)
+        if state == "open":
+            return False
+        return state == "closed" or not stats.probing
+
+    def _acquire(self, route: dict) -> bool:
+        """发起请求前占用路由：半开时占用唯一的探测名额，返回是否为探测请求"""
+        stats = self._get(route)
+        if not self.is_available(route):
+            raise UpstreamError(f"{self.route_key(route)} 熔断中")
+        if stats.state == "half_open":
+            stats.probing = True
+            return True
+        return False
+
+    def record_success(self, route: dict, latency: float):
+        stats = self._get(route)
+        stats.calls += 1
+        stats.samples.append(latency)
+        stats.ewma_latency = latency if stats.ewma_latency is None else (
+            self.alpha * latency + (1 - self.alpha) * stats.ewma_latency
+        )
+        stats.ewma_error = (1 - self.alpha) * stats.ewma_error
+        stats.consecutive_failures = 0
+        stats.state = "closed"
+        stats.probing = False
+
+    def record_failure(self, route: dict, latency: float):
+        stats = self._get(route)
+        stats.calls += 1
+        stats.failures += 1
+        stats.ewma_error = self.alpha + (1 - self.alpha) * stats.ewma_error
+        stats.consecutive_failures += 1
+        if stats.state == "half_open" or stats.consecutive_failures >= self.failure_threshold:
+            stats.state = "open"
+            stats.opened_at = time.monotonic()
+
+    def _score(self, route: dict) -> float:
+        stats = self._get(route)
+        # 未知路由按 0 延迟处理，优先探索
+        latency = stats.ewma_latency or 0.0
+        return latency * (1 + 4 * stats.ewma_error) + stats.ewma_error
+
+    def rank(self, routes: List[dict], by_latency: bool = False) -> List[dict]:
+        """排序候选路由：跳过熔断中（及半开且探测未结束）的路由，错误率高的放到最后
+
+        by_latency=False 时保持配置的优先级（如免费模型优先），慢请求交给对冲处理；
+        by_latency=True 用于等价路由，按延迟和错误率择优。
+        """
+        healthy, degraded = [], []
+        for r in routes:
+            if not self.is_available(r):
+                continue
+            if self._get(r).ewma_error > 0.5:
+                degraded.append(r)
+            else:
+                healthy.append(r)
+        if by_latency:
+            healthy.sort(key=self._score)
+        ordered = healthy + degraded
+        if not self.failover_enabled:
+            return ordered[:1]
+        return ordered
+
+    def pick(self, routes: List[dict]) -> dict:
+        """从多个等价路由中选一个（轮换起点，分数相同时轮流使用；全部熔断时按轮换返回，由调用时直接失败）"""
+        start = self._rotation % len(routes)
+        self._rotation += 1
+        rotated = routes[start:] + routes[:start]
+        ranked = self.rank(rotated, by_latency=True)
+        return ranked[0] if ranked else rotated[0]
+
+    def hedge_delay(self, route: dict) -> Optional[float]:
+        """返回对冲等待时间（历史延迟分位数），样本不足时不对冲"""
+        stats = self._get(route)
+        if len(stats.samples) < self.hedge_min_samples:
+            return None
+        ordered = sorted(stats.samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))
+        return ordered[index]
+
+    # ============ 调用 ============
+
+    async def _run(
+        self, route: dict, fn: Callable[..., Awaitable[Any]], admit: Optional[Admit] = None,
+        admitted: Optional[asyncio.Event] = None
+    ) -> Any:
+        """获得准入名额后调用 fn 并计时；admit 为 None 时调用 fn(route)，否则调用 fn(route, 名额)"""
+        # 排队等待不计入延迟，排队超时（SchedulerTimeout）直接抛出，不计入路由统计
+        async with (admit or _admitted)(route) as ticket:
+            if admitted is not None:
+                admitted.set()
+            # 排序（或排队）之后路由可能已熔断，或探测名额已被其他请求占用：直接失败，不计入统计
+            probe = self._acquire(route)
+            start = time.perf_counter()
+            try:
+                with tracer.span("llm.call", kind="client", route=self.route_key(route)):
+                    result = await (fn(route, ticket) if admit else fn(route))
+            except asyncio.CancelledError:
+                if probe:
+                    self._get(route).probing = False  # 探测被取消，名额留给下一个请求
+                raise
+            except Exception:
+                elapsed = time.perf_counter() - start
+                self.record_failure(route, elapsed)
+                observe_upstream(route.get("provider"), route.get("model"), elapsed, "error")
+                raise
+            elapsed = time.perf_counter() - start
+            self.record_success(route, elapsed)
+            observe_upstream(route.get("provider"), route.get("model"), elapsed)
+            return result
+
+    async def _hedged(
+        self, primary: dict, backup: dict, delay: float, fn: Callable[..., Awaitable[Any]],
+        admit: Optional[Admit] = None
+    ) -> Tuple[Any, dict]:
+        admitted = asyncio.Event()
+        first = asyncio.ensure_future(self._run(primary, fn, admit, admitted))
+        waiter = asyncio.ensure_future(admitted.wait())
+        tasks = {first: primary}
+        try:
+            # 对冲计时从主请求获得准入名额后开始
+            await asyncio.wait({first, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            if not first.done():
+                await asyncio.wait({first}, timeout=delay)
+            if first.done() and isinstance(first.exception(), SchedulerTimeout):
+                raise first.exception()
+            if first.done() and first.exception() is None:
+                return first.result(), primary
+            # 主请求超时未返回（对冲）或已失败（故障转移），都启用备选路由
+            tasks[asyncio.ensure_future(self._run(backup, fn, admit))] = backup
+            pending = set(tasks.keys())
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), tasks[task]
+                    error = task.exception()
+            raise error
+        finally:
+            # 返回、失败或调用方被取消时，取消仍在执行的请求
+            waiter.cancel()
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def call(
+        self, routes: List[dict], fn: Callable[..., Awaitable[Any]], hedge: bool = True,
+        admit: Optional[Admit] = None
+    ) -> Tuple[Any, dict]:
+        """按健康度依次尝试路由，返回 (结果, 实际使用的路由)
+
+        admit(route) 返回准入上下文（如 ai_scheduler.slot），获得名额后才调用 fn(route, 名额)；
+        排队超时直接抛出 SchedulerTimeout，不转移到其他路由。
+        """
+        ordered = self.rank(routes)
+        last_error: Optional[Exception] = None
+        i = 0
+        while i < len(ordered):
+            primary = ordered[i]
+            backup = ordered[i + 1] if i + 1 < len(ordered) else None
+            delay = self.hedge_delay(primary) if (hedge and self.hedge_enabled and backup) else None
+            try:
+                if delay is not None:
+                    return await self._hedged(primary, backup, delay, fn, admit)
+                return await self._run(primary, fn, admit), primary
+            except SchedulerTimeout:
+                raise
+            except Exception as e:
+                last_error = e
+                logger.warning("%s 调用失败，尝试下一个: %s", self.route_key(primary), e)
+                # 对冲时备选路由也已尝试过
+                i += 2 if delay is not None else 1
+        raise last_error or UpstreamError("没有可用的模型服务")
+
+    def get_stats(self) -> List[dict]:
+        return [
+            {
+                "route": key,
+                "state": s.state,
+                "ewmaLatencyMs": round(s.ewma_latency * 1000) if s.ewma_latency is not None else None,
+                "errorRate": round(s.ewma_error, 3),
+                "calls": s.calls,
+                "failures": s.failures
+            }
+            for key, s in self._stats.items()
+        ]
+
+
+llm_router = LLMRouter(
+    failure_threshold=settings.LLM_BREAKER_FAILURES,
+    cooldown=settings.LLM_BREAKER_COOLDOWN,
+    hedge_enabled=settings.LLM_HEDGE_ENABLED,
+    hedge_percentile=settings.LLM_HEDGE_PERCENTILE,
+    failover_enabled=settings.LLM_FAILOVER_ENABLED
+)
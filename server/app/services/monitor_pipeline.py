@@ -0,0 +1,254 @@
+"""消息监控采集流水线
+
+- 接口只负责入队（asyncio.Queue，满时拒收），后台任务按批处理，请求路径上不做数据库和向量化调用
+- 每批按用户分组：长度过滤 -> 关键词匹配（每个用户一个编译好的 Aho–Corasick 自动机）-> 去重
+  （批内 + Redis SET NX 窗口，多进程共享）。保存失败时释放本批占用的去重键，重新提交不会被当作重复
+- 命中的消息写入监控消息列表；开启 auto_save 时批量向量化后一次性保存为知识（source="monitor"）
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis import redis_client
+from app.models.knowledge import Knowledge
+from app.models.monitor import MonitorConfig
+from app.services.ai_service import ai_service
+from app.services.counter_service import counter_service
+from app.services.dedup_service import content_hash
+from app.services.keyword_matcher import KeywordMatcher, compile_matcher
+from app.services.monitor_service import monitor_service
+
+logger = logging.getLogger(__name__)
+
+MONITOR_SOURCE = "monitor"
+DEFAULT_CONFIG = {"enabled": True, "keywords": [], "autoSave": False, "minLength": 50}
+
+
+def _dedup_key(user_id: int, digest: str) -> str:
+    return f"monitor:seen:{user_id}:{digest}"
+
+
+def _normalize(content: str) -> str:
+    # 空白差异不算不同内容
+    return " ".join(content.split())
+
+
+class _UserConfig:
+    __slots__ = ("enabled", "keywords", "auto_save", "min_length", "matcher", "expires")
+
+    def __init__(self, config: Optional[MonitorConfig]):
+        self.enabled = bool(config.enabled) if config else DEFAULT_CONFIG["enabled"]
+        self.keywords: List[str] = list(config.keywords or []) if config else []
+        self.auto_save = bool(config.auto_save) if config else DEFAULT_CONFIG["autoSave"]
+        self.min_length = config.min_length if config and config.min_length is not None else DEFAULT_CONFIG["minLength"]
+        self.matcher: Optional[KeywordMatcher] = compile_matcher(self.keywords) if self.keywords else None
+        self.expires = time.monotonic() + settings.MONITOR_CONFIG_TTL
+
+
+class MonitorPipeline:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.MONITOR_QUEUE_SIZE)
+        self._configs: Dict[int, _UserConfig] = {}
+        self.stats = {
+            "received": 0, "rejected": 0, "tooShort": 0, "unmatched": 0,
+            "duplicate": 0, "captured": 0, "saved": 0, "disabled": 0, "failed": 0
+        }
+
+    # ============ 配置 ============
+
+    async def get_config(self, db: AsyncSession, user_id: int) -> Optional[MonitorConfig]:
+        result = await db.execute(
+            select(MonitorConfig).where(MonitorConfig.user_id == user_id).order_by(MonitorConfig.id).limit(1)
+        )
+        return result.scalar_one_or_none()
+
+    async def save_config(self, db: AsyncSession, user_id: int, values: Dict) -> MonitorConfig:
+        config = await self.get_config(db, user_id)
+        if config is None:
+            config = MonitorConfig(user_id=user_id)
+            db.add(config)
+        for field, value in values.items():
+            setattr(config, field, value)
+        await db.commit()
+        await db.refresh(config)
+        # 本进程立即生效，其他进程在 MONITOR_CONFIG_TTL 内生效
+        self._configs.pop(user_id, None)
+        return config
+
+    async def _load_configs(self, user_ids: List[int]) -> Dict[int, _UserConfig]:
+        now = time.monotonic()
+        missing = [uid for uid in user_ids if uid not in self._configs or self._configs[uid].expires < now]
+        if missing:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    select(MonitorConfig).where(MonitorConfig.user_id.in_(missing)).order_by(MonitorConfig.id)
+                )
+                rows: Dict[int, MonitorConfig] = {}
+                for config in result.scalars():
+                    rows.setdefault(config.user_id, config)
+            for uid in missing:
+                self._configs[uid] = _UserConfig(rows.get(uid))
+        return {uid: self._configs[uid] for uid in user_ids}
+
+    # ============ 入队 ============
+
+    def submit(self, user_id: int, messages: List[Dict]) -> int:
+        """入队，返回接收的条数（队列满时其余被拒收）"""
+        accepted = 0
+        for message in messages:
+            try:
+                self.queue.put_nowait((user_id, message))
+            except asyncio.QueueFull:
+                break
+            accepted += 1
+        self.stats["received"] += accepted
+        self.stats["rejected"] += len(messages) - accepted
+        return accepted
+
+    # ============ 处理 ============
+
+    async def _next_batch(self) -> List[tuple]:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + settings.MONITOR_BATCH_WAIT
+        while len(batch) < settings.MONITOR_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def process_batch(self, batch: List[tuple]):
+        by_user: Dict[int, List[Dict]] = {}
+        for user_id, message in batch:
+            by_user.setdefault(user_id, []).append(message)
+        configs = await self._load_configs(list(by_user))
+        for user_id, messages in by_user.items():
+            try:
+                await self._process_user(user_id, messages, configs[user_id])
+            except Exception as e:
+                self.stats["failed"] += len(messages)
+                logger.warning("处理监控消息失败 user=%s: %s", user_id, e)
+
+    async def _process_user(self, user_id: int, messages: List[Dict], config: _UserConfig):
+        if not config.enabled:
+            self.stats["disabled"] += len(messages)
+            return
+
+        candidates = []
+        seen = set()
+        for message in messages:
+            content = _normalize(message["content"])
+            if len(content) < config.min_length:
+                self.stats["tooShort"] += 1
+                continue
+            hits = config.matcher.find(content) if config.matcher else []
+            if config.matcher and not hits:
+                self.stats["unmatched"] += 1
+                continue
+            digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+            if digest in seen:
+                self.stats["duplicate"] += 1
+                continue
+            seen.add(digest)
+            candidates.append((message, hits, digest))
+        if not candidates:
+            return
+
+        fresh = await redis_client.set_nx_many(
+            [_dedup_key(user_id, digest) for _, _, digest in candidates], "1", settings.MONITOR_DEDUP_TTL
+        )
+        self.stats["duplicate"] += fresh.count(False)
+        candidates = [c for c, is_new in zip(candidates, fresh) if is_new]
+        if not candidates:
+            return
+
+        try:
+            knowledge_ids: List[Optional[int]] = [None] * len(candidates)
+            if config.auto_save:
+                knowledge_ids = await self._save_knowledge(user_id, candidates)
+
+            await monitor_service.add_messages(user_id, [
+                {
+                    "source": message.get("source") or MONITOR_SOURCE,
+                    "content": message["content"],
+                    "status": "saved" if knowledge_id else "pending",
+                    "time": message.get("time"),
+                    "extra": {"keywords": hits, "knowledgeId": knowledge_id}
+                }
+                for (message, hits, _), knowledge_id in zip(candidates, knowledge_ids)
+            ])
+        except BaseException:
+            # 向量化 / 入库 / 写入监控列表失败：释放去重键，消息重新提交时可以再次处理
+            await self._release(user_id, candidates)
+            raise
+        self.stats["captured"] += len(candidates)
+
+    async def _release(self, user_id: int, candidates: List[tuple]):
+        try:
+            await redis_client.delete(*[_dedup_key(user_id, digest) for _, _, digest in candidates])
+        except Exception as e:
+            logger.warning("释放监控去重键失败 user=%s: %s", user_id, e)
+
+    async def _save_knowledge(self, user_id: int, candidates: List[tuple]) -> List[Optional[int]]:
+        """批量向量化并在一个事务中保存，返回每条对应的知识 ID"""
+        embeddings: List[Optional[List[float]]] = []
+        step = settings.MONITOR_EMBED_BATCH
+        for i in range(0, len(candidates), step):
+            chunk = candidates[i:i + step]
+            embeddings.extend(await ai_service.get_embeddings([m["content"] for m, _, _ in chunk], user_id=user_id))
+
+        rows = []
+        for (message, hits, digest), embedding in zip(candidates, embeddings):
+            content = message["content"]
+            rows.append(Knowledge(
+                user_id=user_id,
+                title=(_normalize(content)[:30] or "监控消息"),
+                content=content,
+                source=MONITOR_SOURCE,
+                source_id=(message.get("source") or "")[:100] or None,
+                tags=hits,
+                embedding=embedding,
+                token_count=len(content),
+                content_hash=content_hash(content)
+            ))
+        async with AsyncSessionLocal() as db:
+            db.add_all(rows)
+            await db.flush()
+            ids = [row.id for row in rows]
+            await db.commit()
+        await counter_service.incr_user_stat(user_id, "knowledge", len(rows))
+        self.stats["saved"] += len(rows)
+        return ids
+
+    async def run(self):
+        """后台处理循环"""
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self.process_batch(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logger.warning("监控消息批处理失败: %s", e)
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, "queued": self.queue.qsize(), "cachedConfigs": len(self._configs)}
+
+
+monitor_pipeline = MonitorPipeline()
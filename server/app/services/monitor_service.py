@@ -0,0 +1,159 @@
+"""监控消息存储
+
+- 消息体存在哈希 monitor:msg:{user_id}（id -> JSON），按时间的有序集合做索引，
+  每种状态另有一个有序集合，支持按状态过滤和分页（O(log n + m)）
+- 当前状态单独存在哈希 monitor:msg:status:{user_id}（id -> 状态），读取时覆盖 JSON 中的 status；
+  更新状态不需要在脚本中解码 / 重新编码 JSON（Redis 的 cjson 会把空数组编码成 {}）
+- 新增（含超出上限时裁剪最旧的消息）和状态更新都在 Lua 脚本中完成，并发写入不会互相覆盖
+"""
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.core.redis import redis_client
+
+MESSAGE_LIMIT = 200  # 每个用户保留的消息数
+STATUSES = ("pending", "saved", "ignored")
+
+# KEYS: 消息哈希, 状态哈希, 时间索引, 各状态索引（与 STATUSES 顺序一致）
+# ARGV: id, JSON, 分数（微秒时间戳）, 状态, 上限
+_ADD = """
+local limit = tonumber(ARGV[5])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[4])
+redis.call('ZADD', KEYS[3], ARGV[3], ARGV[1])
+for i = 4, #KEYS do
+    if KEYS[i] == KEYS[3] .. ':' .. ARGV[4] then
+        redis.call('ZADD', KEYS[i], ARGV[3], ARGV[1])
+    end
+end
+local overflow = redis.call('ZCARD', KEYS[3]) - limit
+if overflow > 0 then
+    local old = redis.call('ZRANGE', KEYS[3], 0, overflow - 1)
+    redis.call('ZREMRANGEBYRANK', KEYS[3], 0, overflow - 1)
+    redis.call('HDEL', KEYS[1], unpack(old))
+    redis.call('HDEL', KEYS[2], unpack(old))
+    for i = 4, #KEYS do
+        redis.call('ZREM', KEYS[i], unpack(old))
+    end
+end
+return 1
+"""
+
+# KEYS 同上；ARGV: id, 新状态
+# 只改状态哈希和状态索引，消息 JSON 原样返回；消息不存在时返回 nil
+_UPDATE_STATUS = """
+local raw = redis.call('HGET', KEYS[1], ARGV[1])
+if not raw then
+    return nil
+end
+local score = redis.call('ZSCORE', KEYS[3], ARGV[1]) or 0
+for i = 4, #KEYS do
+    if KEYS[i] == KEYS[3] .. ':' .. ARGV[2] then
+        redis.call('ZADD', KEYS[i], score, ARGV[1])
+    else
+        redis.call('ZREM', KEYS[i], ARGV[1])
+    end
+end
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+return raw
+"""
+
+
+def _hash_key(user_id: int) -> str:
+    return f"monitor:msg:{user_id}"
+
+
+def _status_key(user_id: int) -> str:
+    return f"monitor:msg:status:{user_id}"
+
+
+def _index_key(user_id: int, status: Optional[str] = None) -> str:
+    key = f"monitor:msg:idx:{user_id}"
+    return f"{key}:{status}" if status else key
+
+
+def _keys(user_id: int) -> List[str]:
+    return [_hash_key(user_id), _status_key(user_id), _index_key(user_id)] + [_index_key(user_id, s) for s in STATUSES]
+
+
+def _decode(raw: str, status: Optional[str]) -> Dict:
+    item = json.loads(raw)
+    if status:
+        item["status"] = status
+    # 旧版本的状态更新经 cjson 重新编码，空的关键词列表变成了 {}
+    if item.get("keywords") == {}:
+        item["keywords"] = []
+    return item
+
+
+class MonitorService:
+    @staticmethod
+    def _new_item(source: str, content: str, status: str, time_label: Optional[str], extra: Optional[Dict]) -> Dict:
+        return {
+            "id": str(uuid.uuid4()),
+            "source": source,
+            "content": content,
+            "status": status,
+            "time": time_label or datetime.now().strftime("%H:%M"),
+            **(extra or {})
+        }
+
+    @staticmethod
+    def _add_args(item: Dict) -> list:
+        return [
+            item["id"], json.dumps(item, ensure_ascii=False), time.time_ns() // 1000, item["status"], MESSAGE_LIMIT
+        ]
+
+    async def add_message(
+        self, user_id: int, source: str, content: str,
+        status: str = "pending", time_label: Optional[str] = None, extra: Optional[Dict] = None
+    ) -> Dict:
+        item = self._new_item(source, content, status, time_label, extra)
+        await redis_client.eval(_ADD, _keys(user_id), self._add_args(item))
+        return item
+
+    async def add_messages(self, user_id: int, messages: List[Dict]) -> List[Dict]:
+        """批量新增（一个 pipeline），messages 中每项含 source/content/status/time/extra"""
+        items = [
+            self._new_item(m["source"], m["content"], m.get("status", "pending"), m.get("time"), m.get("extra"))
+            for m in messages
+        ]
+        if items:
+            await redis_client.eval_many(_ADD, _keys(user_id), [self._add_args(item) for item in items])
+        return items
+
+    async def update_status(self, user_id: int, message_id: str, status: str) -> Optional[Dict]:
+        """原子更新状态，消息不存在时返回 None"""
+        raw = await redis_client.eval(_UPDATE_STATUS, _keys(user_id), [message_id, status])
+        return _decode(raw, status) if raw else None
+
+    async def list_messages(
+        self, user_id: int, status: Optional[str] = None, page: int = 1, size: int = MESSAGE_LIMIT
+    ) -> Dict:
+        """按时间倒序分页，可按状态过滤"""
+        index = _index_key(user_id, status)
+        start = (page - 1) * size
+        ids = await redis_client.zrevrange(index, start, start + size - 1)
+        total = await redis_client.zcard(index)
+        items = []
+        if ids:
+            raws = await redis_client.hmget(_hash_key(user_id), ids)
+            statuses = await redis_client.hmget(_status_key(user_id), ids)
+            for raw, item_status in zip(raws, statuses):
+                # 索引与哈希在同一脚本中维护，这里只防御手工修改过的数据
+                if raw:
+                    try:
+                        # 状态哈希中没有的（本次改动之前写入的消息）以 JSON 中的 status 为准
+                        items.append(_decode(raw, item_status))
+                    except ValueError:
+                        continue
+        return {"items": items, "total": total}
+
+    async def clear(self, user_id: int):
+        await redis_client.delete(*_keys(user_id))
+
+
+monitor_service = MonitorService()
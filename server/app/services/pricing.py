@@ -0,0 +1,179 @@
+"""模型价格表
+
+- 价格放在 PRICING_FILE（JSON，单位：元/百万token），按版本追加，每个版本有生效时间 effective_from；
+  调价时新增版本而不是修改旧版本，历史消息的成本可以按当时生效的版本复算
+- 加载时预先展开成 (服务商, 模型) -> (输入, 输出, 缓存) 单价的查找表，计算成本只做字典查找
+- 热更新：管理员接口立即重新加载；其他进程每 PRICING_CHECK_INTERVAL 秒检查一次文件修改时间，
+  文件变化后自动重新加载。新文件校验失败时保留当前价格表
+- 查找顺序：服务商的该模型 -> 服务商的 default -> default_provider 的该模型 / default（自定义密钥等未知服务商）
+"""
+import json
+import logging
+import os
+import time
+from bisect import bisect_right
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+SERVER_DIR = Path(__file__).resolve().parents[2]
+PRICE_KINDS = ("input", "output", "cached")
+
+Price = Tuple[float, float, float]  # 元/百万token：输入、输出、缓存命中
+
+
+class PricingVersion:
+    def __init__(self, version: str, effective_from: datetime, providers: Dict[str, Dict[str, dict]]):
+        self.version = version
+        self.effective_from = effective_from
+        self.providers = providers
+        self.lookup: Dict[Tuple[str, str], Price] = {}
+        for provider, models in providers.items():
+            for model, price in models.items():
+                missing = [k for k in PRICE_KINDS if not isinstance(price.get(k), (int, float))]
+                if missing:
+                    raise ValueError(f"{version} {provider}/{model} 缺少价格: {', '.join(missing)}")
+                self.lookup[(provider, model)] = tuple(price[k] for k in PRICE_KINDS)
+
+    def find(self, provider: Optional[str], model: str, default_provider: str) -> Price:
+        lookup = self.lookup
+        if provider:
+            price = lookup.get((provider, model)) or lookup.get((provider, "default"))
+            if price:
+                return price
+        return lookup.get((default_provider, model)) or lookup.get((default_provider, "default")) or (0, 0, 0)
+
+
+def _parse(data: dict) -> Tuple[str, List[PricingVersion]]:
+    versions = []
+    for item in data.get("versions") or []:
+        versions.append(PricingVersion(
+            str(item["version"]),
+            datetime.fromisoformat(item["effective_from"]),
+            item.get("providers") or {}
+        ))
+    if not versions:
+        raise ValueError("价格表没有任何版本")
+    versions.sort(key=lambda v: v.effective_from)
+    names = [v.version for v in versions]
+    if len(set(names)) != len(names):
+        raise ValueError("价格表版本号重复")
+    return data.get("default_provider") or "zhipu", versions
+
+
+class PricingTable:
+    def __init__(self):
+        path = Path(settings.PRICING_FILE)
+        self.path = path if path.is_absolute() else SERVER_DIR / path
+        self.default_provider = "zhipu"
+        self.versions: List[PricingVersion] = []
+        self._starts: List[datetime] = []
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self.loaded_at: Optional[float] = None
+        try:
+            self.reload()
+        except ValueError:
+            pass  # 已记录日志，文件修复后自动加载
+
+    # ============ 加载 ============
+
+    def reload(self) -> dict:
+        """重新加载价格文件；校验失败时抛出 ValueError 并保留当前价格表"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+            with open(self.path, encoding="utf-8") as f:
+                default_provider, versions = _parse(json.load(f))
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            self._next_check = time.monotonic() + settings.PRICING_CHECK_INTERVAL
+            if not self.versions:
+                logger.error("加载价格表失败，成本按 0 计算: %s", e)
+            raise ValueError(f"加载价格表失败: {e}") from e
+        self.default_provider = default_provider
+        self.versions = versions
+        self._starts = [v.effective_from for v in versions]
+        self._mtime = mtime
+        self._next_check = time.monotonic() + settings.PRICING_CHECK_INTERVAL
+        self.loaded_at = time.time()
+        logger.info("价格表已加载: %s（%s 个版本，当前 %s）", self.path, len(versions), self.current_version())
+        return self.get_info()
+
+    def _check_file(self):
+        """定期检查文件修改时间（多进程部署时由此同步管理员的热更新）"""
+        self._next_check = time.monotonic() + settings.PRICING_CHECK_INTERVAL
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            logger.warning("读取价格文件失败，继续使用当前价格表: %s", e)
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            self.reload()
+        except ValueError as e:
+            logger.warning("价格文件已变化但未能加载，继续使用当前价格表: %s", e)
+            self._mtime = mtime  # 同一个错误文件不重复加载
+
+    # ============ 查询 ============
+
+    def version_at(self, at: Optional[datetime] = None) -> Optional[PricingVersion]:
+        """at 时刻生效的版本（默认当前时间，与数据库一致使用 UTC）"""
+        if time.monotonic() >= self._next_check:
+            self._check_file()
+        if not self.versions:
+            return None
+        index = bisect_right(self._starts, at or datetime.utcnow()) - 1
+        return self.versions[max(index, 0)]
+
+    def current_version(self) -> Optional[str]:
+        version = self.version_at()
+        return version.version if version else None
+
+    def quote(
+        self,
+        provider: Optional[str],
+        model: str,
+        input_tokens: int,
+        output_tokens: int = 0,
+        cached_tokens: int = 0,
+        at: Optional[datetime] = None
+    ) -> Tuple[int, Optional[str]]:
+        """计算成本，返回 (成本（万分之一元）, 价格版本)"""
+        version = self.version_at(at)
+        if version is None:
+            return 0, None
+        input_price, output_price, cached_price = version.find(provider, model, self.default_provider)
+        # 缓存命中的输入 token 按缓存价格计算
+        non_cached_input = max(0, input_tokens - cached_tokens)
+        cost_yuan = (
+            non_cached_input * input_price / 1000000 +
+            output_tokens * output_price / 1000000 +
+            cached_tokens * cached_price / 1000000
+        )
+        # 转换为万分之一元（保留精度）
+        return int(cost_yuan * 10000), version.version
+
+    def get_info(self) -> dict:
+        current = self.current_version()
+        return {
+            "file": str(self.path),
+            "defaultProvider": self.default_provider,
+            "currentVersion": current,
+            "loadedAt": int(self.loaded_at) if self.loaded_at else None,
+            "versions": [
+                {
+                    "version": v.version,
+                    "effectiveFrom": v.effective_from.isoformat(),
+                    "models": len(v.lookup),
+                    "current": v.version == current
+                }
+                for v in self.versions
+            ]
+        }
+
+
+pricing_table = PricingTable()
@@ -0,0 +1,273 @@
+"""对话提示词的 token 预算
+
+- 计数：安装了 tiktoken 时按 BPE 编码计数（模型不在 tiktoken 的映射中时用 cl100k_base），
+  否则回退到 ai_scheduler.estimate_tokens 的估算。编码表首次使用可能需要下载，
+  在线程中加载（启动时预热配置的模型，用户自定义的模型在第一次请求时加载），加载完成前按估算计数
+- 预算：输入上限 = min(模型上下文窗口 - 输出预留, PROMPT_MAX_INPUT_TOKENS)。先扣除当前消息和提示词模板，
+  剩余部分按 PROMPT_SHARES 分给网页内容、知识引用、历史消息，某个来源用不完的份额再分给其他来源
+- 裁剪：网页内容截掉尾部；知识引用平均分配（短的先满足，余量留给长的），大半内容放不下时换成已有摘要，否则截断；
+  历史消息从最早的开始丢弃
+- 记录每次请求的预估与服务商返回的实际 input_tokens，按模型统计偏差；实际偏多时按比例收紧后续预算
+- 显式缓存标记：PROMPT_CACHE_HINT_PROVIDERS 中的服务商（如通义千问）在稳定前缀的最后一条消息上
+  加 cache_control；其他服务商（智谱、DeepSeek、OpenAI）自动缓存前缀，不需要标记
+"""
+import asyncio
+import logging
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import record_prompt_tokens
+from app.services.ai_scheduler import estimate_tokens
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ("web", "knowledge", "history")  # 同时也是剩余份额的分配顺序
+MESSAGE_OVERHEAD = 4  # 每条消息的角色、分隔符开销
+REPLY_OVERHEAD = 3  # 回复起始标记
+MIN_REFERENCE_TOKENS = 32  # 分到的预算少于该值的知识引用直接丢弃
+TRUNCATED_MARK = "\n[内容已截断...]"
+CALIBRATION_ALPHA = 0.1  # 实际 / 预估比例的滑动平均系数
+
+
+def _parse_mapping(value: str, cast) -> Dict[str, float]:
+    """解析 "a=1,b=2" 形式的配置"""
+    mapping = {}
+    for item in value.split(','):
+        name, _, raw = item.strip().partition('=')
+        if name and raw:
+            try:
+                mapping[name.strip()] = cast(raw.strip())
+            except ValueError:
+                logger.warning("忽略无效的提示词预算配置: %s", item)
+    return mapping
+
+
+# 编码名 -> 已加载的编码（加载失败时为 None，不再重试）
+_encodings: Dict[str, object] = {}
+
+
+@lru_cache(maxsize=64)
+def _encoding_name(model: str) -> Optional[str]:
+    """模型对应的编码名（只查映射表，不加载编码）"""
+    if tiktoken is None or settings.PROMPT_TOKENIZER != "auto":
+        return None
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return "cl100k_base"
+
+
+def _load_encoding(name: str):
+    """加载编码表（可能下载 BPE 文件，在线程中执行）"""
+    try:
+        _encodings[name] = tiktoken.get_encoding(name)
+    except Exception as e:  # 编码表需要下载，离线环境可能失败
+        logger.warning("加载 tiktoken 编码失败，使用估算: %s", e)
+        _encodings[name] = None
+
+
+def _encoding(model: str):
+    """已加载的编码，未加载时返回 None（不在事件循环中加载）"""
+    name = _encoding_name(model)
+    return _encodings.get(name) if name else None
+
+
+def _reference_line(title: str, content: str) -> str:
+    return f"- {title}: {content}"
+
+
+class PromptBuilder:
+    def __init__(self):
+        self.context_windows = _parse_mapping(settings.PROMPT_CONTEXT_WINDOWS, int)
+        shares = _parse_mapping(settings.PROMPT_SHARES, float)
+        total = sum(shares.get(s, 0) for s in SOURCES) or 1
+        self.shares = {s: shares.get(s, 0) / total for s in SOURCES}
+        self.cache_hint_providers = {p.strip() for p in settings.PROMPT_CACHE_HINT_PROVIDERS.split(',') if p.strip()}
+        self._models: Dict[str, dict] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+
+    # ============ 编码表 ============
+
+    async def warm(self, models: Iterable[str]):
+        """在线程中加载模型的编码表（同一编码只加载一次，并发请求等待同一次加载）"""
+        for name in {_encoding_name(m) for m in models if m}:
+            if not name or name in _encodings:
+                continue
+            future = self._loading.get(name)
+            if future is None:
+                future = self._loading[name] = asyncio.ensure_future(asyncio.to_thread(_load_encoding, name))
+                future.add_done_callback(lambda _, name=name: self._loading.pop(name, None))
+            await asyncio.shield(future)
+
+    # ============ 计数 / 截断 ============
+
+    def count(self, text: str, model: str) -> int:
+        if not text:
+            return 0
+        encoding = _encoding(model)
+        if encoding is None:
+            return estimate_tokens(text)
+        return len(encoding.encode(text, disallowed_special=()))
+
+    def count_messages(self, messages: List[dict], model: str) -> int:
+        return sum(self.count(m["content"], model) + MESSAGE_OVERHEAD for m in messages) + REPLY_OVERHEAD
+
+    def truncate(self, text: str, max_tokens: int, model: str) -> str:
+        """截断到不超过 max_tokens（含截断标记），放不下时返回空串"""
+        if self.count(text, model) <= max_tokens:
+            return text
+        limit = max_tokens - self.count(TRUNCATED_MARK, model)
+        if limit <= 0:
+            return ""
+        encoding = _encoding(model)
+        if encoding is not None:
+            return encoding.decode(encoding.encode(text, disallowed_special=())[:limit]) + TRUNCATED_MARK
+        # 估算值随前缀长度单调不减，二分查找最长的前缀
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if estimate_tokens(text[:mid]) <= limit:
+                lo = mid
+            else:
+                hi = mid - 1
+        return text[:lo] + TRUNCATED_MARK if lo else ""
+
+    # ============ 预算 ============
+
+    def budget(self, model: str, max_output: int) -> int:
+        """模型的输入 token 上限"""
+        window = self.context_windows.get(model, settings.PROMPT_DEFAULT_CONTEXT_WINDOW)
+        return max(0, min(window - max_output, settings.PROMPT_MAX_INPUT_TOKENS))
+
+    def _allocate(self, available: int, demands: Dict[str, int]) -> Dict[str, int]:
+        allocated = {s: min(demands[s], int(available * self.shares[s])) for s in SOURCES}
+        left = available - sum(allocated.values())
+        for s in SOURCES:
+            if left <= 0:
+                break
+            extra = min(demands[s] - allocated[s], left)
+            allocated[s] += extra
+            left -= extra
+        return allocated
+
+    def _fit_references(self, references: List[dict], limit: int, model: str) -> List[dict]:
+        costs = [self.count(_reference_line(r["title"], r["content"]), model) for r in references]
+        fitted: Dict[int, dict] = {}
+        remaining = limit
+        order = sorted(range(len(references)), key=costs.__getitem__)
+        for position, i in enumerate(order):
+            share = remaining // (len(order) - position)
+            ref = references[i]
+            content = ref["content"]
+            cost = costs[i]
+            if cost > share:
+                summary = ref.get("summary")
+                # 大半内容会被截掉时改用摘要
+                if summary and share < cost // 2 and self.count(_reference_line(ref["title"], summary), model) <= share:
+                    content = summary
+                else:
+                    overhead = self.count(_reference_line(ref["title"], ""), model)
+                    content = self.truncate(content, share - overhead, model) if share > overhead else ""
+                cost = self.count(_reference_line(ref["title"], content), model)
+                if not content or cost < MIN_REFERENCE_TOKENS:
+                    continue
+            fitted[i] = {"title": ref["title"], "content": content}
+            remaining -= cost
+        return [fitted[i] for i in sorted(fitted)]
+
+    def _fit_history(self, history: List[dict], limit: int, model: str) -> List[dict]:
+        kept = []
+        used = 0
+        for item in reversed(history):
+            cost = self.count(item["content"], model) + MESSAGE_OVERHEAD
+            if used + cost > limit:
+                break
+            kept.append(item)
+            used += cost
+        kept.reverse()
+        return kept
+
+    def fit(
+        self,
+        model: str,
+        message: str,
+        web: str = "",
+        references: Optional[List[dict]] = None,
+        history: Optional[List[dict]] = None,
+        max_output: int = 2000
+    ) -> dict:
+        """按模型预算裁剪各来源，返回 {web, references, history, budget, truncated}
+
+        references 为 [{title, content, summary?}]，history 为 [{role, content}]。
+        """
+        references = references or []
+        history = history or []
+        budget = self.budget(model, max_output)
+        # 实际 token 数持续多于预估时按比例收紧
+        scale = max(1.0, self._models.get(model, {}).get("ratio", 1.0))
+        fixed = self.count(message, model) + settings.PROMPT_TEMPLATE_RESERVE + MESSAGE_OVERHEAD * 2 + REPLY_OVERHEAD
+        available = max(0, int(budget / scale) - fixed)
+
+        demands = {
+            "web": self.count(web, model),
+            "knowledge": sum(self.count(_reference_line(r["title"], r["content"]), model) for r in references),
+            "history": sum(self.count(m["content"], model) + MESSAGE_OVERHEAD for m in history)
+        }
+        allocated = self._allocate(available, demands)
+        truncated = [s for s in SOURCES if allocated[s] < demands[s]]
+        return {
+            "web": web if "web" not in truncated else self.truncate(web, allocated["web"], model),
+            "references": references if "knowledge" not in truncated
+            else self._fit_references(references, allocated["knowledge"], model),
+            "history": history if "history" not in truncated
+            else self._fit_history(history, allocated["history"], model),
+            "budget": budget,
+            "truncated": truncated
+        }
+
+    # ============ 前缀缓存 ============
+
+    def with_cache_hint(self, messages: List[dict], provider: Optional[str], model: str) -> List[dict]:
+        """稳定前缀（除当前消息外的全部消息）足够长时，在其最后一条消息上加显式缓存标记"""
+        if provider not in self.cache_hint_providers or len(messages) < 2:
+            return messages
+        if self.count_messages(messages[:-1], model) < settings.PROMPT_CACHE_MIN_TOKENS:
+            return messages
+        marked = list(messages)
+        last = marked[-2]
+        marked[-2] = {**last, "content": [
+            {"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}
+        ]}
+        return marked
+
+    # ============ 预估偏差 ============
+
+    def record(self, model: str, projected: int, actual: int):
+        """记录预估与服务商返回的实际输入 token 数"""
+        if not projected or not actual:
+            return
+        record_prompt_tokens(model, projected, actual)
+        stats = self._models.setdefault(model, {"requests": 0, "projected": 0, "actual": 0, "ratio": 1.0})
+        stats["requests"] += 1
+        stats["projected"] += projected
+        stats["actual"] += actual
+        stats["ratio"] += CALIBRATION_ALPHA * (actual / projected - stats["ratio"])
+
+    def get_stats(self) -> dict:
+        return {
+            "tokenizer": "tiktoken" if tiktoken is not None and settings.PROMPT_TOKENIZER == "auto" else "heuristic",
+            "encodings": sorted(name for name, encoding in _encodings.items() if encoding is not None),
+            "models": {
+                model: {**stats, "ratio": round(stats["ratio"], 3)}
+                for model, stats in self._models.items()
+            }
+        }
+
+
+prompt_builder = PromptBuilder()
@@ -0,0 +1,194 @@
+"""网页入库与增量重抓
+
+- 保存网页：抓取正文后作为知识保存（source="web"），记录内容哈希和抓取时间
+- 同一用户重复保存同一网址时更新原记录；内容哈希未变化时只刷新抓取时间，不重新向量化
+- 后台重抓：定期检查到期的网页，同一网址只抓取一次，仅内容变化的记录重新向量化
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.redis import redis_client
+from app.models.knowledge import Knowledge
+from app.services.ai_service import ai_service
+from app.services.answer_cache import answer_cache
+from app.services.counter_service import counter_service
+from app.services.dedup_service import content_hash
+from app.services.web_scraper import web_scraper
+
+logger = logging.getLogger(__name__)
+
+WEB_SOURCE = "web"
+RECRAWL_LOCK_KEY = "web:recrawl:lock"
+
+
+class WebKnowledgeService:
+    async def save_page(
+        self,
+        db: AsyncSession,
+        user_id: int,
+        url: str,
+        category_id: Optional[int] = None,
+        title: Optional[str] = None
+    ) -> Dict:
+        """抓取网页并保存为知识，返回 {success, id, title, status(created/updated/unchanged), error}"""
+        page = await web_scraper.fetch_url(url)
+        if not page['success']:
+            return {'success': False, 'error': page.get('error', '抓取失败')}
+        if not page.get('content'):
+            return {'success': False, 'error': '未提取到网页正文'}
+
+        digest = content_hash(page['content'])
+        page_title = (title or page.get('title') or url)[:255]
+        now = datetime.utcnow()
+
+        result = await db.execute(
+            select(Knowledge).where(
+                Knowledge.user_id == user_id,
+                Knowledge.source == WEB_SOURCE,
+                Knowledge.source_url == url,
+                Knowledge.status == 1
+            ).limit(1)
+        )
+        existing = result.scalar_one_or_none()
+
+        if existing and existing.content_hash == digest:
+            await self._touch(db, [existing.id], now)
+            await db.commit()
+            return {'success': True, 'id': existing.id, 'title': existing.title, 'status': 'unchanged'}
+
+        embedding = await ai_service.get_embedding(page_title + " " + page['content'], user_id=user_id)
+
+        if existing:
+            existing.title = page_title
+            existing.content = page['content']
+            existing.content_hash = digest
+            existing.embedding = embedding
+            existing.token_count = len(page['content'])
+            existing.fetched_at = now
+            await db.commit()
+            await answer_cache.invalidate([existing.id])
+            return {'success': True, 'id': existing.id, 'title': page_title, 'status': 'updated'}
+
+        knowledge = Knowledge(
+            user_id=user_id,
+            title=page_title,
+            content=page['content'],
+            source=WEB_SOURCE,
+            source_url=url,
+            tags=["网页"],
+            category_id=category_id,
+            embedding=embedding,
+            token_count=len(page['content']),
+            content_hash=digest,
+            fetched_at=now
+        )
+        db.add(knowledge)
+        await counter_service.adjust_category_count(db, category_id, 1)
+        await db.commit()
+        await db.refresh(knowledge)
+        await counter_service.incr_user_stat(user_id, "knowledge", 1)
+        return {'success': True, 'id': knowledge.id, 'title': page_title, 'status': 'created'}
+
+    @staticmethod
+    async def _touch(db: AsyncSession, ids: List[int], now: datetime):
+        """内容未变时只刷新抓取时间，保留 updated_at（回答缓存按它区分知识版本）"""
+        if ids:
+            await db.execute(
+                update(Knowledge).where(Knowledge.id.in_(ids))
+                .values(fetched_at=now, updated_at=Knowledge.updated_at)
+            )
+
+    # ============ 后台重抓 ============
+
+    async def recrawl_due(self, db: AsyncSession, limit: int = 20) -> Dict[str, int]:
+        """重抓到期的网页（按网址去重），返回统计"""
+        due_before = datetime.utcnow() - timedelta(seconds=settings.WEB_RECRAWL_INTERVAL)
+        result = await db.execute(
+            select(Knowledge.source_url)
+            .where(
+                Knowledge.source == WEB_SOURCE,
+                Knowledge.status == 1,
+                Knowledge.source_url.isnot(None),
+                Knowledge.fetched_at < due_before
+            )
+            .group_by(Knowledge.source_url)
+            .order_by(func.min(Knowledge.fetched_at))
+            .limit(limit)
+        )
+        urls = [row[0] for row in result.all()]
+        stats = {'urls': len(urls), 'unchanged': 0, 'updated': 0, 'failed': 0}
+        updated_ids: List[int] = []
+        if not urls:
+            return stats
+
+        # 抓取并发进行（受单域名并发限制）；数据库写入在同一会话中按顺序执行
+        fetched = await web_scraper.fetch_many(urls, timeout=settings.WEB_RECRAWL_FETCH_TIMEOUT)
+
+        for url, page in zip(urls, fetched):
+            now = datetime.utcnow()
+            if not page['success'] or not page.get('content'):
+                # 抓取失败：推迟到下一个周期再试，保留原内容
+                stats['failed'] += 1
+                await db.execute(
+                    update(Knowledge)
+                    .where(Knowledge.source == WEB_SOURCE, Knowledge.source_url == url, Knowledge.status == 1)
+                    .values(fetched_at=now, updated_at=Knowledge.updated_at)
+                )
+                continue
+
+            digest = content_hash(page['content'])
+            rows = await db.execute(
+                select(Knowledge).where(
+                    Knowledge.source == WEB_SOURCE,
+                    Knowledge.source_url == url,
+                    Knowledge.status == 1
+                )
+            )
+            items: List[Knowledge] = rows.scalars().all()
+            changed = [k for k in items if k.content_hash != digest]
+            await self._touch(db, [k.id for k in items if k.content_hash == digest], now)
+            stats['unchanged'] += len(items) - len(changed)
+            if not changed:
+                continue
+            # 同一网址的内容相同，只向量化一次；向量化失败时不更新抓取时间，下次检查时重试
+            embedding = await ai_service.get_embedding(changed[0].title + " " + page['content'])
+            if embedding is None:
+                stats['failed'] += 1
+                continue
+            for k in changed:
+                k.content = page['content']
+                k.content_hash = digest
+                k.embedding = embedding
+                k.token_count = len(page['content'])
+                k.fetched_at = now
+            stats['updated'] += len(changed)
+            updated_ids.extend(k.id for k in changed)
+        await db.commit()
+        await answer_cache.invalidate(updated_ids)
+        return stats
+
+    async def run_recrawler(self):
+        """后台重抓循环（多进程部署时用 Redis 锁保证同一时间只有一个进程在重抓）"""
+        while True:
+            await asyncio.sleep(settings.WEB_RECRAWL_CHECK_INTERVAL)
+            try:
+                if not await redis_client.set_nx(RECRAWL_LOCK_KEY, "1", ex=settings.WEB_RECRAWL_CHECK_INTERVAL):
+                    continue
+                async with AsyncSessionLocal() as db:
+                    stats = await self.recrawl_due(db, settings.WEB_RECRAWL_BATCH)
+                if stats['urls']:
+                    logger.info("网页重抓完成: %s", stats, extra={"recrawl": stats})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("网页重抓失败: %s", e)
+
+
+web_knowledge_service = WebKnowledgeService()
@@ -1,9 +1,29 @@
 import re
+import json
+import codecs
+import asyncio
+import time
+import hashlib
+import logging
 import httpx
-from bs4 import BeautifulSoup
-from typing import Optional, Dict
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, List
 from urllib.parse import urlparse
 
+from app.core.config import settings
+from app.core.redis import redis_client
+from app.core.tracing import tracer
+from app.services import html_extractor
+from app.services.ai_scheduler import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "web:page:"
+CACHE_LRU_KEY = "web:page:lru"
+MAX_CONTENT_LENGTH = 8000  # 返回正文的最大字符数（避免token过多）
+READ_CHUNK_SIZE = 64 * 1024
+CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.I)
+
 
 class WebScraper:
     """网页抓取服务"""
@@ -15,6 +35,10 @@ class WebScraper:
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
         }
         self.timeout = 15.0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_slots: Dict[str, list] = {}  # 域名 -> [信号量, 使用中/等待中的请求数]
+        self.stats = {'hits': 0, 'revalidated': 0, 'negative_hits': 0, 'misses': 0, 'evictions': 0,
+                      'stopped_early': 0, 'rejected': 0}
     
     @staticmethod
     def is_valid_url(text: str) -> bool:
@@ -29,86 +53,251 @@ class WebScraper:
         return bool(url_pattern.match(text.strip()))
     
     @staticmethod
-    def extract_url(text: str) -> Optional[str]:
-        """从文本中提取URL"""
+    def extract_urls(text: str) -> List[str]:
+        """从文本中提取所有URL（按出现顺序去重）"""
         # 更完善的URL匹配，支持路径中的各种字符
         url_pattern = re.compile(
             r'https?://'
-            r'[^\s<>\"\'\u4e00-\u9fff]+',  # 匹配到空格、引号或中文前
+            r'[^\s<>\"\'\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]+',  # 匹配到空格、引号、中文或全角标点前
             re.IGNORECASE)
-        match = url_pattern.search(text)
-        if match:
-            url = match.group(0)
+        urls = []
+        for match in url_pattern.finditer(text):
             # 清理末尾可能的标点符号
-            url = url.rstrip('.,;:!?')
-            return url
+            url = match.group(0).rstrip('.,;:!?')
+            if url not in urls:
+                urls.append(url)
+        return urls
+    
+    @classmethod
+    def extract_url(cls, text: str) -> Optional[str]:
+        """从文本中提取第一个URL"""
+        urls = cls.extract_urls(text)
+        return urls[0] if urls else None
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """共享的连接池客户端（复用 TCP/TLS 连接）"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+            )
+        return self._client
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    # ============ 缓存 ============
+    
+    @staticmethod
+    def _cache_key(url: str) -> str:
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+    
+    async def _cache_get(self, digest: str) -> Optional[dict]:
+        try:
+            raw = await redis_client.get(f"{CACHE_PREFIX}{digest}")
+            if raw:
+                await redis_client.zadd(CACHE_LRU_KEY, {digest: time.time()})
+                return json.loads(raw)
+        except Exception as e:
+            logger.warning("读取网页缓存失败: %s", e)
         return None
     
+    async def _cache_put(self, digest: str, entry: dict):
+        ttl = settings.WEB_CACHE_TTL if entry['ok'] else settings.WEB_CACHE_NEGATIVE_TTL
+        try:
+            await redis_client.set(f"{CACHE_PREFIX}{digest}", json.dumps(entry, ensure_ascii=False), ex=ttl)
+            await redis_client.zadd(CACHE_LRU_KEY, {digest: time.time()})
+            # 超出容量时淘汰最久未访问的页面
+            overflow = await redis_client.zcard(CACHE_LRU_KEY) - settings.WEB_CACHE_MAX_ENTRIES
+            if overflow > 0:
+                evicted = await redis_client.zpopmin(CACHE_LRU_KEY, overflow)
+                await redis_client.delete(*[f"{CACHE_PREFIX}{member}" for member, _ in evicted])
+                self.stats['evictions'] += len(evicted)
+        except Exception as e:
+            logger.warning("写入网页缓存失败: %s", e)
+    
+    async def _not_modified(self, url: str, entry: dict) -> bool:
+        """带 ETag / Last-Modified 的条件请求，304 表示页面未变化（不读取响应体）
+
+        url 是返回这些校验值的地址（Jina Reader 或原网页），校验值只对该地址有效。
+        """
+        headers = dict(self.headers)
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            client = await self._get_client()
+            async with client.stream('GET', url, headers=headers, timeout=self.timeout) as response:
+                return response.status_code == 304
+        except Exception:
+            return False
+    
     async def fetch_url(self, url: str) -> Dict:
+        """抓取网页内容（带缓存：新鲜期内直接返回，过期后条件请求重新验证，失败结果短暂缓存）"""
+        digest = self._cache_key(url)
+        entry = await self._cache_get(digest)
+        if entry:
+            if not entry['ok']:
+                self.stats['negative_hits'] += 1
+                return entry['result']
+            if time.time() - entry['fetched_at'] < settings.WEB_CACHE_FRESH_TTL:
+                self.stats['hits'] += 1
+                return entry['result']
+            # 旧缓存没有记录校验值来源，无法确定该向哪个地址验证，直接重新抓取
+            if entry.get('validator_url') and (entry.get('etag') or entry.get('last_modified')) \
+                    and await self._not_modified(entry['validator_url'], entry):
+                self.stats['revalidated'] += 1
+                entry['fetched_at'] = time.time()
+                await self._cache_put(digest, entry)
+                return entry['result']
+        
+        self.stats['misses'] += 1
+        result = await self._fetch_uncached(url)
+        validators = result.pop('validators', {})
+        await self._cache_put(digest, {
+            'ok': result['success'],
+            'result': result,
+            'fetched_at': time.time(),
+            'etag': validators.get('etag'),
+            'last_modified': validators.get('last_modified'),
+            'validator_url': validators.get('url')
+        })
+        return result
+    
+    @staticmethod
+    def _validators(response: httpx.Response, url: str) -> Dict:
+        """响应的 ETag / Last-Modified 及请求地址（条件请求必须发给同一地址）"""
+        return {
+            'etag': response.headers.get('etag'),
+            'last_modified': response.headers.get('last-modified'),
+            'url': url
+        }
+    
+    async def _fetch_uncached(self, url: str) -> Dict:
         """抓取网页内容（使用 Jina Reader API 支持 JS 渲染）"""
         try:
             # 优先使用 Jina Reader API（支持 JS 渲染，免费）
             jina_url = f"https://r.jina.ai/{url}"
-            async with httpx.AsyncClient(
-                timeout=30.0,
-                follow_redirects=True
-            ) as client:
-                response = await client.get(jina_url)
-                
-                if response.status_code == 200:
-                    content = response.text
-                    # 解析 Jina 返回的 Markdown 格式
-                    lines = content.split('\n')
-                    title = ""
-                    body_lines = []
-                    in_content = False
-                    
-                    for line in lines:
-                        if line.startswith('Title:'):
-                            title = line[6:].strip()
-                        elif line.startswith('Markdown Content:'):
-                            in_content = True
-                        elif in_content:
-                            body_lines.append(line)
-                    
-                    body = '\n'.join(body_lines).strip()
-                    if len(body) > 8000:
-                        body = body[:8000] + "\n\n[内容已截断...]"
-                    
-                    return {
-                        'success': True,
-                        'title': title,
-                        'url': url,
-                        'content': body
-                    }
-                
+            client = await self._get_client()
+            async with client.stream('GET', jina_url, timeout=30.0) as response:
+                ok = response.status_code == 200
+                if ok:
+                    # Markdown 正文只需要前 MAX_CONTENT_LENGTH 个字符，多出的部分不再下载
+                    content, truncated = await self._read_text(response, MAX_CONTENT_LENGTH * 4)
+                    validators = self._validators(response, jina_url)
+            
+            if not ok:
                 # Jina 失败则回退到原始方法
                 return await self._fetch_url_fallback(url)
+            
+            # 解析 Jina 返回的 Markdown 格式
+            lines = content.split('\n')
+            title = ""
+            body_lines = []
+            in_content = False
+            
+            for line in lines:
+                if line.startswith('Title:'):
+                    title = line[6:].strip()
+                elif line.startswith('Markdown Content:'):
+                    in_content = True
+                elif in_content:
+                    body_lines.append(line)
+            
+            body = '\n'.join(body_lines).strip()
+            if len(body) > MAX_CONTENT_LENGTH or truncated:
+                body = body[:MAX_CONTENT_LENGTH] + "\n\n[内容已截断...]"
+            
+            return {
+                'success': True,
+                'title': title,
+                'url': url,
+                'content': body,
+                'validators': validators
+            }
                 
         except Exception as e:
             # 出错时回退到原始方法
             return await self._fetch_url_fallback(url)
     
+    @staticmethod
+    def _decoder(response: httpx.Response, head: bytes):
+        """增量解码器：响应头的 charset 优先，其次是页面开头的 <meta charset>，默认 utf-8"""
+        encoding = response.charset_encoding
+        if not encoding:
+            match = CHARSET_RE.search(head[:4096])
+            encoding = match.group(1).decode('ascii') if match else 'utf-8'
+        try:
+            return codecs.getincrementaldecoder(encoding)(errors='replace')
+        except LookupError:
+            return codecs.getincrementaldecoder('utf-8')(errors='replace')
+    
+    async def _read_text(self, response: httpx.Response, max_bytes: int):
+        """流式读取文本，超过 max_bytes 即停止，返回 (文本, 是否被截断)"""
+        decoder = None
+        parts = []
+        received = 0
+        async for chunk in response.aiter_bytes(READ_CHUNK_SIZE):
+            if decoder is None:
+                decoder = self._decoder(response, chunk)
+            received += len(chunk)
+            if received > max_bytes:
+                parts.append(decoder.decode(chunk[:len(chunk) - (received - max_bytes)]))
+                return ''.join(parts), True
+            parts.append(decoder.decode(chunk))
+        if decoder is not None:
+            parts.append(decoder.decode(b'', final=True))
+        return ''.join(parts), False
+    
     async def _fetch_url_fallback(self, url: str) -> Dict:
-        """回退：直接抓取网页"""
+        """回退：直接抓取网页
+        
+        流式下载，边下载边解码边提取：响应头不是 HTML/文本或声明的大小超限时不读响应体，
+        超过字节上限或已提取到足够正文时提前停止下载。
+        """
         try:
-            async with httpx.AsyncClient(
-                headers=self.headers,
-                timeout=self.timeout,
-                follow_redirects=True
-            ) as client:
-                response = await client.get(url)
+            client = await self._get_client()
+            async with client.stream('GET', url, headers=self.headers, timeout=self.timeout) as response:
                 response.raise_for_status()
                 
                 content_type = response.headers.get('content-type', '')
                 if 'text/html' not in content_type and 'text/plain' not in content_type:
+                    self.stats['rejected'] += 1
                     return {
                         'success': False,
                         'error': f'不支持的内容类型: {content_type}'
                     }
+                declared = response.headers.get('content-length', '')
+                if declared.isdigit() and int(declared) > settings.WEB_FETCH_MAX_BYTES:
+                    self.stats['rejected'] += 1
+                    return {'success': False, 'error': '页面过大'}
+                
+                extractor = html_extractor.Extractor(settings.HTML_EXTRACTOR_ENGINE)
+                enough_text = MAX_CONTENT_LENGTH * settings.WEB_FETCH_TEXT_MULTIPLE
+                decoder = None
+                received = 0
+                async for chunk in response.aiter_bytes(READ_CHUNK_SIZE):
+                    if decoder is None:
+                        decoder = self._decoder(response, chunk)
+                    received += len(chunk)
+                    over_limit = received >= settings.WEB_FETCH_MAX_BYTES
+                    if over_limit:
+                        chunk = chunk[:len(chunk) - (received - settings.WEB_FETCH_MAX_BYTES)]
+                    # 解析是 CPU 密集的，放到线程池避免阻塞事件循环
+                    await asyncio.to_thread(extractor.feed, decoder.decode(chunk))
+                    if over_limit or extractor.text_length >= enough_text:
+                        self.stats['stopped_early'] += 1
+                        break
                 
-                html = response.text
-                return self._parse_html(html, url)
+                validators = self._validators(response, url)
+            
+            extracted = await asyncio.to_thread(extractor.close)
+            result = self._build_result(extracted, url)
+            result['validators'] = validators
+            return result
                 
         except httpx.TimeoutException:
             return {'success': False, 'error': '请求超时'}
@@ -117,56 +306,126 @@ class WebScraper:
         except Exception as e:
             return {'success': False, 'error': f'抓取失败: {str(e)}'}
     
-    def _parse_html(self, html: str, url: str) -> Dict:
-        """解析HTML内容"""
-        soup = BeautifulSoup(html, 'html.parser')
-        
-        # 移除脚本和样式
-        for tag in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'noscript', 'iframe']):
-            tag.decompose()
+    @asynccontextmanager
+    async def _host_slot(self, host: str):
+        """同一域名的并发抓取数限制（礼貌抓取），空闲后释放记录"""
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = self._host_slots[host] = [asyncio.Semaphore(settings.WEB_FETCH_PER_HOST), 0]
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if slot[1] == 0:
+                self._host_slots.pop(host, None)
+    
+    async def fetch_many(self, urls: List[str], timeout: float = 35.0) -> List[Dict]:
+        """并发抓取多个网页（限制总并发和单域名并发），按输入顺序返回每个页面的结果（附带 url、ms）
         
-        # 获取标题
-        title = ''
-        if soup.title:
-            title = soup.title.string or ''
-        if not title:
-            h1 = soup.find('h1')
-            if h1:
-                title = h1.get_text(strip=True)
+        总耗时约等于最慢的一个页面（而不是所有页面之和）；单个页面超时或失败不影响其他页面。
+        """
+        fan_out = asyncio.Semaphore(settings.WEB_FETCH_CONCURRENCY)
         
-        # 获取正文内容
-        content = ''
+        async def fetch_one(url: str) -> Dict:
+            start = time.perf_counter()
+            
+            async def run():
+                async with fan_out, self._host_slot(urlparse(url).netloc.lower()):
+                    return await self.fetch_url(url)
+            
+            with tracer.span('web.fetch', kind='client', url=url) as span:
+                try:
+                    result = await asyncio.wait_for(run(), timeout)
+                except asyncio.TimeoutError:
+                    result = {'success': False, 'error': '请求超时'}
+                if span:
+                    span.set(success=result['success'])
+            result = {**result, 'url': url}
+            result['ms'] = round((time.perf_counter() - start) * 1000)
+            return result
         
-        # 尝试找到主要内容区域
-        main_content = (
-            soup.find('article') or 
-            soup.find('main') or 
-            soup.find(class_=re.compile(r'(content|article|post|entry|main)', re.I)) or
-            soup.find(id=re.compile(r'(content|article|post|entry|main)', re.I)) or
-            soup.body
-        )
+        return await asyncio.gather(*[fetch_one(url) for url in urls])
+    
+    async def fetch_urls(self, urls: List[str], timeout: float = 35.0, token_budget: int = None) -> Dict:
+        """并发抓取多个网页，合并为一个受 token 预算限制的上下文块
         
-        if main_content:
-            # 获取所有段落文本
-            paragraphs = main_content.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'li', 'td', 'th', 'span', 'div'])
-            texts = []
-            for p in paragraphs:
-                text = p.get_text(strip=True)
-                if text and len(text) > 10:
-                    texts.append(text)
-            content = '\n\n'.join(texts)
+        返回 {'success', 'content', 'pages': [{url, success, title, error, ms}]}
+        """
+        results = await self.fetch_many(urls, timeout)
+        content = self._merge_pages(results, token_budget or settings.WEB_CONTEXT_TOKEN_BUDGET)
+        return {
+            'success': any(r['success'] for r in results),
+            'content': content,
+            'pages': [
+                {
+                    'url': r['url'],
+                    'success': r['success'],
+                    'title': r.get('title', ''),
+                    'error': r.get('error'),
+                    'ms': r['ms']
+                }
+                for r in results
+            ]
+        }
+    
+    @staticmethod
+    def _allocate(sizes: List[int], budget: int) -> List[int]:
+        """按页面平均分配预算，短页面用不完的部分让给长页面"""
+        allocation = [0] * len(sizes)
+        pending = sorted(range(len(sizes)), key=lambda i: sizes[i])
+        remaining = budget
+        while pending:
+            share = remaining // len(pending)
+            smallest = pending[0]
+            if sizes[smallest] > share:
+                for i in pending:
+                    allocation[i] = share
+                break
+            allocation[smallest] = sizes[smallest]
+            remaining -= sizes[smallest]
+            pending.pop(0)
+        return allocation
+    
+    def _merge_pages(self, results: List[Dict], token_budget: int) -> str:
+        pages = [r for r in results if r['success']]
+        failures = [r for r in results if not r['success']]
+        sizes = [estimate_tokens(r['content']) for r in pages]
+        allocation = self._allocate(sizes, token_budget)
         
-        if not content:
-            content = soup.get_text(separator='\n', strip=True)
+        blocks = []
+        for i, (page, size, allowed) in enumerate(zip(pages, sizes, allocation)):
+            content = page['content']
+            if allowed < size:
+                # 按 token 比例截断字符
+                content = content[:int(len(content) * allowed / size)] + '\n\n[内容已截断...]'
+            label = '【网页内容】' if len(pages) == 1 else f'【网页内容 {i + 1}/{len(pages)}】'
+            blocks.append(f"{label}\n标题: {page.get('title', '')}\n网址: {page['url']}\n\n{content}")
+        for failure in failures:
+            if len(results) == 1:
+                blocks.append(f"【网页抓取失败】{failure['error']}")
+            else:
+                blocks.append(f"【网页抓取失败】{failure['url']}: {failure['error']}")
+        return '\n\n'.join(blocks)
+    
+    def get_stats(self) -> dict:
+        lookups = self.stats['hits'] + self.stats['revalidated'] + self.stats['negative_hits'] + self.stats['misses']
+        cached = lookups - self.stats['misses']
+        return {**self.stats, 'hitRatio': round(cached / lookups, 3) if lookups else 0}
+    
+    def _build_result(self, extracted: Dict, url: str) -> Dict:
+        """整理提取结果"""
+        title = extracted['title']
+        content = extracted['content']
         
         # 清理内容
         content = re.sub(r'\n{3,}', '\n\n', content)
         content = re.sub(r' {2,}', ' ', content)
         
         # 限制长度（避免token过多）
-        max_length = 8000
-        if len(content) > max_length:
-            content = content[:max_length] + '\n\n[内容已截断...]'
+        if len(content) > MAX_CONTENT_LENGTH:
+            content = content[:MAX_CONTENT_LENGTH] + '\n\n[内容已截断...]'
         
         # 获取域名
         domain = urlparse(url).netloc
@@ -0,0 +1,109 @@
+"""网页正文提取基准测试
+
+用法（在 server 目录下）：
+    python benchmarks/html_extract_bench.py [--repeat 20] [--large-mb 4]
+
+- 语料：benchmarks/html/*.html（保存的真实结构页面）+ 一个合成的多 MB 深层嵌套页面
+- 对比各个可用的提取后端（lxml / stdlib），安装了 bs4 时同时对比旧的 BeautifulSoup 实现
+- 输出每个页面每个后端的平均耗时和提取出的正文长度
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import html_extractor  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'html')
+
+
+def legacy_extract(html: str) -> dict:
+    """旧实现：BeautifulSoup + html.parser，find_all 后逐个 get_text"""
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'noscript', 'iframe']):
+        tag.decompose()
+    title = soup.title.string if soup.title else ''
+    main_content = (
+        soup.find('article') or
+        soup.find('main') or
+        soup.find(class_=re.compile(r'(content|article|post|entry|main)', re.I)) or
+        soup.find(id=re.compile(r'(content|article|post|entry|main)', re.I)) or
+        soup.body
+    )
+    texts = []
+    if main_content:
+        for p in main_content.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'li', 'td', 'th', 'span', 'div']):
+            text = p.get_text(strip=True)
+            if text and len(text) > 10:
+                texts.append(text)
+    return {'title': title or '', 'content': '\n\n'.join(texts)}
+
+
+def synthetic_page(target_mb: float) -> str:
+    """生成深层嵌套的大页面（模拟论坛/评论列表），用于观察规模扩展性"""
+    paragraph = ('这是一个用于基准测试的段落，包含足够多的文字、标点，以及一些英文 words, '
+                 'so that the scorer treats it as real content. ')
+    parts = ['<html><head><title>Synthetic large page</title></head><body><div class="content">']
+    size = 0
+    i = 0
+    while size < target_mb * 1024 * 1024:
+        block = (
+            f'<div class="thread"><div class="post"><div class="post-body">'
+            f'<div class="text"><p>{paragraph * 3} #{i}</p></div>'
+            f'<div class="meta"><span>作者 {i}</span> <a href="/u/{i}">主页</a></div>'
+            f'</div></div></div>'
+        )
+        parts.append(block)
+        size += len(block.encode('utf-8'))
+        i += 1
+    parts.append('</div></body></html>')
+    return ''.join(parts)
+
+
+def bench(fn, html: str, repeat: int) -> dict:
+    fn(html)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(html)
+    elapsed = (time.perf_counter() - start) / repeat
+    return {'avgMs': round(elapsed * 1000, 2), 'contentLength': len(result['content']), 'title': result['title'][:40]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--large-mb', type=float, default=4.0)
+    args = parser.parse_args()
+
+    engines = {name: (lambda html, n=name: html_extractor.extract(html, n)) for name in html_extractor.ENGINES}
+    try:
+        import bs4  # noqa: F401
+        engines['legacy-bs4'] = legacy_extract
+    except ImportError:
+        print('未安装 bs4，跳过旧实现对比', file=sys.stderr)
+
+    pages = {}
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith('.html'):
+            with open(os.path.join(CORPUS_DIR, name), encoding='utf-8') as f:
+                pages[name] = f.read()
+    if args.large_mb > 0:
+        pages[f'synthetic-{args.large_mb}mb'] = synthetic_page(args.large_mb)
+
+    report = {}
+    for page, html in pages.items():
+        # 大页面少跑几轮
+        repeat = args.repeat if len(html) < 1024 * 1024 else max(1, args.repeat // 10)
+        report[page] = {'bytes': len(html.encode('utf-8'))}
+        for engine, fn in engines.items():
+            report[page][engine] = bench(fn, html, repeat)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""对话指令意图识别基准测试
+
+用法（在 server 目录下）：
+    python benchmarks/intent_bench.py [--repeat 200] [--long-kb 4,32,128]
+
+- 语料：常见的短指令 + 合成的长消息（粘贴的大段文字，指令词出现在末尾或不出现）
+- 对比旧实现（多个词表逐个 any(kw in msg) + 每次 re.search）和编译后的单次扫描，
+  并校验两者结果一致
+- 安装了 fastapi 时同时对比 XSS 检测（逐个正则 vs 合并正则）
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.intent import IntentDetector, DEFAULT_VOCABULARY, SAVE, QUERY, VAGUE, LAST_REPLY, SAVE_COMMAND, SEARCH  # noqa: E402
+
+SHORT_MESSAGES = [
+    '保存', '帮我保存：明天下午三点开会', '保存以上内容', '保存上一条', '记一下',
+    '帮我查一下上周保存的会议纪要', '怎么保存文件？', '今天天气不错', '有没有保存过 Python 教程',
+    '把这个存下', '帮我记录：https://example.com/article',
+]
+
+PARAGRAPH = ('这是一段用户直接粘贴进对话框的长文本，内容来自会议纪要、网页摘录或者代码片段，'
+             'it contains mixed English words and punctuation, 以及一些数字 12345。')
+XSS_SAMPLES = ['<p>hello</p>', '<img src=x onerror=alert(1)>', 'javascript:void(0)', '正常的文字内容']
+
+
+def legacy_save_intent(message: str) -> dict:
+    """旧实现（chat.check_save_intent）"""
+    msg = message.strip()
+    if not any(kw in msg for kw in DEFAULT_VOCABULARY[SAVE]):
+        return {"is_save": False, "type": None, "content": None}
+    if any(word in msg for word in DEFAULT_VOCABULARY[QUERY]):
+        return {"is_save": False, "type": None, "content": None}
+    match = re.search(r'(?:帮我)?(?:保存|记录|记住|储存)[：:]\s*(.+)', msg, re.DOTALL)
+    if match:
+        content = match.group(1).strip()
+        if content and len(content) > 2:
+            return {"is_save": True, "type": "specific", "content": content}
+    if any(p in msg for p in DEFAULT_VOCABULARY[VAGUE]):
+        return {"is_save": True, "type": "vague", "content": None}
+    if any(cmd in msg for cmd in DEFAULT_VOCABULARY[LAST_REPLY]):
+        return {"is_save": True, "type": "last_reply", "content": None}
+    if len(msg) <= 15:
+        for cmd in DEFAULT_VOCABULARY[SAVE_COMMAND]:
+            if cmd in msg:
+                return {"is_save": True, "type": "last_reply", "content": None}
+    return {"is_save": False, "type": None, "content": None}
+
+
+def legacy_classify(message: str) -> tuple:
+    return legacy_save_intent(message), any(kw in message for kw in DEFAULT_VOCABULARY[SEARCH])
+
+
+def compiled_classify(detector: IntentDetector):
+    def classify(message: str) -> tuple:
+        hits = detector.detect(message)  # 一次扫描同时得到保存和检索意图
+        return detector.save_intent(message, hits=hits), SEARCH in hits
+    return classify
+
+
+def long_message(kb: int, tail: str) -> str:
+    text = PARAGRAPH * (kb * 1024 // len(PARAGRAPH.encode('utf-8')) + 1)
+    return text + tail
+
+
+def bench(fn, messages, repeat: int) -> float:
+    for m in messages:
+        fn(m)  # 预热
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for m in messages:
+            fn(m)
+    return (time.perf_counter() - start) / (repeat * len(messages)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--long-kb', default='4,32,128')
+    args = parser.parse_args()
+
+    detector = IntentDetector()
+    compiled = compiled_classify(detector)
+
+    corpora = {'short': SHORT_MESSAGES}
+    for kb in [int(x) for x in args.long_kb.split(',') if x]:
+        corpora[f'{kb}KB 无指令'] = [long_message(kb, '')]
+        corpora[f'{kb}KB 末尾指令'] = [long_message(kb, '帮我保存：以上内容')]
+
+    for name, messages in corpora.items():
+        for m in messages:
+            assert legacy_classify(m) == compiled(m), f'结果不一致: {m[:40]}'
+        repeat = args.repeat if name == 'short' else max(1, args.repeat // 20)
+        legacy_us = bench(legacy_classify, messages, repeat)
+        compiled_us = bench(compiled, messages, repeat)
+        print(f'{name:>16}  legacy {legacy_us:10.1f} us/msg   compiled {compiled_us:10.1f} us/msg')
+
+    try:
+        from app.core.security_middleware import XSS_PATTERNS, check_xss
+    except ImportError:
+        print('未安装 fastapi，跳过 XSS 对比')
+        return
+
+    def legacy_xss(content: str) -> bool:
+        content_lower = content.lower()
+        return not any(re.search(p, content_lower, re.IGNORECASE) for p in XSS_PATTERNS)
+
+    samples = XSS_SAMPLES + [long_message(32, '')]
+    for s in samples:
+        assert legacy_xss(s) == check_xss(s)
+    print(f'{"xss":>16}  legacy {bench(legacy_xss, samples, args.repeat):10.1f} us/msg   '
+          f'compiled {bench(check_xss, samples, args.repeat):10.1f} us/msg')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""端到端压测场景（Locust）
+
+1. 启动上游模拟服务：
+    python loadtest/mock_upstream.py --port 9100 --chat-latency lognormal:800,0.5 --error-rate 0.01
+
+2. 启动应用并指向模拟服务（单进程或多进程）：
+    ZHIPU_API_KEY=mock QWEN_API_KEY=mock \\
+    ZHIPU_BASE_URL=http://127.0.0.1:9100/api/paas/v4 \\
+    QWEN_BASE_URL=http://127.0.0.1:9100/compatible-mode/v1 \\
+    DASHSCOPE_BASE_URL=http://127.0.0.1:9100 \\
+    COS_DOMAIN=127.0.0.1:9100 COS_SCHEME=http COS_BUCKET=mock \\
+    uvicorn main:app --host 0.0.0.0 --port 8000 --workers 4
+
+3. 运行压测，输出吞吐和延迟报告（CSV + HTML）：
+    locust -f loadtest/locustfile.py --host http://127.0.0.1:8000 --headless \\
+        -u 200 -r 20 -t 5m --csv reports/run1 --html reports/run1.html
+
+流量配比通过 LOADTEST_MIX 调整（默认如下）：
+    LOADTEST_MIX="chat=5,search=3,browse=2,create=1,upload_image=1,upload_file=1,upload_cos=1"
+
+每个虚拟用户注册独立账号，并带上独立的 X-Forwarded-For，避免所有请求落到同一个 IP 的限流桶里。
+"""
+import base64
+import io
+import os
+import random
+import struct
+import uuid
+import zlib
+
+from locust import HttpUser, between, events
+
+DEFAULT_MIX = "chat=5,search=3,browse=2,create=1,upload_image=1,upload_file=1,upload_cos=1"
+
+QUESTIONS = [
+    "帮我总结一下 Python 异步编程的要点",
+    "连接池应该怎么配置比较合适？",
+    "Redis 有哪些常用的数据结构？",
+    "如何排查接口延迟突然变高的问题",
+    "给我写一个快速排序的例子",
+]
+SEARCH_QUERIES = ["异步", "连接池", "Redis", "延迟", "排序", "数据库 索引", "缓存 失效"]
+NOTES = [
+    ("异步编程笔记", "asyncio 的事件循环负责调度协程，阻塞调用需要放到线程池执行，否则会拖慢所有请求。"),
+    ("连接池配置", "连接池大小应接近并发上游调用数，空闲连接数应小于最大连接数，超时按上游分别设置。"),
+    ("Redis 数据结构", "字符串、哈希、列表、集合、有序集合、流，各自适合计数、缓存、队列、排行榜和日志等场景。"),
+]
+
+
+def _png_bytes(width: int = 64, height: int = 64) -> bytes:
+    """生成一张纯色 PNG（不依赖图片库）"""
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+    raw = b''.join(b'\x00' + bytes([200, 120, 40]) * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+PNG = _png_bytes()
+PNG_BASE64 = base64.b64encode(PNG).decode('ascii')
+PDF = b"%PDF-1.4\n1 0 obj<</Type/Catalog>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n" + b"0" * 20000
+
+
+def _parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name and weight:
+            mix[name] = int(weight)
+    return mix
+
+
+class KnowledgeBaseUser(HttpUser):
+    abstract = True
+    wait_time = between(1, 3)
+
+    def on_start(self):
+        self.ip = f"10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}"
+        self.client.headers["X-Forwarded-For"] = self.ip
+        username = f"lt_{uuid.uuid4().hex[:12]}"
+        password = "loadtest-password"
+        self.client.post("/api/user/register", json={"username": username, "password": password},
+                         name="/api/user/register")
+        response = self.client.post("/api/user/login", data={"username": username, "password": password},
+                                    name="/api/user/login")
+        token = response.json()["data"]["access_token"]
+        self.client.headers["Authorization"] = f"Bearer {token}"
+        self.conversation_id = None
+        self.knowledge_ids = []
+
+    # ============ 场景 ============
+
+    def chat(self):
+        payload = {"message": random.choice(QUESTIONS)}
+        if self.conversation_id:
+            payload["conversationId"] = self.conversation_id
+        with self.client.post("/api/chat", json=payload, name="/api/chat", catch_response=True) as response:
+            body = response.json() if response.status_code == 200 else {}
+            if body.get("code") == 0:
+                self.conversation_id = body["data"]["conversationId"]
+                response.success()
+            else:
+                response.failure(f"status={response.status_code} body={response.text[:200]}")
+
+    def search(self):
+        self.client.post("/api/knowledge/search", json={"query": random.choice(SEARCH_QUERIES)},
+                         name="/api/knowledge/search")
+
+    def browse(self):
+        self.client.get("/api/knowledge?page=1&size=20", name="/api/knowledge")
+        if self.knowledge_ids:
+            self.client.get(f"/api/knowledge/{random.choice(self.knowledge_ids)}", name="/api/knowledge/[id]")
+
+    def create(self):
+        title, content = random.choice(NOTES)
+        response = self.client.post("/api/knowledge", json={"title": title, "content": content},
+                                    name="/api/knowledge [create]")
+        if response.status_code == 200 and response.json().get("code") == 0:
+            self.knowledge_ids.append(response.json()["data"]["id"])
+
+    def upload_image(self):
+        self.client.post("/api/upload/image", files={"file": ("test.png", io.BytesIO(PNG), "image/png")},
+                         name="/api/upload/image")
+
+    def upload_file(self):
+        self.client.post("/api/upload/file", files={"file": ("test.pdf", io.BytesIO(PDF), "application/pdf")},
+                         name="/api/upload/file")
+
+    def upload_cos(self):
+        self.client.post("/api/upload/to-cos", json={
+            "file_data": PNG_BASE64,
+            "filename": "test.png",
+            "file_type": "image"
+        }, name="/api/upload/to-cos")
+
+
+_mix = _parse_mix(os.getenv("LOADTEST_MIX", DEFAULT_MIX))
+
+
+class MixedTrafficUser(KnowledgeBaseUser):
+    """按 LOADTEST_MIX 配比执行各个场景"""
+    tasks = {
+        getattr(KnowledgeBaseUser, name): weight
+        for name, weight in _mix.items()
+        if weight > 0 and callable(getattr(KnowledgeBaseUser, name, None))
+    }
+
+
+@events.test_start.add_listener
+def _print_mix(environment, **kwargs):
+    print(f"流量配比: {_mix}")
@@ -0,0 +1,289 @@
+"""压测用的本地上游模拟服务
+
+一个进程同时模拟：
+- OpenAI 兼容接口（智谱 / 通义千问 compatible-mode）：chat/completions（含 stream）、embeddings、files
+- DashScope 原生协议：/api/v1/services/aigc/text-generation/generation
+- 腾讯云 COS：PUT/GET/HEAD/DELETE /{key}（对象存在内存里）
+
+延迟和错误率可配置，例如：
+    python loadtest/mock_upstream.py --port 9100 \\
+        --chat-latency lognormal:800,0.5 --embedding-latency uniform:20,60 \\
+        --file-latency fixed:1500 --error-rate 0.02 --error-status 500,429
+
+延迟分布格式：fixed:毫秒 | uniform:最小,最大 | normal:均值,标准差 | lognormal:中位数,sigma
+
+应用指向模拟服务（见 locustfile.py 说明）：
+    ZHIPU_BASE_URL=http://127.0.0.1:9100/api/paas/v4
+    QWEN_BASE_URL=http://127.0.0.1:9100/compatible-mode/v1
+    DASHSCOPE_BASE_URL=http://127.0.0.1:9100
+    COS_DOMAIN=127.0.0.1:9100 COS_SCHEME=http
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="mock-upstream")
+
+REPLY = ("这是模拟服务返回的回答，用于压测。它的长度大致接近真实回答，"
+         "包含若干句子，以便下游的 token 统计和消息保存逻辑都能正常执行。") * 4
+
+
+class Latency:
+    """延迟分布（毫秒）"""
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(':')
+        self.kind = kind
+        self.params = [float(x) for x in params.split(',')] if params else [0.0]
+        if kind not in ('fixed', 'uniform', 'normal', 'lognormal'):
+            raise ValueError(f"未知的延迟分布: {spec}")
+
+    def sample(self) -> float:
+        p = self.params
+        if self.kind == 'fixed':
+            ms = p[0]
+        elif self.kind == 'uniform':
+            ms = random.uniform(p[0], p[1])
+        elif self.kind == 'normal':
+            ms = random.gauss(p[0], p[1])
+        else:
+            ms = random.lognormvariate(math.log(p[0]), p[1])
+        return max(0.0, ms) / 1000
+
+
+class Config:
+    chat_latency = Latency('lognormal:800,0.5')
+    embedding_latency = Latency('uniform:20,60')
+    file_latency = Latency('fixed:1500')
+    cos_latency = Latency('uniform:10,40')
+    stream_chunk_ms = 30.0
+    error_rate = 0.0
+    error_statuses = [500]
+    file_parse_polls = 1  # 文件上传后前几次解析返回“解析中”
+    embedding_dim = 1024
+
+
+config = Config()
+stats: Dict[str, int] = defaultdict(int)
+objects: Dict[str, tuple] = {}  # COS 对象：key -> (content_type, body)
+file_polls: Dict[str, int] = defaultdict(int)
+
+
+async def simulate(kind: str, latency: Latency):
+    """按配置注入延迟，返回需要注入的错误响应（无错误时返回 None）"""
+    stats[kind] += 1
+    await asyncio.sleep(latency.sample())
+    if config.error_rate and random.random() < config.error_rate:
+        stats[f"{kind}_errors"] += 1
+        status = random.choice(config.error_statuses)
+        return JSONResponse(
+            status_code=status,
+            content={"error": {"message": f"mock upstream error {status}", "type": "mock_error"}}
+        )
+    return None
+
+
+def usage_for(messages) -> dict:
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 2 + 1
+    completion_tokens = len(REPLY) // 2
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+
+# ============ OpenAI 兼容接口 ============
+
+@app.post("/{prefix:path}/chat/completions")
+async def chat_completions(prefix: str, request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "mock")
+
+    # 文档解析：fileid 消息在前几次返回“解析中”
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str) and content.startswith("fileid://"):
+            file_id = content[len("fileid://"):]
+            file_polls[file_id] += 1
+            if file_polls[file_id] <= config.file_parse_polls:
+                return JSONResponse(status_code=400, content={"error": {"message": "File parsing in progress"}})
+
+    error = await simulate("chat", config.chat_latency)
+    if error:
+        return error
+
+    created = int(time.time())
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    usage = usage_for(messages)
+
+    if body.get("stream"):
+        async def events():
+            for i in range(0, len(REPLY), 16):
+                chunk = {
+                    "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {"content": REPLY[i:i + 16]}, "finish_reason": None}]
+                }
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(config.stream_chunk_ms / 1000)
+            final = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage
+            }
+            yield f"data: {json.dumps(final, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+        "usage": usage
+    }
+
+
+def mock_embedding(text: str, dim: int):
+    """由文本哈希确定的单位向量（相同文本得到相同向量）"""
+    rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dim)]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+@app.post("/{prefix:path}/embeddings")
+async def embeddings(prefix: str, request: Request):
+    body = await request.json()
+    error = await simulate("embedding", config.embedding_latency)
+    if error:
+        return error
+    inputs = body.get("input", "")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dim = body.get("dimensions") or config.embedding_dim
+    tokens = sum(len(t) for t in inputs) // 2 + 1
+    return {
+        "object": "list",
+        "model": body.get("model", "mock-embedding"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": mock_embedding(t, dim)}
+            for i, t in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    }
+
+
+@app.post("/{prefix:path}/files")
+async def upload_file(prefix: str, request: Request):
+    form = await request.form()
+    upload = form.get("file")
+    size = len(await upload.read()) if upload is not None else 0
+    error = await simulate("file", config.file_latency)
+    if error:
+        return error
+    return {
+        "id": f"file-mock-{uuid.uuid4().hex[:16]}",
+        "object": "file",
+        "bytes": size,
+        "filename": getattr(upload, "filename", "file"),
+        "purpose": form.get("purpose", "file-extract"),
+        "created_at": int(time.time())
+    }
+
+
+# ============ DashScope 原生协议 ============
+
+@app.post("/api/v1/services/aigc/text-generation/generation")
+async def dashscope_generation(request: Request):
+    await request.json()
+    error = await simulate("dashscope", config.file_latency)
+    if error:
+        return error
+    return {
+        "request_id": uuid.uuid4().hex,
+        "output": {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": REPLY}}]},
+        "usage": {"input_tokens": 800, "output_tokens": len(REPLY) // 2}
+    }
+
+
+# ============ COS ============
+
+@app.put("/{key:path}")
+async def cos_put(key: str, request: Request):
+    body = await request.body()
+    error = await simulate("cos_put", config.cos_latency)
+    if error:
+        return error
+    objects[key] = (request.headers.get("content-type", "application/octet-stream"), body)
+    etag = hashlib.md5(body).hexdigest()
+    return Response(status_code=200, headers={"ETag": f'"{etag}"', "x-cos-request-id": uuid.uuid4().hex})
+
+
+@app.get("/{key:path}")
+async def cos_get(key: str):
+    if key == "mock/stats":
+        return {"requests": dict(stats), "objects": len(objects)}
+    if key not in objects:
+        return Response(status_code=404)
+    content_type, body = objects[key]
+    return Response(content=body, media_type=content_type)
+
+
+@app.head("/{key:path}")
+async def cos_head(key: str):
+    if key not in objects:
+        return Response(status_code=404)
+    content_type, body = objects[key]
+    return Response(headers={"Content-Type": content_type, "Content-Length": str(len(body))})
+
+
+@app.delete("/{key:path}")
+async def cos_delete(key: str):
+    objects.pop(key, None)
+    return Response(status_code=204)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--chat-latency', default='lognormal:800,0.5')
+    parser.add_argument('--embedding-latency', default='uniform:20,60')
+    parser.add_argument('--file-latency', default='fixed:1500')
+    parser.add_argument('--cos-latency', default='uniform:10,40')
+    parser.add_argument('--stream-chunk-ms', type=float, default=30.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='注入错误的概率（0~1）')
+    parser.add_argument('--error-status', default='500', help='注入错误的状态码，逗号分隔，随机选择')
+    parser.add_argument('--file-parse-polls', type=int, default=1)
+    parser.add_argument('--embedding-dim', type=int, default=1024)
+    args = parser.parse_args()
+
+    config.chat_latency = Latency(args.chat_latency)
+    config.embedding_latency = Latency(args.embedding_latency)
+    config.file_latency = Latency(args.file_latency)
+    config.cos_latency = Latency(args.cos_latency)
+    config.stream_chunk_ms = args.stream_chunk_ms
+    config.error_rate = args.error_rate
+    config.error_statuses = [int(s) for s in args.error_status.split(',')]
+    config.file_parse_polls = args.file_parse_polls
+    config.embedding_dim = args.embedding_dim
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,78 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from contextlib import asynccontextmanager
+import asyncio
+import logging
 import os
 
+import psutil
+
 from app.core.config import settings
-from app.core.database import init_db
+from app.core import metrics
+from app.core.log import setup_logging, shutdown_logging
+from app.core.log_store import log_store
+from app.core.loop_monitor import loop_monitor
+from app.core.tracing import tracer, TracingMiddleware
+from app.core.database import init_db, AsyncSessionLocal, engine
 from app.core.redis import redis_client
 from app.core.security_middleware import SecurityMiddleware
+from app.services.ai_scheduler import ai_scheduler
+from app.services.answer_cache import answer_cache
+from app.services.counter_service import counter_service
+from app.services.llm_cache import llm_cache
+from app.services.llm_router import llm_router
+from app.services.monitor_pipeline import monitor_pipeline
+from app.services.prompt_builder import prompt_builder
+from app.services.web_scraper import web_scraper
+from app.services.web_knowledge_service import web_knowledge_service
 from app.api import api_router
 
+setup_logging([log_store.handler] if settings.LOG_STORE_ENABLED else None)
+logger = logging.getLogger(__name__)
+
+
+def _loop_exception_handler(loop, context):
+    """后台任务中未捕获的异常（记录到异常存储）"""
+    logger.error("未处理的异步异常: %s", context.get("message"), exc_info=context.get("exception"))
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时
+    asyncio.get_running_loop().set_exception_handler(_loop_exception_handler)
     await redis_client.connect()
     await init_db()
-    print("✅ 数据库和Redis连接成功")
-    print("🛡️ 安全防护已启用")
+    async with AsyncSessionLocal() as db:
+        await counter_service.reconcile_category_counts(db)
+    logger.info("数据库和Redis连接成功，安全防护已启用")
+    # 预热 CPU 采样，之后 cpu_percent(interval=None) 返回两次调用之间的使用率
+    psutil.cpu_percent(interval=None)
+    background_tasks = []
+    if settings.WEB_RECRAWL_ENABLED:
+        background_tasks.append(asyncio.create_task(web_knowledge_service.run_recrawler()))
+    if settings.LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    if tracer.enabled:
+        background_tasks.append(asyncio.create_task(tracer.run_exporter()))
+    if settings.LOG_STORE_ENABLED:
+        background_tasks.append(asyncio.create_task(log_store.run_flusher()))
+    if settings.MONITOR_PIPELINE_ENABLED:
+        background_tasks.append(asyncio.create_task(monitor_pipeline.run()))
+    # 预热提示词计数用的编码表（可能需要下载，不阻塞启动）
+    background_tasks.append(asyncio.create_task(prompt_builder.warm([settings.CHAT_MODEL, settings.QWEN_CHAT_MODEL])))
     yield
     # 关闭时
+    await loop_monitor.stop()
+    for task in background_tasks:
+        task.cancel()
+    # 等待后台任务退出（链路导出任务退出前会导出剩余的 span）
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await web_scraper.close()
     await redis_client.close()
-    print("👋 服务已关闭")
+    logger.info("服务已关闭")
+    shutdown_logging()
 
 
 app = FastAPI(
@@ -35,6 +85,14 @@ app = FastAPI(
 # 安全中间件（放在 CORS 之前）
 app.add_middleware(SecurityMiddleware)
 
+# 监控指标（抓取时读取各模块已有的统计）
+metrics.watch_cache("llm", llm_cache)
+metrics.watch_cache("web", web_scraper)
+metrics.watch_cache("answer", answer_cache)
+metrics.watch_scheduler(ai_scheduler)
+metrics.watch_router(llm_router)
+metrics.watch_pool(engine.sync_engine.pool)
+
 # CORS配置（生产环境请配置具体域名）
 ALLOWED_ORIGINS = os.getenv('ALLOWED_ORIGINS', '*').split(',')
 app.add_middleware(
@@ -45,16 +103,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 验证错误处理器（打印详细错误）
+# 请求指标（最外层，限流拒绝的请求也会被统计）
+if settings.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# 链路追踪（最外层：每个请求生成 trace_id，响应头返回 X-Trace-Id）
+app.add_middleware(TracingMiddleware)
+
+# 验证错误处理器（记录出错字段，不记录请求内容）
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    print(f"[VALIDATION ERROR] URL: {request.url}")
-    print(f"[VALIDATION ERROR] Errors: {exc.errors()}")
+    logger.info(
+        "请求参数校验失败: %s %s", request.method, request.url.path,
+        extra={"errors": [{"loc": e.get("loc"), "msg": e.get("msg"), "type": e.get("type")} for e in exc.errors()]}
+    )
     return JSONResponse(
         status_code=422,
         content={"detail": exc.errors()}
     )
 
+
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception):
+    # 未捕获的异常写入异常存储（带堆栈和 trace_id），响应中不暴露细节
+    logger.exception("未处理的异常: %s %s", request.method, request.url.path)
+    return JSONResponse(
+        status_code=500,
+        content={"code": 500, "message": "服务器内部错误"}
+    )
+
 # 注册路由
 app.include_router(api_router, prefix="/api")
 
@@ -73,6 +150,12 @@ async def health():
     return {"status": "ok"}
 
 
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def prometheus_metrics():
+        return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="0.0.0.0", port=3000, reload=True)
@@ -0,0 +1,15 @@
+"""测试公共配置：从 server 目录导入 app 包；异步用例用 asyncio.run 执行，不依赖额外插件"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def run():
+    def _run(coro):
+        return asyncio.run(coro)
+    return _run
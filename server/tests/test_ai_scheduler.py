@@ -0,0 +1,102 @@
+"""AI 调用准入调度：用户间公平、优先级、单用户并发、排队超时"""
+import asyncio
+
+import pytest
+
+from app.services.ai_scheduler import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, AIScheduler, SchedulerTimeout
+)
+
+
+def make_scheduler(**kwargs) -> AIScheduler:
+    options = {"max_concurrency": 1, "user_concurrency": 10, "provider_limits": {}, "queue_timeout": 5.0}
+    options.update(kwargs)
+    return AIScheduler(**options)
+
+
+async def admission_order(scheduler: AIScheduler, batches):
+    """先占住全部名额，按批次排队（每批 [(用户, 标签, 优先级)]），再释放名额，返回放行顺序"""
+    order = []
+    blockers = [await scheduler.acquire(None, user_id=0) for _ in range(scheduler.max_concurrency)]
+
+    async def job(user_id, tag, priority):
+        async with scheduler.slot(None, user_id, priority):
+            order.append(tag)
+            await asyncio.sleep(0)
+
+    tasks = []
+    for batch in batches:
+        tasks += [asyncio.ensure_future(job(*item)) for item in batch]
+        await asyncio.sleep(0)  # 本批全部进入队列后再排下一批
+    for blocker in blockers:
+        scheduler.release(blocker)
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_batch_user_does_not_starve_others(run):
+    scheduler = make_scheduler()
+    order = run(admission_order(scheduler, [
+        [(1, f"a{i}", 1) for i in range(4)],  # 用户 1 先排入一批任务
+        [(2, f"b{i}", 1) for i in range(2)],  # 用户 2 后到
+    ]))
+    assert order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+def test_interactive_before_background(run):
+    scheduler = make_scheduler()
+    order = run(admission_order(scheduler, [
+        [(1, "embed", PRIORITY_BACKGROUND), (1, "parse", PRIORITY_BACKGROUND)],
+        [(2, "chat", PRIORITY_INTERACTIVE)],
+    ]))
+    assert order[0] == "chat"
+
+
+def test_user_concurrency_limit(run):
+    scheduler = make_scheduler(max_concurrency=2, user_concurrency=1)
+
+    async def scenario():
+        first = await scheduler.acquire(None, user_id=1)
+        second = asyncio.ensure_future(scheduler.acquire(None, user_id=1))
+        other = await asyncio.wait_for(scheduler.acquire(None, user_id=2), 1)
+        await asyncio.sleep(0)
+        assert not second.done()  # 用户 1 已达并发上限，空闲名额留给用户 2
+        scheduler.release(first)
+        ticket = await asyncio.wait_for(second, 1)
+        scheduler.release(ticket)
+        scheduler.release(other)
+        return scheduler.get_stats()
+
+    stats = run(scenario())
+    assert stats["active"] == 0 and stats["waiting"] == 0 and stats["admitted"] == 3
+
+
+def test_queue_timeout_leaves_queue(run):
+    scheduler = make_scheduler(queue_timeout=0.05)
+
+    async def scenario():
+        blocker = await scheduler.acquire(None, user_id=1)
+        with pytest.raises(SchedulerTimeout):
+            await scheduler.acquire(None, user_id=2)
+        assert scheduler.get_stats()["waiting"] == 0
+        scheduler.release(blocker)
+        # 超时的请求不占名额，后续请求立即放行
+        ticket = await asyncio.wait_for(scheduler.acquire(None, user_id=2), 1)
+        scheduler.release(ticket)
+
+    run(scenario())
+    assert scheduler.get_stats()["timeouts"] == 1
+
+
+def test_provider_rpm_limit_delays_admission(run):
+    scheduler = make_scheduler(max_concurrency=10, provider_limits={"zhipu": (60, 1000000)})
+    scheduler.rpm_buckets["zhipu"].tokens = 0  # 桶已耗尽，每秒补充 1 个请求
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        ticket = await asyncio.wait_for(scheduler.acquire("zhipu", user_id=1), 3)
+        scheduler.release(ticket)
+        return loop.time() - started
+
+    assert 0.5 < run(scenario()) < 2
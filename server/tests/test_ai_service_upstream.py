@@ -0,0 +1,72 @@
+"""文件 / 文档 / 图片解析的上游调用（替换 httpx.AsyncClient，不访问网络）"""
+import pytest
+
+from app.services import ai_service as ai_module
+from app.services.ai_service import ai_service
+
+
+class FakeResponse:
+    def __init__(self, data: dict):
+        self._data = data
+
+    def json(self) -> dict:
+        return self._data
+
+
+class FakeAsyncClient:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def post(self, url, **kwargs):
+        self.calls.append(url)
+        return FakeResponse(self.responses.pop(0))
+
+
+@pytest.fixture
+def fake_client(monkeypatch):
+    def install(*responses):
+        client = FakeAsyncClient(responses)
+        monkeypatch.setattr(ai_module.httpx, "AsyncClient", lambda *args, **kwargs: client)
+        return client
+    return install
+
+
+CHAT_RESULT = {
+    "choices": [{"message": {"content": "解析结果"}}],
+    "usage": {"prompt_tokens": 100, "completion_tokens": 20}
+}
+
+
+def test_parse_file(run, fake_client):
+    client = fake_client({
+        "output": {"choices": [{"message": {"content": "文档内容"}}]},
+        "usage": {"input_tokens": 100, "output_tokens": 20}
+    })
+    result = run(ai_service.parse_file("https://example.com/a.pdf", user_id=1))
+    assert result["success"], result
+    assert result["content"] == "文档内容"
+    assert result["input_tokens"] == 100
+    assert len(client.calls) == 1
+
+
+def test_parse_file_base64_image(run, fake_client):
+    fake_client(CHAT_RESULT)
+    result = run(ai_service.parse_file_base64(b"\x89PNG", "png", user_id=1))
+    assert result["success"], result
+    assert result["model"] == "qwen-vl-plus"
+    assert result["output_tokens"] == 20
+
+
+def test_parse_document(run, fake_client):
+    client = fake_client({"id": "file-1"}, CHAT_RESULT)
+    result = run(ai_service.parse_document(b"%PDF", "a.pdf", user_id=1))
+    assert result["success"], result
+    assert result["content"] == "解析结果"
+    assert len(client.calls) == 2  # 上传 + 解析
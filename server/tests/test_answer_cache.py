@@ -0,0 +1,112 @@
+"""知识库问答缓存：分桶、相似问题命中、知识更新后清除（替换 Redis 客户端和数据库会话）"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import answer_cache as cache_module
+from app.services.answer_cache import AnswerCache
+
+
+class FakeRedis:
+    """按脚本模拟 _STORE / _INVALIDATE 的效果"""
+
+    def __init__(self):
+        self.lists = {}
+        self.sets = {}
+
+    async def lrange(self, key, start, end):
+        return list(self.lists.get(key, []))
+
+    async def eval(self, script, keys, args):
+        if script == cache_module._STORE:
+            entry, size = args[0], int(args[1])
+            bucket = self.lists.setdefault(keys[0], [])
+            bucket.insert(0, entry)
+            del bucket[size:]
+            for ref in keys[1:]:
+                self.sets.setdefault(ref, set()).add(keys[0])
+            return 1
+        if script == cache_module._INVALIDATE:
+            removed = 0
+            for ref in keys:
+                for bucket in self.sets.pop(ref, set()):
+                    removed += 1 if self.lists.pop(bucket, None) is not None else 0
+            return removed
+        raise AssertionError("unexpected script")
+
+
+class FakeSession:
+    def __init__(self, versions):
+        self.versions = versions  # knowledge_id -> updated_at（不存在 / 已删除的不在其中）
+
+    async def execute(self, statement):
+        return [SimpleNamespace(id=i, updated_at=t) for i, t in self.versions.items()]
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(cache_module, "redis_client", fake)
+    return fake
+
+
+@pytest.fixture
+def cache(monkeypatch, redis):
+    monkeypatch.setattr(cache_module.settings, "ANSWER_CACHE_ENABLED", True)
+    monkeypatch.setattr(cache_module.settings, "ANSWER_CACHE_SIMILARITY", 0.95)
+    monkeypatch.setattr(cache_module.settings, "ANSWER_CACHE_BUCKET_SIZE", 2)
+    return AnswerCache()
+
+
+V1 = datetime(2026, 1, 1, 8, 0)
+V2 = datetime(2026, 1, 2, 8, 0)
+REFS = [{"id": 1}, {"id": 2}]
+
+
+def test_bucket_changes_with_reference_versions(run, cache):
+    bucket = run(cache.bucket_key(FakeSession({1: V1, 2: V1}), 7, "glm", REFS))
+    assert bucket.startswith("answer:7:glm:")
+    # 引用顺序不影响分桶
+    assert run(cache.bucket_key(FakeSession({1: V1, 2: V1}), 7, "glm", REFS[::-1])) == bucket
+    # 任意一条知识更新后落到新的桶
+    assert run(cache.bucket_key(FakeSession({1: V1, 2: V2}), 7, "glm", REFS)) != bucket
+    # 其他模型 / 用户不共用
+    assert run(cache.bucket_key(FakeSession({1: V1, 2: V1}), 7, "qwen", REFS)) != bucket
+    # 引用的知识已删除时不缓存
+    assert run(cache.bucket_key(FakeSession({1: V1}), 7, "glm", REFS)) is None
+
+
+def test_similar_question_hits(run, cache):
+    bucket = run(cache.bucket_key(FakeSession({1: V1, 2: V1}), 7, "glm", REFS))
+    assert run(cache.lookup(bucket, [1.0, 0.0, 0.0])) is None
+    run(cache.store(bucket, [1.0, 0.0, 0.0], REFS, "回答", "glm", "zhipu"))
+
+    hit = run(cache.lookup(bucket, [0.99, 0.05, 0.0]))
+    assert hit["reply"] == "回答" and hit["similarity"] >= 0.95
+    assert run(cache.lookup(bucket, [0.0, 1.0, 0.0])) is None
+    assert cache.get_stats()["hits"] == 1
+
+
+def test_bucket_size_is_bounded(run, cache, redis):
+    bucket = "answer:7:glm:test"
+    for i, vector in enumerate(([1.0, 0.0], [0.0, 1.0], [-1.0, 0.0])):
+        run(cache.store(bucket, vector, REFS, f"回答{i}", "glm", "zhipu"))
+    assert len(redis.lists[bucket]) == 2
+    assert run(cache.lookup(bucket, [1.0, 0.0])) is None  # 最早的条目已被挤出
+    assert run(cache.lookup(bucket, [-1.0, 0.0]))["reply"] == "回答2"
+
+
+def test_invalidate_clears_buckets_referencing_knowledge(run, cache):
+    shared = "answer:7:glm:shared"
+    other = "answer:7:glm:other"
+    run(cache.store(shared, [1.0, 0.0], [{"id": 1}, {"id": 2}], "回答", "glm", "zhipu"))
+    run(cache.store(other, [1.0, 0.0], [{"id": 3}], "回答", "glm", "zhipu"))
+
+    run(cache.invalidate([2, None]))
+    assert run(cache.lookup(shared, [1.0, 0.0])) is None
+    assert run(cache.lookup(other, [1.0, 0.0]))["reply"] == "回答"
+    assert cache.get_stats()["invalidations"] == 1
+    # 知识 1 的反向索引仍指向已清除的桶，再次清除不报错
+    run(cache.invalidate([1]))
+    assert cache.get_stats()["invalidations"] == 1
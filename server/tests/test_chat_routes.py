@@ -0,0 +1,25 @@
+"""聊天候选路由：自带密钥的用户不转移到平台密钥，联网搜索不退化为普通聊天"""
+from app.services import ai_service as ai_module
+from app.services.ai_service import ai_service
+
+OWN_CHAT = {"chat_api_key": "sk-user", "chat_base_url": "https://llm.example.com/v1", "chat_model": "my-model"}
+OWN_SEARCH = {"search_api_key": "sk-user", "search_base_url": "https://llm.example.com/v1", "search_model": "my-search"}
+
+
+def test_own_key_stays_on_own_provider():
+    for config, web_search in ((OWN_CHAT, False), (OWN_SEARCH, True)):
+        routes = ai_service._chat_routes(config, web_search)
+        assert len(routes) == 1 and routes[0]["own_key"]
+
+
+def test_own_key_failover_setting(monkeypatch):
+    monkeypatch.setattr(ai_module.settings, "LLM_OWN_KEY_FAILOVER", True)
+    routes = ai_service._chat_routes(OWN_CHAT, False)
+    assert routes[0]["own_key"] and len(routes) > 1
+
+
+def test_web_search_routes_all_search(monkeypatch):
+    monkeypatch.setattr(ai_module.settings, "LLM_OWN_KEY_FAILOVER", True)
+    for config in ({}, OWN_SEARCH):
+        routes = ai_service._chat_routes(config, True)
+        assert routes and all(r["extra_body"] == {"enable_search": True} for r in routes)
@@ -0,0 +1,73 @@
+"""计数缓存：回填不覆盖已有缓存，启动校准加锁（替换 Redis 客户端和数据库会话）"""
+import pytest
+
+from app.services import counter_service as counter_module
+from app.services.counter_service import counter_service
+
+
+class FakeRedis:
+    def __init__(self, cached=None, lock_free=True):
+        self.cached = cached
+        self.lock_free = lock_free
+        self.evals = []
+
+    async def eval(self, script, keys, args):
+        self.evals.append((keys, args))
+        if self.cached is None:
+            # 缓存缺失：按参数回填
+            self.cached = [args[i] for i in range(2, len(args), 2)]
+        return [str(v) for v in self.cached]
+
+    async def set_nx(self, key, value, ex):
+        free, self.lock_free = self.lock_free, False
+        return free
+
+
+class FakeSession:
+    def __init__(self, counts=(0, 0, 0)):
+        self.counts = list(counts)
+        self.executed = 0
+        self.committed = 0
+
+    async def scalar(self, statement):
+        return self.counts.pop(0)
+
+    async def execute(self, statement):
+        self.executed += 1
+
+    async def commit(self):
+        self.committed += 1
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    def install(**kwargs):
+        client = FakeRedis(**kwargs)
+        monkeypatch.setattr(counter_module, "redis_client", client)
+        return client
+    return install
+
+
+def test_reconcile_fills_missing_cache(run, fake_redis):
+    redis = fake_redis()
+    stats = run(counter_service.reconcile_user_stats(FakeSession((3, 2, 7)), 1))
+    assert stats == {"knowledge": 3, "conversation": 2, "aiCalls": 7}
+    keys, args = redis.evals[0]
+    assert keys == ["user:stats:1"]
+    assert args == [counter_module.USER_STATS_TTL, "knowledge", 3, "conversation", 2, "aiCalls", 7]
+
+
+def test_reconcile_keeps_concurrent_cache(run, fake_redis):
+    # 统计期间其他请求已回填并自增：返回缓存中的计数，而不是覆盖它
+    fake_redis(cached=[4, 2, 8])
+    stats = run(counter_service.reconcile_user_stats(FakeSession((3, 2, 7)), 1))
+    assert stats == {"knowledge": 4, "conversation": 2, "aiCalls": 8}
+
+
+def test_category_reconcile_runs_once(run, fake_redis):
+    fake_redis()
+    first, second = FakeSession(), FakeSession()
+    assert run(counter_service.reconcile_category_counts(first)) is True
+    assert run(counter_service.reconcile_category_counts(second)) is False
+    assert (first.executed, first.committed) == (1, 1)
+    assert (second.executed, second.committed) == (0, 0)
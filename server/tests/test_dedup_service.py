@@ -0,0 +1,34 @@
+"""批量去重分组：只删除与保留项本身相似的条目"""
+from app.services.dedup_service import DedupService
+
+
+def test_chain_does_not_delete_dissimilar_entry():
+    # A≈B、B≈C，但 C 与 A 不相似（近邻查询没有返回 A-C）：只删除 B，C 保留
+    groups = DedupService._group([(1, 2, 0.95), (2, 3, 0.93)])
+    assert groups == [{"keep": 1, "duplicates": [{"id": 2, "similarity": 0.95}]}]
+
+
+def test_direct_duplicates_grouped_under_earliest():
+    pairs = [
+        (1, 2, 0.95), (1, 3, 0.92), (2, 3, 0.97),  # 都与 1 相似
+        (4, 6, 1.0), (4, 5, 0.91),                 # 哈希相同 + 向量相似
+        (5, 6, 0.99)
+    ]
+    assert DedupService._group(pairs) == [
+        {"keep": 1, "duplicates": [{"id": 2, "similarity": 0.95}, {"id": 3, "similarity": 0.92}]},
+        {"keep": 4, "duplicates": [{"id": 5, "similarity": 0.91}, {"id": 6, "similarity": 1.0}]},
+    ]
+
+
+def test_duplicate_pair_keeps_highest_similarity():
+    # 同一对既有哈希匹配又有向量匹配
+    assert DedupService._group([(1, 2, 0.9), (1, 2, 1.0)]) == [
+        {"keep": 1, "duplicates": [{"id": 2, "similarity": 1.0}]}
+    ]
+
+
+def test_removed_entry_is_not_a_keeper():
+    # 2 已作为 1 的重复项删除，4 只与 2 相似：保留 4（下一次去重时再与其他条目比较）
+    groups = DedupService._group([(1, 2, 0.95), (2, 4, 0.96), (3, 5, 0.9)])
+    assert [g["keep"] for g in groups] == [1, 3]
+    assert all(d["id"] != 4 for g in groups for d in g["duplicates"])
@@ -0,0 +1,55 @@
+"""指令意图识别：用户扩展词表在读取 AI 配置时登记（替换数据库会话）"""
+import json
+from types import SimpleNamespace
+
+from app.services.ai_service import ai_service
+from app.services.intent import SAVE, SEARCH, intent_detector
+
+USER_ID = 90001
+
+
+class FakeResult:
+    def __init__(self, user):
+        self._user = user
+
+    def scalar_one_or_none(self):
+        return self._user
+
+
+class FakeSession:
+    def __init__(self, ai_config=None):
+        self.settings = json.dumps({"ai_config": ai_config}) if ai_config is not None else None
+
+    async def execute(self, statement):
+        return FakeResult(SimpleNamespace(id=USER_ID, settings=self.settings))
+
+
+def test_default_vocabulary():
+    assert SAVE in intent_detector.detect("帮我保存：明天下午三点开会")
+    assert intent_detector.save_intent("保存以上内容")["type"] == "vague"
+    assert intent_detector.is_search("帮我查一下上次的笔记")
+
+
+def test_user_keywords_apply_after_config_is_read(run):
+    message = "归档一下"
+    intent_detector.remember_user(USER_ID, None)
+    assert SAVE not in intent_detector.detect(message, USER_ID)
+
+    config = run(ai_service.get_user_ai_config(
+        FakeSession({"intent_keywords": {"save": ["归档"], "search": ["翻翻"]}}), USER_ID
+    ))
+    assert config["intent_keywords"]["save"] == ["归档"]
+    assert intent_detector.save_intent(message, USER_ID)["type"] == "last_reply"
+    assert SEARCH in intent_detector.detect("翻翻之前的记录", USER_ID)
+
+
+def test_cleared_keywords_are_forgotten(run):
+    run(ai_service.get_user_ai_config(FakeSession({"intent_keywords": {"save": ["归档"]}}), USER_ID))
+    assert SAVE in intent_detector.detect("归档一下", USER_ID)
+
+    # 其他进程清空了扩展词：下一次读取配置时移除登记
+    run(ai_service.get_user_ai_config(FakeSession({}), USER_ID))
+    assert SAVE not in intent_detector.detect("归档一下", USER_ID)
+    run(ai_service.get_user_ai_config(FakeSession({"intent_keywords": {"save": ["归档"]}}), USER_ID))
+    run(ai_service.get_user_ai_config(FakeSession(), USER_ID))
+    assert SAVE not in intent_detector.detect("归档一下", USER_ID)
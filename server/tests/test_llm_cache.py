@@ -0,0 +1,67 @@
+"""提示词响应缓存：单飞合并，发起者被取消时等待者重新发起"""
+import asyncio
+
+import pytest
+
+from app.services.llm_cache import LLMResponseCache
+
+
+def test_concurrent_requests_call_upstream_once(run):
+    cache = LLMResponseCache()
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"reply": "ok"}
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_call("k", factory) for _ in range(5)))
+
+    assert run(scenario()) == [{"reply": "ok"}] * 5
+    assert len(calls) == 1
+    assert cache.stats["misses"] == 1 and cache.stats["coalesced"] == 4
+    assert run(cache.get_or_call("k", factory)) == {"reply": "ok"}
+    assert cache.stats["hits"] == 1
+
+
+def test_follower_survives_leader_cancellation(run):
+    cache = LLMResponseCache()
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return {"reply": f"call {len(calls)}"}
+
+    async def scenario():
+        leader = asyncio.ensure_future(cache.get_or_call("k", factory))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(cache.get_or_call("k", factory))
+        await asyncio.sleep(0.01)
+        leader.cancel()  # 例如客户端断开
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.wait_for(follower, 1)
+
+    # 等待者没有被取消，而是接替发起了一次新的上游调用
+    assert run(scenario()) == {"reply": "call 2"}
+    assert len(calls) == 2
+    assert cache.stats["coalesced"] == 0
+
+
+def test_upstream_error_reaches_followers(run):
+    cache = LLMResponseCache()
+
+    async def factory():
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def scenario():
+        results = await asyncio.gather(
+            *(cache.get_or_call("k", factory) for _ in range(3)), return_exceptions=True
+        )
+        return [type(r) for r in results]
+
+    assert run(scenario()) == [ValueError] * 3
+    assert cache.get("k") is None
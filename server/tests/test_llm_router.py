@@ -0,0 +1,219 @@
+"""LLM 路由：熔断状态转换、半开探测、对冲请求的取消、准入排队不计入路由统计"""
+import asyncio
+
+import pytest
+
+from app.services.ai_scheduler import AIScheduler, SchedulerTimeout
+from app.services.llm_router import LLMRouter, UpstreamError
+
+A = {"provider": "zhipu", "model": "a"}
+B = {"provider": "qwen", "model": "b"}
+
+
+def make_router(**kwargs) -> LLMRouter:
+    options = {"failure_threshold": 2, "cooldown": 30.0, "hedge_enabled": False}
+    options.update(kwargs)
+    return LLMRouter(**options)
+
+
+def cool_down(router: LLMRouter, route: dict):
+    router._get(route).opened_at -= router.cooldown
+
+
+async def ok(route):
+    return route["model"]
+
+
+async def fail(route):
+    raise UpstreamError("boom")
+
+
+def test_opens_after_consecutive_failures(run):
+    router = make_router()
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            run(router.call([A], fail))
+    assert router._get(A).state == "open"
+    assert not router.is_available(A)
+    # 熔断中的路由不参与排序
+    assert router.rank([A, B]) == [B]
+    assert run(router.call([A, B], ok)) == ("b", B)
+
+
+def test_all_routes_open_fails_fast(run):
+    router = make_router(failure_threshold=1)
+    calls = []
+
+    async def track(route):
+        calls.append(route["model"])
+        raise UpstreamError("boom")
+
+    with pytest.raises(UpstreamError):
+        run(router.call([A], track))
+    with pytest.raises(UpstreamError):
+        run(router.call([A], track))
+    assert calls == ["a"]
+    assert router.pick([A]) == A  # 全部熔断时仍返回路由，由调用时失败
+
+
+def test_half_open_allows_one_probe(run):
+    router = make_router(failure_threshold=1)
+    router.record_failure(A, 0.1)
+    cool_down(router, A)
+    assert router.is_available(A)
+    assert router._get(A).state == "half_open"
+
+    async def scenario():
+        release = asyncio.Event()
+        started = []
+
+        async def slow(route):
+            started.append(route["model"])
+            await release.wait()
+            return "probe"
+
+        probe = asyncio.ensure_future(router.call([A], slow))
+        await asyncio.sleep(0)
+        # 探测进行中：其他请求跳过该路由
+        assert not router.is_available(A)
+        assert router.rank([A, B]) == [B]
+        with pytest.raises(UpstreamError):
+            await router.call([A], slow)
+        release.set()
+        assert await probe == ("probe", A)
+        return started
+
+    assert run(scenario()) == ["a"]
+    assert router._get(A).state == "closed"
+    assert router.is_available(A)
+
+
+def test_failed_probe_reopens(run):
+    router = make_router(failure_threshold=3)
+    for _ in range(3):
+        router.record_failure(A, 0.1)
+    cool_down(router, A)
+    with pytest.raises(UpstreamError):
+        run(router.call([A], fail))
+    stats = router._get(A)
+    assert stats.state == "open"
+    assert not router.is_available(A)
+    # 再次冷却后重新放行探测
+    cool_down(router, A)
+    assert router.is_available(A)
+
+
+def test_cancelled_probe_releases_slot(run):
+    router = make_router(failure_threshold=1)
+    router.record_failure(A, 0.1)
+    cool_down(router, A)
+
+    async def scenario():
+        async def hang(route):
+            await asyncio.sleep(10)
+
+        probe = asyncio.ensure_future(router.call([A], hang))
+        await asyncio.sleep(0)
+        assert not router.is_available(A)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    run(scenario())
+    assert router._get(A).state == "half_open"
+    assert router.is_available(A)
+
+
+def _warm(router: LLMRouter, route: dict, latency: float):
+    for _ in range(router.hedge_min_samples):
+        router.record_success(route, latency)
+
+
+def test_hedge_uses_backup_when_primary_is_slow(run):
+    router = make_router(hedge_enabled=True)
+    _warm(router, A, 0.01)
+
+    async def slow_primary(route):
+        if route is A:
+            await asyncio.sleep(10)
+        return route["model"]
+
+    assert run(asyncio.wait_for(router.call([A, B], slow_primary), 5)) == ("b", B)
+
+
+def test_hedge_cancels_primary_when_caller_is_cancelled(run):
+    router = make_router(hedge_enabled=True)
+    _warm(router, A, 5.0)  # 对冲等待时间较长，调用方在此之前被取消
+
+    async def scenario():
+        cancelled = []
+
+        async def hang(route):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(route["model"])
+                raise
+
+        caller = asyncio.ensure_future(router.call([A, B], hang))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+        return list(cancelled)  # asyncio.run 退出时会取消剩余任务，这里先取快照
+
+    assert run(scenario()) == ["a"]
+
+
+def make_scheduler(queue_timeout: float = 5.0) -> AIScheduler:
+    return AIScheduler(max_concurrency=1, user_concurrency=10, provider_limits={}, queue_timeout=queue_timeout)
+
+
+def test_scheduler_timeout_is_not_a_route_failure(run):
+    router = make_router(failure_threshold=1, hedge_enabled=True)
+    _warm(router, A, 0.01)
+    before = (router._get(A).calls, router._get(A).failures, list(router._get(A).samples))
+    scheduler = make_scheduler(queue_timeout=0.05)
+    calls = []
+
+    async def scenario():
+        blocker = await scheduler.acquire(None, user_id=1)  # 本地名额已占满
+
+        async def track(route, ticket):
+            calls.append(route["model"])
+            return route["model"]
+
+        with pytest.raises(SchedulerTimeout):
+            await router.call([A, B], track, admit=lambda route: scheduler.slot(None, 2))
+        scheduler.release(blocker)
+
+    run(scenario())
+    # 排队超时：不调用上游、不转移 / 对冲到 B、不影响 A 的熔断和统计
+    assert calls == []
+    stats = router._get(A)
+    assert stats.state == "closed" and stats.consecutive_failures == 0
+    assert (stats.calls, stats.failures, list(stats.samples)) == before
+    assert router._get(B).calls == 0
+
+
+def test_queue_wait_not_counted_as_latency(run):
+    router = make_router(hedge_enabled=True)
+    _warm(router, A, 0.01)  # 对冲等待约 10ms
+    scheduler = make_scheduler()
+
+    async def scenario():
+        blocker = await scheduler.acquire(None, user_id=1)
+        asyncio.get_running_loop().call_later(0.2, scheduler.release, blocker)
+
+        async def quick(route, ticket):
+            return route["model"]
+
+        return await asyncio.wait_for(
+            router.call([A, B], quick, admit=lambda route: scheduler.slot(None, 2)), 5
+        )
+
+    # 排队 200ms 远超对冲等待时间，但计时从获得名额开始：不对冲，由 A 返回
+    assert run(scenario()) == ("a", A)
+    assert router._get(B).calls == 0
+    assert max(router._get(A).samples) < 0.1
@@ -0,0 +1,90 @@
+"""监控采集流水线：去重窗口，保存失败时释放去重键（替换 Redis 客户端和监控消息存储）"""
+import pytest
+
+from app.services import monitor_pipeline as pipeline_module
+from app.services.monitor_pipeline import MonitorPipeline, _UserConfig
+
+CONTENT = "本周例会纪要：确定下个版本的发布时间为月底，测试环境下周一开始冻结，请各组在周五之前提交各自负责模块的变更说明和回归测试结果。"
+
+
+class FakeRedis:
+    def __init__(self):
+        self.keys = set()
+
+    async def set_nx_many(self, keys, value, ex):
+        fresh = [key not in self.keys for key in keys]
+        self.keys.update(keys)
+        return fresh
+
+    async def delete(self, *keys):
+        self.keys.difference_update(keys)
+
+
+class FakeMonitorService:
+    def __init__(self):
+        self.fail = False
+        self.messages = []
+
+    async def add_messages(self, user_id, items):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.messages.extend(items)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(pipeline_module, "redis_client", fake)
+    return fake
+
+
+@pytest.fixture
+def store(monkeypatch):
+    fake = FakeMonitorService()
+    monkeypatch.setattr(pipeline_module, "monitor_service", fake)
+    return fake
+
+
+@pytest.fixture
+def pipeline(redis, store):
+    return MonitorPipeline()
+
+
+def config(auto_save: bool = False) -> _UserConfig:
+    config = _UserConfig(None)
+    config.auto_save = auto_save
+    return config
+
+
+def test_duplicates_within_window(run, pipeline, store):
+    run(pipeline._process_user(1, [{"content": CONTENT}, {"content": CONTENT + "  "}], config()))
+    run(pipeline._process_user(1, [{"content": CONTENT}], config()))
+    assert len(store.messages) == 1
+    assert pipeline.stats["duplicate"] == 2
+    # 其他用户不受影响
+    run(pipeline._process_user(2, [{"content": CONTENT}], config()))
+    assert len(store.messages) == 2
+
+
+def test_failed_store_releases_dedup_keys(run, pipeline, redis, store):
+    store.fail = True
+    with pytest.raises(ConnectionError):
+        run(pipeline._process_user(1, [{"content": CONTENT}], config()))
+    assert redis.keys == set()
+
+    # 重新提交时不会被当作重复
+    store.fail = False
+    run(pipeline._process_user(1, [{"content": CONTENT}], config()))
+    assert len(store.messages) == 1
+    assert pipeline.stats["duplicate"] == 0
+
+
+def test_failed_save_releases_dedup_keys(run, pipeline, redis, store, monkeypatch):
+    async def broken_save(user_id, candidates):
+        raise RuntimeError("embedding failed")
+
+    monkeypatch.setattr(pipeline, "_save_knowledge", broken_save)
+    with pytest.raises(RuntimeError):
+        run(pipeline._process_user(1, [{"content": CONTENT}], config(auto_save=True)))
+    assert redis.keys == set()
+    assert store.messages == []
@@ -0,0 +1,89 @@
+"""监控消息存储：状态单独存储，更新状态不改动消息 JSON（替换 Redis 客户端）"""
+import json
+
+import pytest
+
+from app.services import monitor_service as service_module
+from app.services.monitor_service import MonitorService
+
+
+class FakeRedis:
+    """按脚本模拟 _ADD / _UPDATE_STATUS 的效果（不含裁剪）"""
+
+    def __init__(self):
+        self.hashes = {}
+        self.zsets = {}
+
+    async def eval(self, script, keys, args):
+        messages, statuses, index = keys[0], keys[1], keys[2]
+        if script == service_module._ADD:
+            message_id, raw, score, status = args[0], args[1], args[2], args[3]
+            self.hashes.setdefault(messages, {})[message_id] = raw
+            self.hashes.setdefault(statuses, {})[message_id] = status
+            self.zsets.setdefault(index, {})[message_id] = score
+            self.zsets.setdefault(f"{index}:{status}", {})[message_id] = score
+            return 1
+        if script == service_module._UPDATE_STATUS:
+            message_id, status = args
+            raw = self.hashes.get(messages, {}).get(message_id)
+            if raw is None:
+                return None
+            score = self.zsets[index][message_id]
+            for key in keys[3:]:
+                self.zsets.setdefault(key, {}).pop(message_id, None)
+            self.zsets[f"{index}:{status}"][message_id] = score
+            self.hashes[statuses][message_id] = status
+            return raw
+        raise AssertionError("unexpected script")
+
+    async def eval_many(self, script, keys, args_list):
+        return [await self.eval(script, keys, args) for args in args_list]
+
+    async def zrevrange(self, key, start, end):
+        ordered = sorted(self.zsets.get(key, {}), key=self.zsets.get(key, {}).get, reverse=True)
+        return ordered[start:end + 1]
+
+    async def zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    async def hmget(self, key, fields):
+        values = self.hashes.get(key, {})
+        return [values.get(f) for f in fields]
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(service_module, "redis_client", fake)
+    return fake
+
+
+def test_status_update_keeps_message_json(run, redis):
+    service = MonitorService()
+    item = run(service.add_message(1, "wechat", "内容", extra={"keywords": [], "knowledgeId": None}))
+    raw_before = redis.hashes["monitor:msg:1"][item["id"]]
+
+    updated = run(service.update_status(1, item["id"], "ignored"))
+    assert updated["status"] == "ignored"
+    assert updated["keywords"] == []
+    # 消息 JSON 没有被重新编码
+    assert redis.hashes["monitor:msg:1"][item["id"]] == raw_before
+
+    listed = run(service.list_messages(1))["items"]
+    assert listed[0]["status"] == "ignored" and listed[0]["keywords"] == []
+    assert run(service.list_messages(1, "ignored"))["total"] == 1
+    assert run(service.list_messages(1, "pending"))["total"] == 0
+    assert run(service.update_status(1, "missing", "saved")) is None
+
+
+def test_legacy_messages(run, redis):
+    service = MonitorService()
+    item = run(service.add_message(1, "wechat", "内容"))
+    # 本次改动之前的数据：没有状态哈希，且经 cjson 重新编码过（空列表变成 {}）
+    legacy = {**item, "status": "saved", "keywords": {}}
+    redis.hashes["monitor:msg:1"][item["id"]] = json.dumps(legacy, ensure_ascii=False)
+    del redis.hashes["monitor:msg:status:1"][item["id"]]
+
+    listed = run(service.list_messages(1))["items"][0]
+    assert listed["status"] == "saved"
+    assert listed["keywords"] == []
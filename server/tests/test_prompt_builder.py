@@ -0,0 +1,89 @@
+"""提示词预算：编码表在线程中加载、裁剪结果不超过预算（替换 tiktoken，不下载编码表）"""
+import asyncio
+import threading
+
+import pytest
+
+from app.services import prompt_builder as builder_module
+from app.services.prompt_builder import PromptBuilder
+
+
+class FakeEncoding:
+    def encode(self, text, disallowed_special=()):
+        return list(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+class FakeTiktoken:
+    def __init__(self):
+        self.loads = []
+
+    def encoding_name_for_model(self, model):
+        if model == "gpt-4o":
+            return "o200k_base"
+        raise KeyError(model)
+
+    def get_encoding(self, name):
+        self.loads.append((name, threading.current_thread() is threading.main_thread()))
+        return FakeEncoding()
+
+
+@pytest.fixture
+def fake_tiktoken(monkeypatch):
+    fake = FakeTiktoken()
+    monkeypatch.setattr(builder_module, "tiktoken", fake)
+    monkeypatch.setattr(builder_module, "_encodings", {})
+    builder_module._encoding_name.cache_clear()
+    yield fake
+    builder_module._encoding_name.cache_clear()
+
+
+def test_encoding_loaded_off_loop(run, fake_tiktoken):
+    builder = PromptBuilder()
+    # 未加载前按估算计数，不在事件循环中下载
+    assert builder_module._encoding("glm-4.5-flash") is None
+    assert fake_tiktoken.loads == []
+
+    async def warm_concurrently():
+        await asyncio.gather(*(builder.warm(["glm-4.5-flash", "qwen-turbo"]) for _ in range(5)))
+
+    run(warm_concurrently())
+    # 两个模型都映射到 cl100k_base：只加载一次，且在线程中加载
+    assert fake_tiktoken.loads == [("cl100k_base", False)]
+    assert builder.count("abcdef", "qwen-turbo") == 6
+    assert builder.get_stats()["encodings"] == ["cl100k_base"]
+
+    run(builder.warm(["gpt-4o"]))
+    assert [name for name, _ in fake_tiktoken.loads] == ["cl100k_base", "o200k_base"]
+
+
+def test_failed_load_falls_back_to_estimate(run, fake_tiktoken, monkeypatch):
+    def broken(name):
+        fake_tiktoken.loads.append((name, False))
+        raise OSError("offline")
+
+    monkeypatch.setattr(fake_tiktoken, "get_encoding", broken)
+    builder = PromptBuilder()
+    run(builder.warm(["glm-4.5-flash"]))
+    run(builder.warm(["glm-4.5-flash"]))
+    assert len(fake_tiktoken.loads) == 1  # 失败后不再重试
+    assert builder.count("abcdef", "glm-4.5-flash") == builder_module.estimate_tokens("abcdef")
+
+
+def test_fit_stays_within_budget(fake_tiktoken, run):
+    builder = PromptBuilder()
+    run(builder.warm(["glm-4.5-flash"]))
+    model = "glm-4.5-flash"
+    references = [{"title": f"知识{i}", "content": "内容" * 3000, "summary": "摘要"} for i in range(3)]
+    history = [{"role": "user", "content": "历史" * 500} for _ in range(10)]
+    fitted = builder.fit(model, "问题", web="网页" * 5000, references=references, history=history)
+    used = (
+        builder.count(fitted["web"], model)
+        + sum(builder.count(builder_module._reference_line(r["title"], r["content"]), model)
+              for r in fitted["references"])
+        + sum(builder.count(m["content"], model) + builder_module.MESSAGE_OVERHEAD for m in fitted["history"])
+    )
+    assert set(fitted["truncated"]) == {"web", "knowledge", "history"}
+    assert used <= fitted["budget"]
@@ -0,0 +1,126 @@
+"""网页缓存的条件请求：校验值必须发回返回它的地址（替换共享客户端和 Redis 缓存，不访问网络）"""
+import pytest
+
+from app.services.web_scraper import WebScraper
+
+PAGE = "https://example.com/post"
+JINA_PAGE = f"https://r.jina.ai/{PAGE}"
+
+
+class FakeStream:
+    def __init__(self, status_code: int, headers: dict, body: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.charset_encoding = "utf-8"
+        self._body = body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def aiter_bytes(self, chunk_size=None):
+        if self._body:
+            yield self._body
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeClient:
+    def __init__(self, routes):
+        self.routes = routes  # url -> 处理函数(headers) -> FakeStream
+        self.calls = []
+
+    def stream(self, method, url, headers=None, timeout=None):
+        self.calls.append((url, dict(headers or {})))
+        return self.routes[url](headers or {})
+
+
+@pytest.fixture
+def scraper(monkeypatch):
+    scraper = WebScraper()
+    cache = {}
+
+    async def cache_get(digest):
+        return cache.get(digest)
+
+    async def cache_put(digest, entry):
+        cache[digest] = entry
+
+    monkeypatch.setattr(scraper, "_cache_get", cache_get)
+    monkeypatch.setattr(scraper, "_cache_put", cache_put)
+    scraper.cache = cache
+
+    def install(routes):
+        client = FakeClient(routes)
+
+        async def get_client():
+            return client
+
+        monkeypatch.setattr(scraper, "_get_client", get_client)
+        return client
+
+    scraper.install = install
+    return scraper
+
+
+def _expire(scraper):
+    for entry in scraper.cache.values():
+        entry["fetched_at"] = 0
+
+
+def jina(headers):
+    if headers.get("If-None-Match") == '"jina-1"':
+        return FakeStream(304, {}, b"")
+    body = "Title: 文章\nMarkdown Content:\n正文内容".encode("utf-8")
+    return FakeStream(200, {"etag": '"jina-1"'}, body)
+
+
+def test_jina_validators_revalidate_against_jina(run, scraper):
+    client = scraper.install({JINA_PAGE: jina})
+    first = run(scraper.fetch_url(PAGE))
+    assert first["success"] and first["content"] == "正文内容"
+    entry = next(iter(scraper.cache.values()))
+    assert entry["validator_url"] == JINA_PAGE
+
+    _expire(scraper)
+    second = run(scraper.fetch_url(PAGE))
+    assert second["content"] == "正文内容"
+    assert scraper.stats["revalidated"] == 1
+    # 条件请求发给 Jina，而不是带着 Jina 的 ETag 去请求原网页
+    assert client.calls[-1][0] == JINA_PAGE
+    assert client.calls[-1][1]["If-None-Match"] == '"jina-1"'
+    assert all(url != PAGE for url, _ in client.calls)
+
+
+def test_fallback_validators_revalidate_against_origin(run, scraper):
+    def origin(headers):
+        if headers.get("If-Modified-Since") == "Mon, 01 Jan 2024 00:00:00 GMT":
+            return FakeStream(304, {}, b"")
+        body = "<html><head><title>文章</title></head><body><p>原网页正文</p></body></html>".encode("utf-8")
+        return FakeStream(200, {"content-type": "text/html; charset=utf-8",
+                                "last-modified": "Mon, 01 Jan 2024 00:00:00 GMT"}, body)
+
+    client = scraper.install({JINA_PAGE: lambda headers: FakeStream(503, {}, b""), PAGE: origin})
+    assert run(scraper.fetch_url(PAGE))["success"]
+    assert next(iter(scraper.cache.values()))["validator_url"] == PAGE
+
+    _expire(scraper)
+    run(scraper.fetch_url(PAGE))
+    assert scraper.stats["revalidated"] == 1
+    assert client.calls[-1][0] == PAGE
+
+
+def test_entry_without_validator_url_is_refetched(run, scraper):
+    client = scraper.install({JINA_PAGE: jina})
+    run(scraper.fetch_url(PAGE))
+    entry = next(iter(scraper.cache.values()))
+    del entry["validator_url"]  # 旧格式的缓存：不知道校验值来自哪个地址
+
+    _expire(scraper)
+    run(scraper.fetch_url(PAGE))
+    assert scraper.stats["revalidated"] == 0
+    assert scraper.stats["misses"] == 2
+    assert "If-None-Match" not in client.calls[-1][1]